@@ -6,22 +6,56 @@ Handles multi-agent crew orchestration and API endpoints
 
 import os
 import json
+import gzip
+import zlib
+import time
+import uuid
+import base64
+import socket
+import sqlite3
+import heapq
+import hashlib
+import itertools
+import math
+import asyncio
 import logging
-from typing import Optional
-from datetime import datetime
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Hashable, Optional
+from datetime import datetime, timedelta
 from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, wait as wait_futures
 
 # FastAPI & Async
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, Response, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import uvicorn
+import numpy as np
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
 
-# CrewAI
-from crewai import Agent, Task, Crew
-from langchain_community.llms import Ollama
-from langchain_community.embeddings import HuggingFaceEmbeddings
+# LangChain
+# crewai, the Ollama client and the embedding model are imported on first use;
+# together they take seconds to load and are not needed to serve stored campaigns
+from langchain.globals import set_llm_cache
+from langchain_core.caches import BaseCache
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import Generation
+
+if TYPE_CHECKING:
+    from crewai import Task
+
+try:
+    import brotli  # optional; responses fall back to gzip
+except ImportError:
+    brotli = None
 
 # Logging
 logging.basicConfig(level=logging.INFO)
@@ -43,6 +77,14 @@ class CampaignRequest(BaseModel):
     target_audience: str
     content_type: str  # blog_post, social_media, email, ad_copy
     brand_id: Optional[str] = "default"
+    bypass_cache: bool = False  # force fresh LLM calls; results still refresh the cache
+
+class BatchCampaignRequest(BaseModel):
+    campaigns: list[CampaignRequest] = Field(..., min_length=1, max_length=500)
+    concurrency: int = Field(4, ge=1, le=32)
+
+class BrandCheckRequest(BaseModel):
+    text: str
 
 class CampaignResponse(BaseModel):
     campaign_id: str
@@ -51,27 +93,932 @@ class CampaignResponse(BaseModel):
     validations: dict
     agent_feedback: list
     timestamp: str
+    reused: bool = False  # True when this is an earlier campaign's result, not a new generation
+    duplicate_of: Optional[str] = None  # earlier campaign whose result was reused
+    similarity: Optional[float] = None
+
+class QueueFullError(Exception):
+    """Raised when the job queue cannot accept more work"""
+    
+    def __init__(self, message: str, retry_after: int = 30):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class ShuttingDownError(Exception):
+    """Raised when a job is submitted while the server drains"""
+
+class JobCancelledError(Exception):
+    """Raised inside a worker when its job has been cancelled"""
+
+class IdempotencyConflict(Exception):
+    """Raised when an idempotency key is reused for a different request"""
+    status_code = 422
+
+# ==================== Streaming Events ====================
+
+# Set per campaign run; copied into stage threads so LLM callbacks can find them
+_event_sink: contextvars.ContextVar[Optional[Callable[[dict], None]]] = contextvars.ContextVar(
+    "event_sink", default=None
+)
+_current_stage: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "current_stage", default=None
+)
+
+def emit_event(event: str, **data):
+    """Forward a progress event to the listener of the current campaign, if any"""
+    sink = _event_sink.get()
+    if sink is None:
+        return
+    try:
+        sink({"event": event, **data})
+    except Exception as e:
+        logger.warning(f"Dropping {event} event: {str(e)}")
+
+class TokenStreamHandler(BaseCallbackHandler):
+    """Relays Ollama tokens to the campaign event stream"""
+    
+    def on_llm_new_token(self, token: str, **kwargs):
+        emit_event("token", stage=_current_stage.get(), text=token)
+
+token_stream_handler = TokenStreamHandler()
+
+# ==================== Metrics ====================
+
+# Upper bounds in seconds, sized for LLM stages rather than fast HTTP handlers
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def format_labels(names: tuple, values: tuple) -> str:
+    """Render a Prometheus label set, escaping backslashes, quotes and newlines"""
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+class Counter:
+    """Monotonic counter with a fixed set of label names"""
+    
+    kind = "counter"
+    
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{format_labels(self.labels, key)} {value}" for key, value in values]
+
+class Histogram:
+    """Cumulative-bucket histogram with a fixed set of label names"""
+    
+    kind = "histogram"
+    
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+    
+    def samples(self) -> list[str]:
+        with self._lock:
+            series = [(key, list(values)) for key, values in self._series.items()]
+        lines = []
+        for key, values in series:
+            cumulative = 0
+            bucket_labels = self.labels + ("le",)
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(bucket_labels, key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(bucket_labels, key + ('+Inf',))} {values[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {round(values[-2], 6)}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {values[-1]}")
+        return lines
+
+class MetricsRegistry:
+    """Metrics rendered in the Prometheus text exposition format
+    
+    Counters and histograms are updated inline; collectors report point-in-time
+    values (queue depth, cache counters) only when scraped.
+    """
+    
+    def __init__(self):
+        self._metrics: list = []
+        self._collectors: list[Callable[[], list[tuple]]] = []
+    
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+    
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+    
+    def collector(self, collect: Callable[[], list[tuple]]):
+        """Register ``collect() -> [(name, kind, help, [(labels, value), ...]), ...]``"""
+        self._collectors.append(collect)
+        return collect
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for collect in self._collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {str(e)}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{format_labels(tuple(labels), tuple(labels.values()))} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+stage_duration = metrics.histogram(
+    "copilot_stage_duration_seconds", "Wall time of each campaign stage", ("stage",)
+)
+stage_failures = metrics.counter(
+    "copilot_stage_failures_total", "Campaign stages that raised", ("stage",)
+)
+llm_prompt_tokens = metrics.counter(
+    "copilot_llm_prompt_tokens_total", "Prompt tokens evaluated by Ollama", ("model", "stage")
+)
+llm_completion_tokens = metrics.counter(
+    "copilot_llm_completion_tokens_total", "Tokens generated by Ollama", ("model", "stage")
+)
+llm_generation_seconds = metrics.histogram(
+    "copilot_llm_generation_seconds",
+    "Ollama generation time per call; completion tokens over its sum gives tokens/s",
+    ("model", "stage")
+)
+http_request_duration = metrics.histogram(
+    "copilot_http_request_duration_seconds",
+    "Time to response headers per endpoint",
+    ("method", "route", "status")
+)
+
+# ==================== LLM Cache ====================
+
+LLM_CACHE_PATH = Path(os.getenv("LLM_CACHE_PATH", "cache/llm_cache.sqlite"))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "512"))
+LLM_CACHE_DISK_ENTRIES = int(os.getenv("LLM_CACHE_DISK_ENTRIES", "20000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+
+_cache_bypass: contextvars.ContextVar[bool] = contextvars.ContextVar("cache_bypass", default=False)
+
+class TwoTierLLMCache(BaseCache):
+    """LangChain LLM cache: in-memory LRU in front of a SQLite store, both with TTL"""
+    
+    def __init__(self, path: Path, memory_entries: int, disk_entries: int, ttl: float):
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl = ttl
+        self._memory: OrderedDict[str, tuple[float, list]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "evictions": 0}
+        
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+        self._db.commit()
+    
+    @staticmethod
+    def make_key(prompt: str, llm_string: str) -> str:
+        """Hash the client's identity (see ``llm_identity``) and the whitespace-normalized prompt"""
+        normalized = "\n".join(line.rstrip() for line in prompt.strip().splitlines())
+        return hashlib.sha256(f"{llm_string}\x00{normalized}".encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def cacheable(llm_string: str) -> bool:
+        # LangChain builds llm_string from the client's identifying params; clients that
+        # do not identify their model, options and system prompt must not share entries
+        return "llm_identity" in llm_string
+    
+    def lookup(self, prompt: str, llm_string: str) -> Optional[list]:
+        if _cache_bypass.get() or not self.cacheable(llm_string):
+            with self._lock:
+                self.counters["bypassed"] += 1
+            return None
+        
+        key = self.make_key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[0] < self.ttl:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return self._replay(entry[1])
+            
+            row = self._db.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row and now - row[1] < self.ttl:
+                self._db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                self._db.commit()
+                generations = [Generation(**g) for g in json.loads(row[0])]
+                self._remember(key, row[1], generations)
+                self.counters["disk_hits"] += 1
+                return self._replay(generations)
+            
+            if row:
+                self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._db.commit()
+            self._memory.pop(key, None)
+            self.counters["misses"] += 1
+        return None
+    
+    def update(self, prompt: str, llm_string: str, return_val: list) -> None:
+        if not self.cacheable(llm_string):
+            return
+        key = self.make_key(prompt, llm_string)
+        now = time.time()
+        value = json.dumps([
+            {"text": g.text, "generation_info": g.generation_info} for g in return_val
+        ])
+        with self._lock:
+            self._remember(key, now, list(return_val))
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self._db.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+            excess = self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.disk_entries
+            if excess > 0:
+                self._db.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)",
+                    (excess,)
+                )
+                self.counters["evictions"] += excess
+            self._db.commit()
+    
+    def clear(self, **kwargs) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM llm_cache")
+            self._db.commit()
+    
+    def stats(self) -> dict:
+        with self._lock:
+            disk_entries = self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            counters = dict(self.counters)
+        lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        return {
+            **counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": disk_entries,
+            "ttl_seconds": self.ttl
+        }
+    
+    def _remember(self, key: str, created_at: float, generations: list):
+        self._memory[key] = (created_at, generations)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+    
+    def _replay(self, generations: list) -> list:
+        # Cached calls skip Ollama, so echo the text for anyone streaming this stage
+        for generation in generations:
+            emit_event("token", stage=_current_stage.get(), text=generation.text, cached=True)
+        return generations
+
+llm_cache = TwoTierLLMCache(
+    path=LLM_CACHE_PATH,
+    memory_entries=LLM_CACHE_MEMORY_ENTRIES,
+    disk_entries=LLM_CACHE_DISK_ENTRIES,
+    ttl=LLM_CACHE_TTL
+)
+set_llm_cache(llm_cache)
+
+# ==================== Admission Control ====================
+
+# Lower rank is served first: UI requests jump ahead of queued batch work
+PRIORITIES = {"interactive": 0, "batch": 1}
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "2"))
+
+_request_priority: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "request_priority", default="interactive"
+)
+
+llm_gate_wait = metrics.histogram(
+    "copilot_llm_gate_wait_seconds", "Time Ollama calls waited for an admission slot", ("priority",)
+)
+job_queue_wait = metrics.histogram(
+    "copilot_job_queue_wait_seconds", "Time jobs waited in the queue for a worker", ("priority",)
+)
+
+class WaitStats:
+    """Rolling window of wait times, in seconds"""
+    
+    def __init__(self, size: int = 1000):
+        self._samples: deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+    
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+    
+    def summary(self) -> dict:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return {"count": self.count, "avg": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+        return {
+            "count": self.count,
+            "avg": round(sum(samples) / len(samples), 4),
+            "p50": round(samples[len(samples) // 2], 4),
+            "p95": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+            "max": round(samples[-1], 4)
+        }
+
+class PriorityGate:
+    """Concurrency limiter that admits waiters by priority, then arrival order"""
+    
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.wait_stats = WaitStats()
+        self._active = 0
+        self._waiters: list[tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+    
+    def acquire(self, priority: str = "interactive"):
+        started = time.monotonic()
+        ticket = (PRIORITIES.get(priority, len(PRIORITIES)), next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            while self._active >= self.limit or self._waiters[0] != ticket:
+                self._cond.wait()
+            heapq.heappop(self._waiters)
+            self._active += 1
+            # The next waiter may also fit if more than one slot is free
+            self._cond.notify_all()
+        waited = time.monotonic() - started
+        self.wait_stats.observe(waited)
+        llm_gate_wait.observe(waited, priority=priority)
+    
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+    
+    def stats(self) -> dict:
+        with self._cond:
+            active, waiting = self._active, len(self._waiters)
+        return {
+            "limit": self.limit,
+            "active": active,
+            "waiting": waiting,
+            "wait_seconds": self.wait_stats.summary()
+        }
+
+llm_gate = PriorityGate(LLM_MAX_CONCURRENCY)
 
 # ==================== LLM Configuration ====================
 
-def get_llm():
-    """Initialize local Ollama LLM"""
-    return Ollama(
-        model="mistral:7b",
-        base_url="http://localhost:11434"
-    )
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "mistral:7b")
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "16"))
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# One keep-alive connection pool to the Ollama server shared by every client
+ollama_session = requests.Session()
+ollama_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=OLLAMA_POOL_SIZE))
+ollama_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=OLLAMA_POOL_SIZE))
+
+class OllamaServerError(ValueError):
+    """Ollama answered with an error status; 404 means the model is not pulled
+    
+    ``status_code`` is Ollama's own status, not one to send to our clients.
+    """
+    
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+def llm_identity(params: dict) -> str:
+    """Everything besides the prompt that shapes an Ollama answer, as canonical JSON"""
+    options = {k: v for k, v in (params.get("options") or {}).items() if v is not None and k != "stop"}
+    return json.dumps({
+        "model": params.get("model"),
+        "format": params.get("format"),
+        "system": params.get("system"),
+        "template": params.get("template"),
+        "options": options,
+        "tier": params.get("tier")
+    }, sort_keys=True)
+
+class PooledOllamaMixin:
+    """Sends Ollama requests over the shared keep-alive session
+    
+    Kept separate from the Ollama class so it can be defined without importing
+    langchain_community; see ``pooled_ollama_class``.
+    """
+    
+    @property
+    def _identifying_params(self) -> dict:
+        # BaseLLM's empty identity shadows Ollama's, so LangChain's cache key would hold
+        # only the client type; key on the model, options, system prompt and tier instead
+        tier = (self.metadata or {}).get("model_tier")
+        return {"llm_identity": llm_identity({**self._default_params, "tier": tier})}
+    
+    def _create_stream(self, api_url: str, payload: dict, stop: Optional[list[str]] = None, **kwargs):
+        # Mirrors Ollama._create_stream, which otherwise opens a new connection per call
+        if self.stop is not None and stop is not None:
+            raise ValueError("`stop` found in both the input and default params.")
+        stop = self.stop if self.stop is not None else (stop or [])
+        
+        params = self._default_params
+        for key in self._default_params:
+            if key in kwargs:
+                params[key] = kwargs[key]
+        if "options" in kwargs:
+            params["options"] = kwargs["options"]
+        else:
+            params["options"] = {
+                **params["options"],
+                "stop": stop,
+                **{k: v for k, v in kwargs.items() if k not in self._default_params}
+            }
+        
+        if payload.get("messages"):
+            request_payload = {"messages": payload.get("messages", []), **params}
+        else:
+            request_payload = {
+                "prompt": payload.get("prompt"),
+                "images": payload.get("images", []),
+                **params
+            }
+        # Keep the model, and with it the server's prompt KV cache, resident between calls
+        request_payload["keep_alive"] = OLLAMA_KEEP_ALIVE
+        
+        # Refuse at once while Ollama is known to be down instead of waiting out a timeout
+        trial = ollama_breaker.before_call()
+        # Hold an admission slot until the whole streamed response has been read
+        llm_gate.acquire(_request_priority.get())
+        try:
+            response = ollama_session.post(
+                url=api_url,
+                headers={
+                    "Content-Type": "application/json",
+                    **(self.headers if isinstance(self.headers, dict) else {})
+                },
+                json=request_payload,
+                stream=True,
+                timeout=(OLLAMA_CONNECT_TIMEOUT, self.timeout)
+            )
+            response.encoding = "utf-8"
+            if response.status_code == 404:
+                raise OllamaServerError(
+                    404,
+                    f"Ollama call failed with status code 404. "
+                    f"Maybe you need to pull the model: ollama pull {self.model}"
+                )
+            if response.status_code != 200:
+                raise OllamaServerError(
+                    response.status_code,
+                    f"Ollama call failed with status code {response.status_code}. "
+                    f"Details: {response.text}"
+                )
+        except Exception as e:
+            llm_gate.release()
+            ollama_breaker.record(e, trial)
+            raise
+        return self._read_and_release(response, trial)
+    
+    def _read_and_release(self, response, trial: Optional[int] = None):
+        error = None
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                # Only the final chunk carries token counts; skip parsing the rest
+                if line and '"eval_count"' in line:
+                    self._record_usage(json.loads(line))
+                yield line
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            response.close()
+            llm_gate.release()
+            ollama_breaker.record(error, trial)
+    
+    def _record_usage(self, chunk: dict):
+        labels = {"model": self.model, "stage": _current_stage.get() or "none"}
+        llm_prompt_tokens.inc(chunk.get("prompt_eval_count", 0), **labels)
+        llm_completion_tokens.inc(chunk.get("eval_count", 0), **labels)
+        if chunk.get("eval_duration"):
+            llm_generation_seconds.observe(chunk["eval_duration"] / 1e9, **labels)
+
+_pooled_ollama_class = None
+
+def pooled_ollama_class() -> type:
+    """Import the Ollama client on first use and combine it with the pooled transport"""
+    global _pooled_ollama_class
+    if _pooled_ollama_class is None:
+        from langchain_community.llms import Ollama
+        _pooled_ollama_class = type("PooledOllama", (PooledOllamaMixin, Ollama), {})
+    return _pooled_ollama_class
+
+_llm_clients: dict[tuple[str, Optional[str], Optional[str]], object] = {}
+_llm_clients_lock = threading.Lock()
+
+def get_llm(model: str = OLLAMA_MODEL, system: Optional[str] = None, tier: Optional[str] = None):
+    """Return the shared local Ollama LLM client for a model, optional system prompt and tier
+    
+    The tier is part of the client's cache identity, so tiers never share cached answers.
+    """
+    key = (model, system, tier)
+    with _llm_clients_lock:
+        if key not in _llm_clients:
+            _llm_clients[key] = pooled_ollama_class()(
+                model=model,
+                base_url=OLLAMA_BASE_URL,
+                system=system,
+                metadata={"model_tier": tier},
+                callbacks=[token_stream_handler]
+            )
+        return _llm_clients[key]
+
+def discard_llm_clients(system: str):
+    """Forget clients built for a system prompt that is no longer in use"""
+    with _llm_clients_lock:
+        for key in [key for key in _llm_clients if key[1] == system]:
+            del _llm_clients[key]
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "distilbert-base-uncased")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+
+_embedding_model = None
+_embedding_model_lock = threading.Lock()
 
 def get_embedding_model():
-    """Initialize embeddings for semantic search"""
-    return HuggingFaceEmbeddings(
-        model_name="distilbert-base-uncased",
-        model_kwargs={"device": "cpu"}
-    )
+    """Return the shared embedding model for semantic scoring and search"""
+    global _embedding_model
+    with _embedding_model_lock:
+        if _embedding_model is None:
+            # Pulls in torch and transformers
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+            _embedding_model = HuggingFaceEmbeddings(
+                model_name=EMBEDDING_MODEL,
+                model_kwargs={"device": "cpu"},
+                encode_kwargs={"batch_size": EMBEDDING_BATCH_SIZE}
+            )
+        return _embedding_model
+
+def embed_texts(texts: list[str]) -> np.ndarray:
+    """Encode texts in one batch as L2-normalized rows"""
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    vectors = np.asarray(get_embedding_model().embed_documents(texts), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+# ==================== Model Routing ====================
+
+AGENT_NAMES = ("content_creator", "brand_manager", "compliance_officer", "design_validator", "optimizer")
+
+def parse_assignments(value: str) -> dict[str, str]:
+    """Parse ``key=value,key=value`` settings, ignoring malformed items"""
+    assignments = {}
+    for item in value.split(","):
+        key, sep, target = item.partition("=")
+        if sep and key.strip() and target.strip():
+            assignments[key.strip()] = target.strip()
+    return assignments
+
+# Tier name -> Ollama model; point the small tier at a 1-3B model to make reviews cheap
+MODEL_TIERS = {
+    "large": OLLAMA_MODEL,
+    "small": os.getenv("OLLAMA_SMALL_MODEL", OLLAMA_MODEL),
+    **parse_assignments(os.getenv("MODEL_TIERS", ""))
+}
+# Agent -> tier; creative work stays on the large model, checklist-style reviews go small
+AGENT_MODEL_TIERS = {
+    "content_creator": "large",
+    "brand_manager": "small",
+    "compliance_officer": "small",
+    "design_validator": "small",
+    "optimizer": "large",
+    **parse_assignments(os.getenv("AGENT_MODEL_TIERS", ""))
+}
+# <content_type>.<agent> -> tier, e.g. social_media.content_creator=small
+CONTENT_TYPE_MODEL_TIERS = parse_assignments(os.getenv("CONTENT_TYPE_MODEL_TIERS", ""))
+
+tier_stage_duration = metrics.histogram(
+    "copilot_tier_stage_duration_seconds", "Wall time of LLM stages by model tier", ("tier", "model")
+)
+
+class ModelRouter:
+    """Routes each agent to a model tier, per content type when configured
+    
+    A tier name that is not in ``tiers`` is taken to be a model name, so an override
+    can point an agent straight at a model. Stage latency is tracked per tier.
+    """
+    
+    def __init__(self, tiers: dict[str, str], agent_tiers: dict[str, str], content_type_tiers: dict[str, str]):
+        self.tiers = tiers
+        self.agent_tiers = agent_tiers
+        self.content_type_tiers = content_type_tiers
+        self._latency: dict[tuple[str, str], list[float]] = {}  # (tier, model) -> [stages, seconds]
+        self._lock = threading.Lock()
+    
+    def route(self, agent: str, content_type: Optional[str] = None) -> tuple[str, str]:
+        """(tier, model) for an agent"""
+        tier = self.content_type_tiers.get(f"{content_type}.{agent}") or self.agent_tiers.get(agent, "large")
+        return tier, self.tiers.get(tier, tier)
+    
+    def routes(self, content_type: Optional[str] = None) -> dict[str, tuple[str, str]]:
+        return {agent: self.route(agent, content_type) for agent in AGENT_NAMES}
+    
+    def models(self) -> list[str]:
+        """Every model some agent can be routed to"""
+        tiers = {*self.agent_tiers.values(), *self.content_type_tiers.values()}
+        return sorted({self.tiers.get(tier, tier) for tier in tiers})
+    
+    def observe(self, tier: str, model: str, seconds: float):
+        tier_stage_duration.observe(seconds, tier=tier, model=model)
+        with self._lock:
+            totals = self._latency.setdefault((tier, model), [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+    
+    def stats(self) -> dict:
+        with self._lock:
+            latency = {key: list(totals) for key, totals in self._latency.items()}
+        return {
+            "tiers": self.tiers,
+            "agents": {agent: self.route(agent)[0] for agent in AGENT_NAMES},
+            "content_type_overrides": self.content_type_tiers,
+            "latency": [
+                {"tier": tier, "model": model, "stages": stages, "avg_seconds": round(seconds / stages, 3)}
+                for (tier, model), (stages, seconds) in sorted(latency.items())
+            ]
+        }
+
+model_router = ModelRouter(MODEL_TIERS, AGENT_MODEL_TIERS, CONTENT_TYPE_MODEL_TIERS)
+
+# ==================== Ollama Health ====================
+
+# Consecutive failed calls that open the breaker, and how long it stays open
+OLLAMA_BREAKER_FAILURES = int(os.getenv("OLLAMA_BREAKER_FAILURES", "5"))
+OLLAMA_BREAKER_COOLDOWN = float(os.getenv("OLLAMA_BREAKER_COOLDOWN", "30"))
+# Half-open: calls let through at once, and successes needed to close again
+OLLAMA_BREAKER_TRIAL_CALLS = int(os.getenv("OLLAMA_BREAKER_TRIAL_CALLS", "2"))
+OLLAMA_BREAKER_RECOVERY_CALLS = int(os.getenv("OLLAMA_BREAKER_RECOVERY_CALLS", "3"))
+# Background probe of the model server; an interval of 0 turns it off
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_TIMEOUT", "2"))
+# Generation may legitimately take minutes, but connecting should not
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+
+class OllamaUnavailableError(Exception):
+    """Raised instead of calling Ollama while the circuit breaker is open"""
+    status_code = 503
+    
+    def __init__(self, message: str, retry_after: int = 30):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+breaker_transitions = metrics.counter(
+    "copilot_ollama_breaker_transitions_total", "Circuit breaker state changes by new state", ("state",)
+)
+breaker_rejections = metrics.counter(
+    "copilot_ollama_breaker_rejections_total", "LLM calls and jobs refused while the breaker was open"
+)
+
+class CircuitBreaker:
+    """Fails LLM calls fast while Ollama is down, then ramps back up through trial calls
+    
+    closed: calls flow and consecutive failures are counted.
+    open: calls are refused until the cooldown ends or the health probe sees the server.
+    half_open: up to ``trial_calls`` calls run at once; ``recovery_calls`` successes
+    close the breaker, any failure opens it again.
+    """
+    
+    def __init__(self, failure_threshold: int, cooldown: float, trial_calls: int, recovery_calls: int):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.trial_calls = trial_calls
+        self.recovery_calls = recovery_calls
+        self.state = "closed"
+        self.last_error: Optional[str] = None
+        self.changed_at = datetime.now().isoformat()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trials = 0
+        self._successes = 0
+        self._round = 0  # tells trial calls from one half-open period apart from the next
+        self._lock = threading.Lock()
+    
+    def _transition(self, state: str):
+        if state == "open":
+            self._opened_at = time.monotonic()
+        elif state == "half_open":
+            self._round += 1
+            self._trials = self._successes = 0
+        self._failures = 0
+        if state == self.state:
+            return
+        logger.warning(f"Ollama circuit breaker {self.state} -> {state}" + (f": {self.last_error}" if state == "open" else ""))
+        self.state = state
+        self.changed_at = datetime.now().isoformat()
+        breaker_transitions.inc(state=state)
+    
+    def _refresh(self):
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+            self._transition("half_open")
+    
+    def _retry_after(self) -> int:
+        if self.state != "open":
+            return 1
+        return max(1, math.ceil(self.cooldown - (time.monotonic() - self._opened_at)))
+    
+    def _refuse(self, retry_after: int):
+        breaker_rejections.inc()
+        raise OllamaUnavailableError(
+            f"LLM backend unavailable at {OLLAMA_BASE_URL} ({self.last_error or 'recent calls failed'})",
+            retry_after=retry_after
+        )
+    
+    def check(self):
+        """Raise OllamaUnavailableError while open; used to refuse work before it is queued"""
+        with self._lock:
+            self._refresh()
+            if self.state != "open":
+                return
+            retry_after = self._retry_after()
+        self._refuse(retry_after)
+    
+    def before_call(self) -> Optional[int]:
+        """Admit one call or raise; returns a trial token to hand back to ``record``"""
+        with self._lock:
+            self._refresh()
+            if self.state == "closed":
+                return None
+            if self.state == "half_open" and self._trials < self.trial_calls:
+                self._trials += 1
+                return self._round
+            retry_after = self._retry_after()
+        self._refuse(retry_after)
+    
+    def record(self, error: Optional[Exception], trial: Optional[int] = None):
+        """Count a finished call; only lost connections, timeouts, 429 and 5xx count against the server"""
+        failed = error is not None and is_transient_error(error)
+        with self._lock:
+            if trial is not None and trial == self._round and self.state == "half_open":
+                self._trials -= 1
+            if failed:
+                self.last_error = f"{type(error).__name__}: {str(error)[:200]}"
+                self._failures += 1
+                if self.state == "half_open" or (self.state == "closed" and self._failures >= self.failure_threshold):
+                    self._transition("open")
+            elif self.state == "half_open":
+                self._successes += 1
+                if self._successes >= self.recovery_calls:
+                    self._transition("closed")
+            elif self.state == "closed":
+                self._failures = 0
+    
+    def observe_probe(self, healthy: bool, error: Optional[str] = None):
+        """Open at once when the server is unreachable; start trial calls once it is back"""
+        with self._lock:
+            if not healthy:
+                self.last_error = error
+                self._transition("open")
+            elif self.state == "open":
+                self._transition("half_open")
+    
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._refresh()
+            return {
+                "state": self.state,
+                "since": self.changed_at,
+                "consecutive_failures": self._failures,
+                "retry_after": self._retry_after() if self.state == "open" else None,
+                "last_error": self.last_error
+            }
+
+ollama_breaker = CircuitBreaker(
+    OLLAMA_BREAKER_FAILURES, OLLAMA_BREAKER_COOLDOWN, OLLAMA_BREAKER_TRIAL_CALLS, OLLAMA_BREAKER_RECOVERY_CALLS
+)
+
+class OllamaHealthProbe:
+    """Polls the Ollama server on a background thread and caches the last result
+    
+    Health checks read the cached result, so they never wait on the model server.
+    """
+    
+    def __init__(self, interval: float, timeout: float, breaker: CircuitBreaker):
+        self.interval = interval
+        self.timeout = timeout
+        self.breaker = breaker
+        self._last = {"status": "unknown", "checked_at": None}
+        self.on_recover: list[Callable[[], None]] = []  # called when Ollama is reachable again
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+    
+    def check(self) -> dict:
+        """Ask Ollama which models it has; lists routed models it is missing"""
+        started = time.monotonic()
+        try:
+            response = ollama_session.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=self.timeout)
+            if response.status_code != 200:
+                raise OllamaServerError(response.status_code, f"/api/tags returned {response.status_code}")
+            available = {model["name"] for model in response.json().get("models", [])}
+            result = {
+                "status": "up",
+                "missing_models": [
+                    model for model in model_router.models()
+                    if model not in available and f"{model}:latest" not in available
+                ]
+            }
+        except (requests.RequestException, OllamaServerError, ValueError) as e:
+            result = {"status": "down", "error": f"{type(e).__name__}: {str(e)[:200]}"}
+        result["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+        result["checked_at"] = datetime.now().isoformat()
+        with self._lock:
+            recovered = result["status"] == "up" and self._last["status"] != "up"
+            self._last = result
+        self.breaker.observe_probe(result["status"] == "up", result.get("error"))
+        if recovered:
+            for callback in self.on_recover:
+                callback()
+        return result
+    
+    def _loop(self):
+        while not self._stop.is_set():
+            self.check()
+            self._stop.wait(self.interval)
+    
+    def start(self) -> bool:
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="ollama-health", daemon=True)
+        self._thread.start()
+        return True
+    
+    def stop(self):
+        self._stop.set()
+    
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._last)
+
+ollama_probe = OllamaHealthProbe(OLLAMA_HEALTH_INTERVAL, OLLAMA_HEALTH_TIMEOUT, ollama_breaker)
 
 # ==================== Agent Definitions ====================
 
 def create_content_creator_agent(llm):
     """Content Creator Agent - Generates initial creative content"""
+    from crewai import Agent
+    
     return Agent(
         role="Creative Content Writer",
         goal="Generate compelling, brand-aligned creative content that resonates with target audience",
@@ -85,6 +1032,8 @@ def create_content_creator_agent(llm):
 
 def create_brand_consistency_agent(llm):
     """Brand Consistency Agent - Ensures content aligns with brand guidelines"""
+    from crewai import Agent
+    
     return Agent(
         role="Brand Consistency Manager",
         goal="Ensure all content maintains brand voice, tone, and visual language consistency",
@@ -97,6 +1046,8 @@ def create_brand_consistency_agent(llm):
 
 def create_compliance_officer_agent(llm):
     """Compliance Officer Agent - Reviews for legal and ethical issues"""
+    from crewai import Agent
+    
     return Agent(
         role="Legal & Compliance Officer",
         goal="Identify legal risks, copyright issues, and unethical claims in content",
@@ -109,6 +1060,8 @@ def create_compliance_officer_agent(llm):
 
 def create_design_validator_agent(llm):
     """Design Validator Agent - Provides design recommendations"""
+    from crewai import Agent
+    
     return Agent(
         role="Design & Visual Specialist",
         goal="Recommend visual elements, design patterns, and media that enhance content appeal",
@@ -121,6 +1074,8 @@ def create_design_validator_agent(llm):
 
 def create_optimizer_agent(llm):
     """Optimizer Agent - Final refinement and SEO optimization"""
+    from crewai import Agent
+    
     return Agent(
         role="Content Optimizer",
         goal="Refine content for maximum impact, readability, SEO, and engagement",
@@ -131,10 +1086,356 @@ def create_optimizer_agent(llm):
         allow_delegation=False
     )
 
+# ==================== Brand Rules ====================
+
+BRAND_RULES_FAIL_FAST = os.getenv("BRAND_RULES_FAIL_FAST", "false").lower() == "true"
+BRAND_RULES_SKIP_LLM = os.getenv("BRAND_RULES_SKIP_LLM", "false").lower() == "true"
+# Carry brand guidelines in a per-brand system prompt so reviews share a cached prefix
+BRAND_PREFIX_CACHE = os.getenv("BRAND_PREFIX_CACHE", "true").lower() == "true"
+BRAND_RULES_MIN_COVERAGE = float(os.getenv("BRAND_RULES_MIN_COVERAGE", "1.0"))
+
+class RuleMatch(BaseModel):
+    term: str
+    start: int
+    end: int
+
+class BrandRuleReport(BaseModel):
+    prohibited_hits: list[RuleMatch]
+    keyword_hits: list[RuleMatch]
+    missing_keywords: list[str]
+    keyword_coverage: float
+    verdict: str  # pass, review, fail
+    
+    def describe(self) -> str:
+        """Plain-text summary for prompts and skipped reviews"""
+        prohibited = sorted({hit.term for hit in self.prohibited_hits})
+        found = sorted({hit.term for hit in self.keyword_hits})
+        return "\n".join([
+            f"Prohibited terms found: {', '.join(prohibited) or 'none'}",
+            f"Keywords present: {', '.join(found) or 'none'}",
+            f"Keywords missing: {', '.join(self.missing_keywords) or 'none'}",
+            f"Keyword coverage: {self.keyword_coverage:.0%}"
+        ])
+
+class BrandRuleViolation(Exception):
+    """Raised when a draft contains prohibited terms and fail-fast is enabled"""
+    status_code = 422
+
+class KeywordMatcher:
+    """Aho-Corasick automaton matching whole-word terms case-insensitively"""
+    
+    def __init__(self, terms: list[str]):
+        self.terms = [term for term in dict.fromkeys(t.strip().lower() for t in terms) if term]
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail = [0]
+        self._out: list[list[int]] = [[]]
+        
+        for index, term in enumerate(self.terms):
+            node = 0
+            for ch in term:
+                if ch not in self._goto[node]:
+                    self._goto[node][ch] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = self._goto[node][ch]
+            self._out[node].append(index)
+        
+        # Breadth-first pass to wire failure links; root children fail to the root
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(ch, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+    
+    def to_state(self) -> dict:
+        """Compiled automaton as plain data, so it can be stored and reloaded without rebuilding"""
+        return {"terms": self.terms, "goto": self._goto, "fail": self._fail, "out": self._out}
+    
+    @classmethod
+    def from_state(cls, state: dict) -> "KeywordMatcher":
+        matcher = cls.__new__(cls)
+        matcher.terms = state["terms"]
+        matcher._goto = state["goto"]
+        matcher._fail = state["fail"]
+        matcher._out = state["out"]
+        return matcher
+    
+    def find(self, text: str) -> list[RuleMatch]:
+        """All whole-word occurrences of the terms, in order of their end position"""
+        lowered = text.lower()
+        matches = []
+        node = 0
+        for i, ch in enumerate(lowered):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for index in self._out[node]:
+                term = self.terms[index]
+                start = i - len(term) + 1
+                if self._is_whole_word(lowered, start, i + 1):
+                    matches.append(RuleMatch(term=term, start=start, end=i + 1))
+        return matches
+    
+    @staticmethod
+    def _is_whole_word(text: str, start: int, end: int) -> bool:
+        before = text[start - 1] if start > 0 else " "
+        after = text[end] if end < len(text) else " "
+        return not (before.isalnum() and text[start].isalnum()) and not (after.isalnum() and text[end - 1].isalnum())
+
+class BrandRules:
+    """Deterministic checks compiled once per brand"""
+    
+    def __init__(self, brand_guidelines: BrandGuidelines):
+        self.prohibited = KeywordMatcher(brand_guidelines.prohibited_topics)
+        self.keywords = KeywordMatcher(brand_guidelines.keywords)
+    
+    def to_state(self) -> dict:
+        return {"prohibited": self.prohibited.to_state(), "keywords": self.keywords.to_state()}
+    
+    @classmethod
+    def from_state(cls, state: dict) -> "BrandRules":
+        rules = cls.__new__(cls)
+        rules.prohibited = KeywordMatcher.from_state(state["prohibited"])
+        rules.keywords = KeywordMatcher.from_state(state["keywords"])
+        return rules
+    
+    def check(self, text: str) -> BrandRuleReport:
+        prohibited_hits = self.prohibited.find(text)
+        keyword_hits = self.keywords.find(text)
+        found = {hit.term for hit in keyword_hits}
+        missing = [term for term in self.keywords.terms if term not in found]
+        coverage = len(found) / len(self.keywords.terms) if self.keywords.terms else 1.0
+        
+        if prohibited_hits:
+            verdict = "fail"
+        elif coverage >= BRAND_RULES_MIN_COVERAGE:
+            verdict = "pass"
+        else:
+            verdict = "review"
+        
+        return BrandRuleReport(
+            prohibited_hits=prohibited_hits,
+            keyword_hits=keyword_hits,
+            missing_keywords=missing,
+            keyword_coverage=round(coverage, 4),
+            verdict=verdict
+        )
+
+# ==================== Brand Alignment ====================
+
+BRAND_ALIGNMENT_FLOOR = float(os.getenv("BRAND_ALIGNMENT_FLOOR", "0.3"))
+BRAND_ALIGNMENT_MIN = float(os.getenv("BRAND_ALIGNMENT_MIN", "0"))
+BRAND_ALIGNMENT_MAX_CHUNKS = 32
+BRAND_ALIGNMENT_WEIGHTS = {"voice": 0.4, "values": 0.3, "keywords": 0.3}
+
+class BrandVectors:
+    """Precomputed embeddings of a brand's voice, values and keywords"""
+    
+    def __init__(self, fingerprint: str, voice: np.ndarray, values: np.ndarray, keywords: np.ndarray):
+        self.fingerprint = fingerprint
+        self.voice = voice
+        self.values = values
+        self.keywords = keywords
+    
+    @classmethod
+    def from_matrix(cls, fingerprint: str, matrix: np.ndarray, n_values: int) -> "BrandVectors":
+        """Split a stacked [voice, values..., keywords...] matrix; rows stay views of it"""
+        return cls(
+            fingerprint=fingerprint,
+            voice=matrix[0],
+            values=matrix[1:1 + n_values],
+            keywords=matrix[1 + n_values:]
+        )
+
+class BrandAlignmentScorer:
+    """Scores drafts against a brand by cosine similarity of sentence embeddings"""
+    
+    def __init__(self):
+        self._vectors: dict[str, BrandVectors] = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def fingerprint(brand_guidelines: BrandGuidelines) -> str:
+        return hashlib.sha256(brand_guidelines.model_dump_json().encode()).hexdigest()
+    
+    def brand_vectors(self, brand_id: str, brand_guidelines: BrandGuidelines) -> BrandVectors:
+        """Cached brand-side vectors, recomputed when the guidelines change"""
+        fingerprint = self.fingerprint(brand_guidelines)
+        cached = self._vectors.get(brand_id)
+        if cached and cached.fingerprint == fingerprint:
+            return cached
+        
+        vectors = BrandVectors.from_matrix(
+            fingerprint, self.embed_brand(brand_guidelines), len(brand_guidelines.values)
+        )
+        with self._lock:
+            self._vectors[brand_id] = vectors
+        return vectors
+    
+    @staticmethod
+    def embed_brand(brand_guidelines: BrandGuidelines) -> np.ndarray:
+        """Stacked embeddings of the voice, then each value, then each keyword"""
+        voice_text = f"{brand_guidelines.voice}. {brand_guidelines.tone}"
+        return embed_texts([voice_text, *brand_guidelines.values, *brand_guidelines.keywords])
+    
+    def score(
+        self,
+        brand_id: str,
+        brand_guidelines: BrandGuidelines,
+        text: str,
+        brand: Optional[BrandVectors] = None
+    ) -> dict:
+        """Per-aspect and overall alignment scores (0-100)"""
+        brand = brand or self.brand_vectors(brand_id, brand_guidelines)
+        chunks = [chunk.strip() for chunk in text.split("\n\n") if chunk.strip()]
+        chunks = chunks[:BRAND_ALIGNMENT_MAX_CHUNKS] or [text]
+        draft = embed_texts(chunks)
+        centroid = draft.mean(axis=0)
+        centroid /= max(np.linalg.norm(centroid), 1e-12)
+        
+        similarities = {"voice": float(centroid @ brand.voice)}
+        # A value or keyword counts as covered if any passage of the draft is close to it
+        if len(brand.values):
+            similarities["values"] = float((draft @ brand.values.T).max(axis=0).mean())
+        if len(brand.keywords):
+            similarities["keywords"] = float((draft @ brand.keywords.T).max(axis=0).mean())
+        
+        scores = {aspect: self._scale(sim) for aspect, sim in similarities.items()}
+        total_weight = sum(BRAND_ALIGNMENT_WEIGHTS[aspect] for aspect in scores)
+        scores["overall"] = round(
+            sum(BRAND_ALIGNMENT_WEIGHTS[aspect] * score for aspect, score in scores.items()) / total_weight
+        )
+        return scores
+    
+    @staticmethod
+    def _scale(similarity: float) -> int:
+        """Map cosine similarity onto 0-100, treating the floor as no alignment"""
+        scaled = (similarity - BRAND_ALIGNMENT_FLOOR) / (1 - BRAND_ALIGNMENT_FLOOR)
+        return round(min(max(scaled, 0.0), 1.0) * 100)
+
+brand_alignment_scorer = BrandAlignmentScorer()
+
+# ==================== Agent Outputs ====================
+
+COMPLIANCE_FAIL_FAST = os.getenv("COMPLIANCE_FAIL_FAST", "true").lower() == "true"
+# A compliance score below this (or a blocking issue) stops the pipeline
+COMPLIANCE_FAIL_SCORE = float(os.getenv("COMPLIANCE_FAIL_SCORE", "50"))
+# Drafts whose brand and compliance scores clear these skip or shorten the optimizer
+OPTIMIZER_SKIP_SCORE = float(os.getenv("OPTIMIZER_SKIP_SCORE", "90"))
+OPTIMIZER_LIGHT_SCORE = float(os.getenv("OPTIMIZER_LIGHT_SCORE", "75"))
+
+structured_output_failures = metrics.counter(
+    "copilot_structured_output_failures_total",
+    "Agent answers that did not validate against their output schema",
+    ("stage",)
+)
+optimizer_runs = metrics.counter(
+    "copilot_optimizer_runs_total", "Optimizer stage outcomes (full, light or skip)", ("mode",)
+)
+
+class BrandReview(BaseModel):
+    score: Optional[float] = Field(None, ge=0, le=100, description="brand consistency, 0-100")
+    issues: list[str] = Field(default_factory=list, description="voice, tone or terminology problems")
+    recommendations: list[str] = Field(default_factory=list, description="specific edits for better alignment")
+    summary: str = Field("", description="one or two sentence verdict")
+
+class ComplianceReview(BaseModel):
+    score: Optional[float] = Field(None, ge=0, le=100, description="compliance, 0-100")
+    issues: list[str] = Field(default_factory=list, description="legal or ethical problems found")
+    flagged_claims: list[str] = Field(default_factory=list, description="claims that need a disclaimer or citation")
+    recommendations: list[str] = Field(default_factory=list, description="specific fixes")
+    blocking: bool = Field(False, description="true only if the content must not be published as is")
+    summary: str = Field("", description="one or two sentence verdict")
+
+class DesignRecommendations(BaseModel):
+    visuals: list[str] = Field(default_factory=list, description="images or visuals that would enhance the content")
+    colors: list[str] = Field(default_factory=list, description="color palette suggestions")
+    typography: list[str] = Field(default_factory=list, description="typography and formatting improvements")
+    layout: list[str] = Field(default_factory=list, description="layout structure and multimedia ideas")
+    summary: str = Field("", description="one or two sentence overview")
+
+class OptimizedContent(BaseModel):
+    content: str = Field(min_length=1, description="the complete optimized content")
+    readability_before: Optional[float] = Field(None, ge=0, le=100, description="readability of the draft, 0-100")
+    readability_after: Optional[float] = Field(None, ge=0, le=100, description="readability of the optimized content, 0-100")
+    quality_score: Optional[float] = Field(None, ge=0, le=100, description="final quality, 0-100")
+    seo_recommendations: list[str] = Field(default_factory=list, description="further SEO suggestions")
+    mode: str = "full"  # full, light or skip; set by the pipeline, not the agent
+
+class ComplianceViolation(Exception):
+    """Raised when the compliance review finds a hard failure and fail-fast is enabled"""
+    status_code = 422
+
+def output_instructions(model: type[BaseModel], exclude: tuple[str, ...] = ()) -> str:
+    """Prompt lines describing the JSON object an agent must answer with"""
+    properties = model.model_json_schema()["properties"]
+    fields = "\n".join(
+        f'- "{name}": {spec.get("description", name)}'
+        for name, spec in properties.items()
+        if name not in exclude
+    )
+    return f"""Respond with only a JSON object, no other text, with these fields:
+{fields}"""
+
+def parse_agent_output(text: str, model: type[BaseModel], stage: str, fallback: dict) -> BaseModel:
+    """Validate an agent's answer against its output model
+    
+    Models wrap JSON in prose or code fences often enough that the outermost
+    object is extracted first. Answers that still do not validate keep their
+    text in ``fallback`` and leave every score unset rather than guessed.
+    """
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        try:
+            return model.model_validate_json(text[start:end + 1])
+        except ValueError:
+            pass
+    structured_output_failures.inc(stage=stage)
+    logger.warning(f"Stage {stage} answer did not match {model.__name__}, keeping it as text")
+    return model(**fallback)
+
+def check_compliance(review: ComplianceReview):
+    if not COMPLIANCE_FAIL_FAST:
+        return
+    if review.blocking or (review.score is not None and review.score < COMPLIANCE_FAIL_SCORE):
+        issues = "; ".join(review.issues) or review.summary or "no details given"
+        raise ComplianceViolation(f"Compliance review failed (score {review.score}): {issues}")
+
+def plan_optimization(brand_score: Optional[float], compliance: ComplianceReview) -> str:
+    """Pick how much optimizer work a draft needs: skip, light or full"""
+    if brand_score is None or compliance.score is None:
+        return "full"
+    lowest = min(brand_score, compliance.score)
+    if lowest >= OPTIMIZER_SKIP_SCORE and not compliance.issues and not compliance.flagged_claims:
+        return "skip"
+    if lowest >= OPTIMIZER_LIGHT_SCORE:
+        return "light"
+    return "full"
+
 # ==================== Task Definitions ====================
 
-def create_content_generation_task(agent, campaign_request: CampaignRequest):
-    """Initial content generation task"""
+def create_content_generation_task(
+    agent,
+    campaign_request: CampaignRequest,
+    reference: Optional[str] = None
+):
+    """Initial content generation task, optionally seeded with a similar past campaign"""
+    from crewai import Task
+    
+    seed = ""
+    if reference:
+        seed = f"""
+
+A campaign for a very similar brief produced the content below. Use it as a starting
+point and adapt it to this brief and audience rather than starting from scratch:
+{reference}"""
+    
     return Task(
         description=f"""Generate a {campaign_request.content_type} about: {campaign_request.campaign_brief}
         
@@ -146,38 +1447,73 @@ Requirements:
 - Include relevant details and calls-to-action
 - Aim for professional quality
 
-Provide the complete content.""",
+Provide the complete content.{seed}""",
         agent=agent,
         expected_output="Complete, well-structured content piece ready for validation"
     )
 
-def create_brand_validation_task(agent, brand_guidelines: BrandGuidelines):
-    """Brand consistency validation task"""
-    return Task(
-        description=f"""Review the generated content against these brand guidelines:
+def render_brand_prefix(brand_guidelines: BrandGuidelines) -> str:
+    """Stable brand block shared by every brand review for this brand
+    
+    Sent as the system prompt so consecutive reviews start with identical tokens and
+    Ollama can reuse the evaluated prefix instead of re-reading the guidelines.
+    """
+    return f"""You review marketing content for {brand_guidelines.brand_name}.
 
+Brand guidelines:
 Brand: {brand_guidelines.brand_name}
 Voice: {brand_guidelines.voice}
 Tone: {brand_guidelines.tone}
 Key Values: {', '.join(brand_guidelines.values)}
 Keywords to include: {', '.join(brand_guidelines.keywords)}
-Prohibited topics: {', '.join(brand_guidelines.prohibited_topics)}
+Prohibited topics: {', '.join(brand_guidelines.prohibited_topics)}"""
+
+def create_brand_validation_task(
+    agent,
+    brand_guidelines: BrandGuidelines,
+    rule_report: BrandRuleReport,
+    prefixed: bool = False
+):
+    """Brand consistency validation task
+    
+    Keyword and prohibited-term checks are settled by ``rule_report``, so the LLM only
+    judges voice and tone. With ``prefixed`` the agent's LLM already carries the brand
+    block as its system prompt, so the description only holds the per-campaign parts.
+    """
+    from crewai import Task
+    
+    if prefixed:
+        brand_block = "Review the generated content against the brand guidelines above."
+    else:
+        brand_block = f"""Review the generated content against these brand guidelines:
+
+Brand: {brand_guidelines.brand_name}
+Voice: {brand_guidelines.voice}
+Tone: {brand_guidelines.tone}
+Key Values: {', '.join(brand_guidelines.values)}"""
+    
+    return Task(
+        description=f"""{brand_block}
+
+Automated checks (already verified, do not repeat):
+{rule_report.describe()}
 
 Tasks:
 1. Check if content matches the brand voice and tone
-2. Verify no prohibited topics are mentioned
-3. Suggest improvements for brand alignment
-4. Score brand consistency (0-100)
+2. Suggest improvements for brand alignment, addressing any prohibited or missing terms above
+3. Score brand consistency (0-100)
 
-Provide detailed feedback and specific recommendations.""",
+{output_instructions(BrandReview)}""",
         agent=agent,
-        expected_output="Brand consistency analysis with score and recommendations"
+        expected_output="Brand consistency analysis as a JSON object"
     )
 
 def create_compliance_task(agent):
     """Legal and compliance review task"""
+    from crewai import Task
+    
     return Task(
-        description="""Review the content for legal and ethical compliance:
+        description=f"""Review the content for legal and ethical compliance:
 
 1. Check for potentially misleading claims or false advertising
 2. Identify any copyright or plagiarism concerns
@@ -185,19 +1521,17 @@ def create_compliance_task(agent):
 4. Verify adherence to FTC disclosure guidelines
 5. Check for age-appropriate content
 
-Provide:
-- Compliance score (0-100)
-- List of issues if any
-- Specific recommendations for fixes
-- Flagged claims that need disclaimer/citation""",
+{output_instructions(ComplianceReview)}""",
         agent=agent,
-        expected_output="Compliance review with issues identified and recommendations"
+        expected_output="Compliance review as a JSON object"
     )
 
 def create_design_recommendation_task(agent):
     """Design and visual recommendations task"""
+    from crewai import Task
+    
     return Task(
-        description="""Provide design and visual recommendations for the content:
+        description=f"""Provide design and visual recommendations for the content:
 
 1. Suggest 3 types of images/visuals that would enhance the content
 2. Recommend color palette alignment
@@ -205,80 +1539,2432 @@ def create_design_recommendation_task(agent):
 4. Propose layout structure for better readability
 5. Include any multimedia recommendations (video, infographics, etc.)
 
-Format as actionable recommendations.""",
+Keep each recommendation short and actionable.
+{output_instructions(DesignRecommendations)}""",
         agent=agent,
-        expected_output="Visual design recommendations and asset suggestions"
+        expected_output="Visual design recommendations as a JSON object"
     )
 
-def create_optimization_task(agent):
-    """Final optimization task"""
-    return Task(
-        description="""Optimize the content for maximum impact:
+def create_optimization_task(agent, light: bool = False):
+    """Final optimization task; ``light`` only applies the reviewers' fixes"""
+    from crewai import Task
+    
+    if light:
+        steps = """Apply the fixes the reviews above ask for and change nothing else:
+
+1. Resolve each listed brand and compliance issue
+2. Add disclaimers or soften the flagged claims
+3. Keep the structure, length and wording of the draft otherwise"""
+    else:
+        steps = """Optimize the content for maximum impact:
 
 1. Improve readability score (aim for 70+)
 2. Enhance SEO with better keyword placement
 3. Strengthen calls-to-action
 4. Improve paragraph structure and flow
 5. Check for grammar and tone consistency
-6. Optimize length for the content type
+6. Optimize length for the content type"""
+    
+    return Task(
+        description=f"""{steps}
 
-Provide:
-- Optimized version of content
-- Readability score (before/after)
-- SEO recommendations
-- Final quality score (0-100)""",
+{output_instructions(OptimizedContent, exclude=("mode",))}""",
         agent=agent,
-        expected_output="Optimized content with quality metrics and improvements"
+        expected_output="Optimized content and quality metrics as a JSON object"
     )
 
 # ==================== Crew Configuration ====================
 
-def create_creative_crew(brand_guidelines: BrandGuidelines):
-    """Assemble the multi-agent crew"""
-    
-    llm = get_llm()
+def create_agents(routes: dict[str, tuple[str, str]]) -> dict:
+    """Build one instance of each agent on its routed (tier, model)"""
+    def llm(agent: str):
+        tier, model = routes[agent]
+        return get_llm(model, tier=tier)
     
-    # Create agents
-    content_creator = create_content_creator_agent(llm)
-    brand_manager = create_brand_consistency_agent(llm)
-    compliance_officer = create_compliance_officer_agent(llm)
-    design_validator = create_design_validator_agent(llm)
-    optimizer = create_optimizer_agent(llm)
+    return {
+        "content_creator": create_content_creator_agent(llm("content_creator")),
+        "brand_manager": create_brand_consistency_agent(llm("brand_manager")),
+        "compliance_officer": create_compliance_officer_agent(llm("compliance_officer")),
+        "design_validator": create_design_validator_agent(llm("design_validator")),
+        "optimizer": create_optimizer_agent(llm("optimizer"))
+    }
+
+def create_creative_crew(brand_guidelines: BrandGuidelines):
+    """Assemble the multi-agent crew"""
     
     # Return agents and configuration for task creation
     return {
-        "content_creator": content_creator,
-        "brand_manager": brand_manager,
-        "compliance_officer": compliance_officer,
-        "design_validator": design_validator,
-        "optimizer": optimizer,
+        **create_agents(model_router.routes()),
         "brand_guidelines": brand_guidelines
     }
 
+def crew_key(routes: dict[str, tuple[str, str]]) -> tuple[tuple[str, str], ...]:
+    """Pool key for a routing: each agent's (tier, model), in AGENT_NAMES order"""
+    return tuple(routes[agent] for agent in AGENT_NAMES)
+
+CREW_POOL_SIZE = int(os.getenv("CREW_POOL_SIZE", "8"))
+
+class CrewPool:
+    """Process-wide pool of prebuilt agent sets, handed out one per running campaign
+    
+    Sets are grouped by key (the tiers and models of a routing, or a model plus brand for
+    brand-scoped agents) and built on demand by ``build(key)``.
+    """
+    
+    def __init__(
+        self,
+        max_size: int,
+        build: Callable[[Hashable], dict],
+        describe: Optional[Callable[[Hashable], str]] = None
+    ):
+        self.max_size = max_size
+        self.build = build
+        self.describe = describe
+        self._idle: dict[Hashable, list[dict]] = {}
+        self._created: dict[Hashable, int] = {}
+        self._cond = threading.Condition()
+    
+    def acquire(self, key: Hashable) -> dict:
+        """Take an idle agent set, building one if the pool has room, else wait"""
+        with self._cond:
+            while True:
+                idle = self._idle.setdefault(key, [])
+                if idle:
+                    return idle.pop()
+                if self._created.get(key, 0) < self.max_size:
+                    self._created[key] = self._created.get(key, 0) + 1
+                    break
+                self._cond.wait()
+        
+        try:
+            return self.build(key)
+        except Exception:
+            with self._cond:
+                self._created[key] -= 1
+                self._cond.notify_all()
+            raise
+    
+    def release(self, agents: dict, key: Hashable):
+        """Return an agent set after clearing per-campaign conversation memory"""
+        for agent in agents.values():
+            executor = getattr(agent, "agent_executor", None)
+            memory = getattr(executor, "memory", None)
+            if memory is not None:
+                memory.clear()
+        with self._cond:
+            if key in self._created:
+                self._idle.setdefault(key, []).append(agents)
+            self._cond.notify_all()
+    
+    @contextmanager
+    def checkout(self, key: Hashable):
+        agents = self.acquire(key)
+        try:
+            yield agents
+        finally:
+            self.release(agents, key)
+    
+    def warm(self, key: Hashable, count: int = 1):
+        """Prebuild agent sets so the first campaigns skip construction"""
+        sets = [self.acquire(key) for _ in range(count)]
+        for agents in sets:
+            self.release(agents, key)
+    
+    def discard(self, predicate: Callable[[Hashable], bool]):
+        """Drop every set whose key matches; checked-out sets are dropped on release"""
+        with self._cond:
+            for key in [key for key in self._created if predicate(key)]:
+                del self._created[key]
+                self._idle.pop(key, None)
+            self._cond.notify_all()
+    
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                self._label(key): {
+                    "created": created,
+                    "idle": len(self._idle.get(key, []))
+                }
+                for key, created in self._created.items()
+            }
+    
+    def _label(self, key: Hashable) -> str:
+        if self.describe:
+            return self.describe(key)
+        return ":".join(str(part) for part in (key if isinstance(key, tuple) else (key,))[:2])
+
+crew_pool = CrewPool(
+    max_size=CREW_POOL_SIZE,
+    build=lambda routes: create_agents(dict(zip(AGENT_NAMES, routes))),
+    describe=lambda routes: "/".join(dict.fromkeys(f"{tier}:{model}" for tier, model in routes))
+)
+
+# Brand managers whose LLM carries the brand guidelines as a system prompt; keyed by
+# (model, brand_id, prefix, tier) so a re-uploaded brand never reuses stale agents
+brand_agent_pool = CrewPool(
+    max_size=CREW_POOL_SIZE,
+    build=lambda key: {"brand_manager": create_brand_consistency_agent(get_llm(key[0], system=key[2], tier=key[3]))}
+)
+
 # ==================== Campaign Storage ====================
 
 CAMPAIGNS_DIR = Path("campaigns")
 CAMPAIGNS_DIR.mkdir(exist_ok=True)
 
-def save_campaign(campaign_id: str, campaign_data: dict):
-    """Save campaign results to JSON"""
-    with open(CAMPAIGNS_DIR / f"{campaign_id}.json", "w") as f:
-        json.dump(campaign_data, f, indent=2)
+CAMPAIGN_INDEX_PATH = CAMPAIGNS_DIR / "campaigns.sqlite"
+CAMPAIGN_PREVIEW_CHARS = 300
+
+def encode_campaign(campaign_data: dict) -> bytes:
+    """Compact JSON, zlib-compressed; result texts shrink several-fold"""
+    return zlib.compress(orjson.dumps(campaign_data), 6)
+
+def decode_campaign(data) -> dict:
+    # Rows written before compression hold plain JSON text
+    if isinstance(data, str):
+        return orjson.loads(data)
+    return orjson.loads(zlib.decompress(data))
+
+ROLLUP_SCORE_METRICS = ("brand_alignment", "compliance", "readability", "overall_quality", "keyword_coverage")
+ROLLUP_BUCKET_WIDTH = 10
+ROLLUP_VERSION = "1"
+
+class CampaignRollups:
+    """Daily aggregates kept in step with the campaigns table.
+    
+    Every save adds the campaign's contribution (and subtracts the row it
+    replaces) in the same transaction, so analytics reads a few hundred
+    rollup rows instead of decoding every campaign.
+    """
+    
+    def __init__(self, db: sqlite3.Connection):
+        self._db = db
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS rollup_meta (key TEXT PRIMARY KEY, value TEXT);"
+            "CREATE TABLE IF NOT EXISTS rollup_campaigns ("
+            "day TEXT, content_type TEXT, brand_id TEXT, status TEXT, campaigns INTEGER NOT NULL, "
+            "PRIMARY KEY (day, content_type, brand_id, status));"
+            "CREATE TABLE IF NOT EXISTS rollup_scores ("
+            "day TEXT, content_type TEXT, brand_id TEXT, metric TEXT, count INTEGER NOT NULL, total REAL NOT NULL, "
+            "PRIMARY KEY (day, content_type, brand_id, metric));"
+            "CREATE TABLE IF NOT EXISTS rollup_score_buckets ("
+            "day TEXT, metric TEXT, bucket INTEGER, count INTEGER NOT NULL, "
+            "PRIMARY KEY (day, metric, bucket));"
+            "CREATE TABLE IF NOT EXISTS rollup_stages ("
+            "day TEXT, stage TEXT, count INTEGER NOT NULL, total_seconds REAL NOT NULL, max_seconds REAL NOT NULL, "
+            "PRIMARY KEY (day, stage));"
+        )
+    
+    def apply(self, campaign_data: dict, sign: int = 1):
+        """Add (sign=1) or remove (sign=-1) one campaign; the caller commits"""
+        day = str(campaign_data.get("timestamp") or "")[:10]
+        content_type = campaign_data.get("content_type") or "unknown"
+        brand_id = campaign_data.get("brand_id") or "default"
+        
+        self._db.execute(
+            "INSERT INTO rollup_campaigns VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (day, content_type, brand_id, status) DO UPDATE SET campaigns = campaigns + excluded.campaigns",
+            (day, content_type, brand_id, campaign_data.get("status") or "unknown", sign)
+        )
+        
+        validations = campaign_data.get("validations") or {}
+        for metric in ROLLUP_SCORE_METRICS:
+            value = validations.get(metric)
+            if not isinstance(value, (int, float)):
+                continue
+            self._db.execute(
+                "INSERT INTO rollup_scores VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (day, content_type, brand_id, metric) DO UPDATE SET count = count + excluded.count, total = total + excluded.total",
+                (day, content_type, brand_id, metric, sign, sign * value)
+            )
+            bucket = min(int(value // ROLLUP_BUCKET_WIDTH), 100 // ROLLUP_BUCKET_WIDTH - 1) * ROLLUP_BUCKET_WIDTH
+            self._db.execute(
+                "INSERT INTO rollup_score_buckets VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (day, metric, bucket) DO UPDATE SET count = count + excluded.count",
+                (day, metric, bucket, sign)
+            )
+        
+        # max_seconds is a high-water mark; removing a campaign does not lower it
+        for stage, seconds in (campaign_data.get("stage_seconds") or {}).items():
+            self._db.execute(
+                "INSERT INTO rollup_stages VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (day, stage) DO UPDATE SET count = count + excluded.count, "
+                "total_seconds = total_seconds + excluded.total_seconds, "
+                "max_seconds = max(max_seconds, excluded.max_seconds)",
+                (day, stage, sign, sign * seconds, seconds if sign > 0 else 0)
+            )
+    
+    def needs_rebuild(self) -> bool:
+        row = self._db.execute("SELECT value FROM rollup_meta WHERE key = 'version'").fetchone()
+        return row is None or row[0] != ROLLUP_VERSION
+    
+    def rebuild(self, batch_size: int = 500) -> int:
+        """Recompute every rollup from the stored campaigns; the caller holds the store lock"""
+        for table in ("rollup_campaigns", "rollup_scores", "rollup_score_buckets", "rollup_stages"):
+            self._db.execute(f"DELETE FROM {table}")
+        scanned = 0
+        rows = self._db.execute("SELECT data FROM campaigns")
+        while batch := rows.fetchmany(batch_size):
+            for (data,) in batch:
+                self.apply(decode_campaign(data))
+            scanned += len(batch)
+        self._db.execute("INSERT OR REPLACE INTO rollup_meta VALUES ('version', ?)", (ROLLUP_VERSION,))
+        self._db.commit()
+        return scanned
+    
+    def query(self, since: str) -> dict:
+        """Aggregates for every day on or after `since` (YYYY-MM-DD)"""
+        campaigns = self._db.execute(
+            "SELECT day, content_type, brand_id, status, campaigns FROM rollup_campaigns "
+            "WHERE day >= ? AND campaigns > 0", (since,)
+        ).fetchall()
+        scores = self._db.execute(
+            "SELECT day, content_type, brand_id, metric, count, total FROM rollup_scores "
+            "WHERE day >= ? AND count > 0", (since,)
+        ).fetchall()
+        buckets = self._db.execute(
+            "SELECT metric, bucket, SUM(count) FROM rollup_score_buckets "
+            "WHERE day >= ? GROUP BY metric, bucket HAVING SUM(count) > 0 ORDER BY metric, bucket", (since,)
+        ).fetchall()
+        stages = self._db.execute(
+            "SELECT day, stage, count, total_seconds, max_seconds FROM rollup_stages "
+            "WHERE day >= ? AND count > 0 ORDER BY day, stage", (since,)
+        ).fetchall()
+        return {"campaigns": campaigns, "scores": scores, "buckets": buckets, "stages": stages}
+
+class CampaignStore:
+    """SQLite-backed campaign storage with an index for listing and filtering"""
+    
+    SUMMARY_COLUMNS = (
+        "campaign_id", "timestamp", "status", "brand_id",
+        "content_type", "campaign_brief", "preview"
+    )
+    
+    def __init__(self, path: Path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS campaigns ("
+            "campaign_id TEXT PRIMARY KEY, timestamp TEXT NOT NULL, status TEXT, "
+            "brand_id TEXT, content_type TEXT, campaign_brief TEXT, preview TEXT, "
+            "data TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_campaigns_time ON campaigns (timestamp, campaign_id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_campaigns_brand ON campaigns (brand_id, timestamp, campaign_id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_campaigns_type ON campaigns (content_type, timestamp, campaign_id)")
+        self._rollups = CampaignRollups(self._db)
+        self._db.commit()
+    
+    def save(self, campaign_id: str, campaign_data: dict):
+        row = (
+            campaign_id,
+            campaign_data.get("timestamp") or datetime.now().isoformat(),
+            campaign_data.get("status"),
+            campaign_data.get("brand_id"),
+            campaign_data.get("content_type"),
+            campaign_data.get("campaign_brief"),
+            str(campaign_data.get("result", ""))[:CAMPAIGN_PREVIEW_CHARS],
+            encode_campaign(campaign_data)
+        )
+        with self._lock:
+            previous = self._db.execute(
+                "SELECT data FROM campaigns WHERE campaign_id = ?", (campaign_id,)
+            ).fetchone()
+            if previous:
+                self._rollups.apply(decode_campaign(previous[0]), -1)
+            self._db.execute("INSERT OR REPLACE INTO campaigns VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+            self._rollups.apply(campaign_data)
+            self._db.commit()
+    
+    def load(self, campaign_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM campaigns WHERE campaign_id = ?", (campaign_id,)
+            ).fetchone()
+        return decode_campaign(row[0]) if row else None
+    
+    def exists(self, campaign_id: str) -> bool:
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM campaigns WHERE campaign_id = ?", (campaign_id,)
+            ).fetchone() is not None
+    
+    def summaries(self, campaign_ids: list[str]) -> list[dict]:
+        """Summary rows for specific campaigns, in no particular order"""
+        if not campaign_ids:
+            return []
+        placeholders = ", ".join("?" for _ in campaign_ids)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(self.SUMMARY_COLUMNS)} FROM campaigns WHERE campaign_id IN ({placeholders})",
+                campaign_ids
+            ).fetchall()
+        return [dict(zip(self.SUMMARY_COLUMNS, row)) for row in rows]
+    
+    def list(
+        self,
+        limit: int = 10,
+        cursor: Optional[str] = None,
+        brand_id: Optional[str] = None,
+        content_type: Optional[str] = None,
+        status: Optional[str] = None,
+        summary: bool = False
+    ) -> tuple[list[dict], Optional[str]]:
+        """Newest-first page of campaigns plus the cursor for the next page"""
+        clauses, params = [], []
+        for column, value in (("brand_id", brand_id), ("content_type", content_type), ("status", status)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if cursor:
+            timestamp, campaign_id = decode_cursor(cursor)
+            clauses.append("(timestamp, campaign_id) < (?, ?)")
+            params.extend([timestamp, campaign_id])
+        
+        columns = ", ".join(self.SUMMARY_COLUMNS) if summary else "campaign_id, timestamp, data"
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = (
+            f"SELECT {columns} FROM campaigns {where} "
+            f"ORDER BY timestamp DESC, campaign_id DESC LIMIT ?"
+        )
+        with self._lock:
+            rows = self._db.execute(query, (*params, limit + 1)).fetchall()
+        
+        next_cursor = encode_cursor(rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+        rows = rows[:limit]
+        if summary:
+            return [dict(zip(self.SUMMARY_COLUMNS, row)) for row in rows], next_cursor
+        return [decode_campaign(row[2]) for row in rows], next_cursor
+    
+    def compress_legacy(self, batch_size: int = 500) -> int:
+        """Rewrite rows stored as plain JSON text in the compressed format"""
+        converted = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT campaign_id, data FROM campaigns WHERE typeof(data) = 'text' LIMIT ?",
+                    (batch_size,)
+                ).fetchall()
+                if not rows:
+                    return converted
+                self._db.executemany(
+                    "UPDATE campaigns SET data = ? WHERE campaign_id = ?",
+                    [(encode_campaign(orjson.loads(data)), campaign_id) for campaign_id, data in rows]
+                )
+                self._db.commit()
+            converted += len(rows)
+    
+    def rebuild_rollups(self, force: bool = False) -> Optional[int]:
+        """Backfill the analytics rollups once; returns the campaigns scanned"""
+        with self._lock:
+            if not force and not self._rollups.needs_rebuild():
+                return None
+            return self._rollups.rebuild()
+    
+    def rollups(self, since: str) -> dict:
+        with self._lock:
+            return self._rollups.query(since)
+    
+    def import_json(self, directory: Path) -> int:
+        """Index legacy <campaign_id>.json files that are not in the store yet"""
+        imported = 0
+        for campaign_file in directory.glob("*.json"):
+            if self.exists(campaign_file.stem):
+                continue
+            try:
+                with open(campaign_file) as f:
+                    campaign_data = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Skipping unreadable campaign file {campaign_file}: {str(e)}")
+                continue
+            self.save(campaign_data.get("campaign_id", campaign_file.stem), campaign_data)
+            imported += 1
+        return imported
+
+def encode_cursor(timestamp: str, campaign_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([timestamp, campaign_id]).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        timestamp, campaign_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(timestamp), str(campaign_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+campaign_store = CampaignStore(CAMPAIGN_INDEX_PATH)
+
+def save_campaign(campaign_id: str, campaign_data: dict, brief_vector: Optional[np.ndarray] = None):
+    """Save campaign results to the campaign store, indexing the brief when embedded"""
+    campaign_store.save(campaign_id, campaign_data)
+    if brief_vector is not None:
+        brief_index.add(
+            campaign_id,
+            campaign_data["timestamp"],
+            campaign_data["brand_id"],
+            campaign_data["content_type"],
+            brief_vector
+        )
 
 def load_campaign(campaign_id: str) -> Optional[dict]:
     """Load campaign from storage"""
+    campaign = campaign_store.load(campaign_id)
+    if campaign is not None:
+        return campaign
+    
+    # Legacy JSON file that has not been imported yet
     campaign_file = CAMPAIGNS_DIR / f"{campaign_id}.json"
     if campaign_file.exists():
         with open(campaign_file) as f:
             return json.load(f)
     return None
 
+def build_analytics(days: int) -> dict:
+    """Campaign counts, score distributions and stage latency over the last ``days`` days"""
+    since = (datetime.now() - timedelta(days=days - 1)).date().isoformat()
+    rollups = campaign_store.rollups(since)
+    
+    def group() -> dict:
+        return {"campaigns": 0, "by_status": {}, "_scores": {}}
+    
+    totals = group()
+    by_content_type, by_brand, daily = {}, {}, {}
+    for day, content_type, brand_id, status, count in rollups["campaigns"]:
+        for target in (
+            totals,
+            by_content_type.setdefault(content_type, group()),
+            by_brand.setdefault(brand_id, group()),
+            daily.setdefault(day, group())
+        ):
+            target["campaigns"] += count
+            target["by_status"][status] = target["by_status"].get(status, 0) + count
+    for day, content_type, brand_id, metric, count, total in rollups["scores"]:
+        for target in (
+            totals,
+            by_content_type.setdefault(content_type, group()),
+            by_brand.setdefault(brand_id, group()),
+            daily.setdefault(day, group())
+        ):
+            sums = target["_scores"].setdefault(metric, [0, 0.0])
+            sums[0] += count
+            sums[1] += total
+    
+    def finish(target: dict) -> dict:
+        scores = target.pop("_scores")
+        target["averages"] = {
+            metric: round(total / count, 2) for metric, (count, total) in scores.items() if count
+        }
+        return target
+    
+    stage_totals = {}
+    stage_daily = []
+    for day, stage, count, total_seconds, max_seconds in rollups["stages"]:
+        stage_daily.append({
+            "day": day,
+            "stage": stage,
+            "count": count,
+            "avg_seconds": round(total_seconds / count, 3),
+            "max_seconds": round(max_seconds, 3)
+        })
+        entry = stage_totals.setdefault(stage, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        entry["count"] += count
+        entry["total_seconds"] += total_seconds
+        entry["max_seconds"] = max(entry["max_seconds"], max_seconds)
+    
+    distributions = {}
+    for metric, bucket, count in rollups["buckets"]:
+        distributions.setdefault(metric, []).append(
+            {"min": bucket, "max": bucket + ROLLUP_BUCKET_WIDTH, "count": count}
+        )
+    
+    return {
+        "since": since,
+        "days": days,
+        "totals": finish(totals),
+        "by_content_type": {key: finish(value) for key, value in sorted(by_content_type.items())},
+        "by_brand": {key: finish(value) for key, value in sorted(by_brand.items())},
+        "daily": [{"day": day, **finish(value)} for day, value in sorted(daily.items())],
+        "score_distributions": distributions,
+        "stage_latency": {
+            "overall": {
+                stage: {
+                    "count": entry["count"],
+                    "avg_seconds": round(entry["total_seconds"] / entry["count"], 3),
+                    "max_seconds": round(entry["max_seconds"], 3)
+                }
+                for stage, entry in sorted(stage_totals.items())
+            },
+            "daily": stage_daily
+        }
+    }
+
+# ==================== Stage Checkpoints ====================
+
+CHECKPOINT_PATH = CAMPAIGNS_DIR / "checkpoints.sqlite"
+CHECKPOINT_RETENTION_DAYS = float(os.getenv("CHECKPOINT_RETENTION_DAYS", "7"))
+# A running run whose owner stops renewing its lease this long is treated as interrupted
+CHECKPOINT_LEASE_SECONDS = float(os.getenv("CHECKPOINT_LEASE_SECONDS", "60"))
+# host:pid:boot - the boot token tells apart processes that reuse a PID (e.g. PID 1 in containers)
+CHECKPOINT_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def owner_alive(owner: Optional[str]) -> Optional[bool]:
+    """Whether the process that owns a run still exists; None when it can't be told from here"""
+    if not owner:
+        return False
+    if owner == CHECKPOINT_OWNER:
+        return True
+    host, _, rest = owner.partition(":")
+    pid, _, _ = rest.partition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return None
+    if int(pid) == os.getpid():
+        return False  # same PID, different boot token: a previous incarnation of this process
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return None
+    return None  # the PID exists but may have been reused; leave it to the lease
+
+class CheckpointStore:
+    """Stage outputs of unfinished campaigns, so a failed or interrupted run can resume
+    
+    A run is recorded when its graph starts and every stage output is written as it
+    completes. Completed campaigns drop their checkpoints; failed, cancelled and
+    interrupted ones keep them until resumed or older than the retention period.
+    
+    Several workers may share the database, so each running row carries its owner and
+    a lease the owner renews; only runs whose owner is gone or whose lease lapsed are
+    flagged as interrupted.
+    """
+    
+    def __init__(self, path: Path, lease_seconds: float = CHECKPOINT_LEASE_SECONDS):
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS campaign_runs ("
+            "campaign_id TEXT PRIMARY KEY, request TEXT NOT NULL, brand_version INTEGER, "
+            "status TEXT NOT NULL, error TEXT, started_at TEXT NOT NULL, updated_at TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS stage_checkpoints ("
+            "campaign_id TEXT, stage TEXT, output TEXT NOT NULL, seconds REAL, "
+            "PRIMARY KEY (campaign_id, stage));"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(campaign_runs)")}
+        for column in ("owner", "lease_until"):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE campaign_runs ADD COLUMN {column} TEXT")
+        self._db.commit()
+    
+    def _lease_until(self) -> str:
+        return (datetime.now() + timedelta(seconds=self.lease_seconds)).isoformat()
+    
+    def begin(self, campaign_id: str, request: CampaignRequest, brand_version: int):
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO campaign_runs (campaign_id, request, brand_version, status, error, "
+                "started_at, updated_at, owner, lease_until) VALUES (?, ?, ?, 'running', NULL, ?, ?, ?, ?) "
+                "ON CONFLICT (campaign_id) DO UPDATE SET status = 'running', error = NULL, "
+                "brand_version = excluded.brand_version, updated_at = excluded.updated_at, "
+                "owner = excluded.owner, lease_until = excluded.lease_until",
+                (campaign_id, request.model_dump_json(), brand_version, now, now,
+                 CHECKPOINT_OWNER, self._lease_until())
+            )
+            self._db.commit()
+    
+    def renew_leases(self) -> int:
+        """Extend the lease on every run this process is still working on"""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE campaign_runs SET lease_until = ? WHERE owner = ? AND status = 'running'",
+                (self._lease_until(), CHECKPOINT_OWNER)
+            )
+            self._db.commit()
+        return cursor.rowcount
+    
+    def save_stage(self, campaign_id: str, stage: str, output: str, seconds: Optional[float] = None):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO stage_checkpoints VALUES (?, ?, ?, ?)",
+                (campaign_id, stage, output, seconds)
+            )
+            self._db.execute(
+                "UPDATE campaign_runs SET updated_at = ? WHERE campaign_id = ?",
+                (datetime.now().isoformat(), campaign_id)
+            )
+            self._db.commit()
+    
+    def stages(self, campaign_id: str) -> dict[str, tuple[str, Optional[float]]]:
+        """Completed stages as name -> (output, seconds)"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT stage, output, seconds FROM stage_checkpoints WHERE campaign_id = ?", (campaign_id,)
+            ).fetchall()
+        return {stage: (output, seconds) for stage, output, seconds in rows}
+    
+    def run(self, campaign_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT request, brand_version, status, error, started_at, updated_at, owner, lease_until "
+                "FROM campaign_runs WHERE campaign_id = ?", (campaign_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            stages = [stage for (stage,) in self._db.execute(
+                "SELECT stage FROM stage_checkpoints WHERE campaign_id = ?", (campaign_id,)
+            )]
+        request, brand_version, status, error, started_at, updated_at, owner, lease_until = row
+        return {
+            "campaign_id": campaign_id,
+            "request": orjson.loads(request),
+            "brand_version": brand_version,
+            "status": status,
+            "error": error,
+            "started_at": started_at,
+            "updated_at": updated_at,
+            "owner": owner,
+            "lease_until": lease_until,
+            "completed_stages": sorted(stages)
+        }
+    
+    def incomplete(self, limit: int = 50) -> list[dict]:
+        """Runs that can be resumed, most recently updated first"""
+        with self._lock:
+            ids = [campaign_id for (campaign_id,) in self._db.execute(
+                "SELECT campaign_id FROM campaign_runs WHERE status != 'running' "
+                "ORDER BY updated_at DESC LIMIT ?", (limit,)
+            )]
+        return [run for run in map(self.run, ids) if run]
+    
+    def fail(self, campaign_id: str, status: str, error: str):
+        with self._lock:
+            self._db.execute(
+                "UPDATE campaign_runs SET status = ?, error = ?, updated_at = ? WHERE campaign_id = ?",
+                (status, error, datetime.now().isoformat(), campaign_id)
+            )
+            self._db.commit()
+    
+    def discard_stages(self, campaign_id: str, keep: set[str]):
+        placeholders = ", ".join("?" for _ in keep) or "NULL"
+        with self._lock:
+            self._db.execute(
+                f"DELETE FROM stage_checkpoints WHERE campaign_id = ? AND stage NOT IN ({placeholders})",
+                (campaign_id, *keep)
+            )
+            self._db.commit()
+    
+    def complete(self, campaign_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM stage_checkpoints WHERE campaign_id = ?", (campaign_id,))
+            self._db.execute("DELETE FROM campaign_runs WHERE campaign_id = ?", (campaign_id,))
+            self._db.commit()
+    
+    def mark_interrupted(self) -> int:
+        """Flag running runs whose owner process is gone or whose lease expired"""
+        now = datetime.now().isoformat()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT campaign_id, owner, lease_until FROM campaign_runs WHERE status = 'running'"
+            ).fetchall()
+            orphaned = []
+            for campaign_id, owner, lease_until in rows:
+                alive = owner_alive(owner)
+                if alive is False or (alive is None and (lease_until or "") < now):
+                    orphaned.append((campaign_id,))
+            self._db.executemany(
+                "UPDATE campaign_runs SET status = 'interrupted', "
+                "error = 'Worker stopped during the run' WHERE campaign_id = ? AND status = 'running'",
+                orphaned
+            )
+            self._db.commit()
+        return len(orphaned)
+    
+    def _loop(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.renew_leases()
+                interrupted = self.mark_interrupted()
+                if interrupted:
+                    logger.warning(f"{interrupted} campaign run(s) lost their worker; they can be resumed")
+            except sqlite3.Error as e:
+                logger.warning(f"Checkpoint lease renewal failed: {e}")
+    
+    def start(self) -> bool:
+        """Renew this process's leases and sweep up runs of dead workers in the background"""
+        if self.lease_seconds <= 0 or (self._thread and self._thread.is_alive()):
+            return False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="checkpoint-lease", daemon=True)
+        self._thread.start()
+        return True
+    
+    def stop(self):
+        self._stop.set()
+    
+    def prune(self, older_than_days: float) -> int:
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM stage_checkpoints WHERE campaign_id IN "
+                "(SELECT campaign_id FROM campaign_runs WHERE updated_at < ? AND status != 'running')",
+                (cutoff,)
+            )
+            cursor = self._db.execute(
+                "DELETE FROM campaign_runs WHERE updated_at < ? AND status != 'running'", (cutoff,)
+            )
+            self._db.commit()
+        return cursor.rowcount
+
+checkpoint_store = CheckpointStore(CHECKPOINT_PATH)
+
+# ==================== Brief Index ====================
+
+BRIEF_INDEX_PATH = CAMPAIGNS_DIR / "briefs.sqlite"
+# What to do with a near-duplicate brief: seed generation from it, reuse the earlier result, or off
+DUPLICATE_BRIEF_MODE = os.getenv("DUPLICATE_BRIEF_MODE", "seed")
+DUPLICATE_BRIEF_THRESHOLD = float(os.getenv("DUPLICATE_BRIEF_THRESHOLD", "0.95"))
+# Similarity needed to return an earlier result; calibrated on BRIEF_CALIBRATION_PAIRS when unset
+DUPLICATE_REUSE_THRESHOLD = os.getenv("DUPLICATE_REUSE_THRESHOLD")
+
+# (brief, audience) pairs labelled paraphrase or not. Mean-pooled embeddings rate even
+# unrelated short briefs as similar, so reuse needs a threshold above every distinct pair.
+BRIEF_CALIBRATION_PAIRS = [
+    (("Announce our spring product line to returning customers", "Existing customers"),
+     ("Tell returning customers about the new spring product line", "Existing customers"), True),
+    (("Promote the annual sustainability report on social media", "Eco-conscious followers"),
+     ("Share our yearly sustainability report on social channels", "Eco-conscious followers"), True),
+    (("Invite small business owners to a free onboarding webinar", "Small business owners"),
+     ("Invite owners of small businesses to our free onboarding webinar", "Small business owners"), True),
+    (("Introduce the new loyalty program with a limited-time offer", "Frequent shoppers"),
+     ("Launch the new loyalty program with a limited time offer", "Frequent shoppers"), True),
+    (("Announce our spring product line to returning customers", "Existing customers"),
+     ("Announce our spring product line to returning customers", "Wholesale buyers in Europe"), False),
+    (("Announce our spring product line to returning customers", "Existing customers"),
+     ("Announce our winter clearance sale to returning customers", "Existing customers"), False),
+    (("Promote the annual sustainability report on social media", "Eco-conscious followers"),
+     ("Promote the annual hiring fair on social media", "Recent graduates"), False),
+    (("Invite small business owners to a free onboarding webinar", "Small business owners"),
+     ("Introduce the new loyalty program with a limited-time offer", "Frequent shoppers"), False),
+    (("Recruit volunteers for the beach cleanup", "Local residents"),
+     ("Apologize for the delayed shipping of holiday orders", "Affected customers"), False),
+]
+
+_reuse_threshold: Optional[float] = None
+_reuse_calibrated = False
+_reuse_threshold_lock = threading.Lock()
+
+def calibrate_reuse_threshold() -> Optional[float]:
+    """Lowest similarity above every distinct calibration pair, or None if paraphrases score no higher"""
+    left = embed_texts([brief_text(*a) for a, _, _ in BRIEF_CALIBRATION_PAIRS])
+    right = embed_texts([brief_text(*b) for _, b, _ in BRIEF_CALIBRATION_PAIRS])
+    similarities = (left * right).sum(axis=1)
+    paraphrase = [float(sim) for sim, (_, _, same) in zip(similarities, BRIEF_CALIBRATION_PAIRS) if same]
+    distinct = [float(sim) for sim, (_, _, same) in zip(similarities, BRIEF_CALIBRATION_PAIRS) if not same]
+    logger.info(
+        f"Brief similarity calibration: paraphrases >= {min(paraphrase):.4f}, distinct <= {max(distinct):.4f}"
+    )
+    if max(distinct) >= min(paraphrase):
+        return None
+    # Halfway between the classes, and never below the seeding threshold
+    return round(max((max(distinct) + min(paraphrase)) / 2, DUPLICATE_BRIEF_THRESHOLD), 4)
+
+def reuse_threshold() -> Optional[float]:
+    """Similarity a brief needs for an earlier result to be returned; None disables reuse"""
+    global _reuse_threshold, _reuse_calibrated
+    if DUPLICATE_REUSE_THRESHOLD:
+        return float(DUPLICATE_REUSE_THRESHOLD)
+    with _reuse_threshold_lock:
+        if not _reuse_calibrated:
+            try:
+                _reuse_threshold = calibrate_reuse_threshold()
+            except Exception as e:
+                # Not remembered: the embedding model may load later
+                logger.warning(f"Brief similarity calibration unavailable: {str(e)}")
+                return None
+            _reuse_calibrated = True
+            if _reuse_threshold is None:
+                logger.warning("Embeddings do not separate paraphrased from distinct briefs; reuse disabled")
+        return _reuse_threshold
+
+class BriefMatch(BaseModel):
+    campaign_id: str
+    similarity: float
+    brand_id: str
+    content_type: str
+    timestamp: str
+
+def brief_text(campaign_brief: str, target_audience: str) -> str:
+    """Text embedded for a brief; brand and content type are matched exactly instead"""
+    return f"{campaign_brief}\nAudience: {target_audience}"
+
+def embed_brief(request: CampaignRequest) -> Optional[np.ndarray]:
+    try:
+        return embed_texts([brief_text(request.campaign_brief, request.target_audience)])[0]
+    except Exception as e:
+        logger.warning(f"Brief embedding unavailable: {str(e)}")
+        return None
+
+class BriefIndex:
+    """Embeddings of past briefs for near-duplicate lookup
+    
+    Vectors live in one contiguous float32 matrix that grows by doubling, with row
+    lists per brand and content type. A lookup is a single matrix-vector product over
+    the filtered rows, which for this archive's size is faster than maintaining an
+    approximate index. Rows are persisted to SQLite and loaded in one pass on first use.
+    """
+    
+    def __init__(self, path: Path, model: str):
+        self.model = model
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS brief_vectors ("
+            "campaign_id TEXT PRIMARY KEY, timestamp TEXT NOT NULL, brand_id TEXT, "
+            "content_type TEXT, model TEXT NOT NULL, vector BLOB NOT NULL)"
+        )
+        self._db.commit()
+        self._loaded = False
+        self._matrix: Optional[np.ndarray] = None
+        self._size = 0
+        self._meta: list[tuple[str, str, str, str]] = []  # (campaign_id, timestamp, brand_id, content_type)
+        self._rows: dict[tuple, list[int]] = {}
+    
+    def add(self, campaign_id: str, timestamp: str, brand_id: str, content_type: str, vector: np.ndarray):
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._ensure_loaded()
+            self._db.execute(
+                "INSERT OR REPLACE INTO brief_vectors VALUES (?, ?, ?, ?, ?, ?)",
+                (campaign_id, timestamp, brand_id, content_type, self.model, vector.tobytes())
+            )
+            self._db.commit()
+            self._append(campaign_id, timestamp, brand_id, content_type, vector)
+    
+    def search(
+        self,
+        vector: np.ndarray,
+        limit: int = 5,
+        brand_id: Optional[str] = None,
+        content_type: Optional[str] = None,
+        min_similarity: float = 0.0
+    ) -> list[BriefMatch]:
+        """Most similar past briefs by cosine similarity, best first"""
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._ensure_loaded()
+            if brand_id and content_type:
+                rows = self._rows.get(("pair", brand_id, content_type), [])
+            elif brand_id:
+                rows = self._rows.get(("brand", brand_id), [])
+            elif content_type:
+                rows = self._rows.get(("type", content_type), [])
+            else:
+                rows = range(self._size)
+            if not rows or self._matrix is None or self._matrix.shape[1] != len(vector):
+                return []
+            
+            rows = np.asarray(rows)
+            similarities = self._matrix[rows] @ vector
+            if len(rows) > limit:
+                top = np.argpartition(-similarities, limit)[:limit]
+            else:
+                top = np.arange(len(rows))
+            top = top[np.argsort(-similarities[top])]
+            
+            matches = []
+            for i in top:
+                if similarities[i] < min_similarity:
+                    break
+                campaign_id, timestamp, match_brand, match_type = self._meta[rows[i]]
+                matches.append(BriefMatch(
+                    campaign_id=campaign_id,
+                    similarity=round(float(similarities[i]), 4),
+                    brand_id=match_brand,
+                    content_type=match_type,
+                    timestamp=timestamp
+                ))
+            return matches
+    
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        rows = self._db.execute(
+            "SELECT campaign_id, timestamp, brand_id, content_type, vector FROM brief_vectors "
+            "WHERE model = ? ORDER BY timestamp",
+            (self.model,)
+        ).fetchall()
+        for campaign_id, timestamp, brand_id, content_type, blob in rows:
+            self._append(campaign_id, timestamp, brand_id, content_type, np.frombuffer(blob, dtype=np.float32))
+        self._loaded = True
+    
+    def _append(self, campaign_id: str, timestamp: str, brand_id: str, content_type: str, vector: np.ndarray):
+        if self._matrix is None:
+            self._matrix = np.zeros((64, len(vector)), dtype=np.float32)
+        elif len(vector) != self._matrix.shape[1]:
+            logger.warning(f"Skipping brief vector for {campaign_id}: dimension {len(vector)}")
+            return
+        elif self._size == len(self._matrix):
+            grown = np.zeros((2 * len(self._matrix), self._matrix.shape[1]), dtype=np.float32)
+            grown[:self._size] = self._matrix
+            self._matrix = grown
+        
+        row = self._size
+        self._matrix[row] = vector
+        self._size += 1
+        self._meta.append((campaign_id, timestamp, brand_id, content_type))
+        for key in (("pair", brand_id, content_type), ("brand", brand_id), ("type", content_type)):
+            self._rows.setdefault(key, []).append(row)
+
+brief_index = BriefIndex(BRIEF_INDEX_PATH, EMBEDDING_MODEL)
+
+# ==================== Brand Registry ====================
+
+BRAND_REGISTRY_DIR = Path(os.getenv("BRAND_REGISTRY_DIR", "brands"))
+
+class BrandArtifacts:
+    """One version of a brand: its guidelines and everything compiled from them"""
+    
+    def __init__(
+        self,
+        brand_id: str,
+        version: int,
+        fingerprint: str,
+        guidelines: BrandGuidelines,
+        prefix: str,
+        rules: BrandRules,
+        vectors: Optional[BrandVectors] = None,
+        vectors_file: Optional[str] = None
+    ):
+        self.brand_id = brand_id
+        self.version = version
+        self.fingerprint = fingerprint
+        self.guidelines = guidelines
+        self.prefix = prefix
+        self.rules = rules
+        self.vectors = vectors
+        self.vectors_file = vectors_file
+    
+    @classmethod
+    def compile(cls, brand_id: str, version: int, guidelines: BrandGuidelines) -> "BrandArtifacts":
+        return cls(
+            brand_id=brand_id,
+            version=version,
+            fingerprint=BrandAlignmentScorer.fingerprint(guidelines),
+            guidelines=guidelines,
+            prefix=render_brand_prefix(guidelines),
+            rules=BrandRules(guidelines)
+        )
+
+class BrandRegistry:
+    """Versioned brand store on disk, shared by every worker process
+    
+    Each upload is compiled once into a new version (prompt prefix, rule automata and,
+    in the background, brand vectors). Vectors are written as .npy files and
+    memory-mapped on load. Workers keep the loaded current versions in memory and only
+    re-read the registry after another connection commits (``PRAGMA data_version``).
+    """
+    
+    def __init__(self, root: Path):
+        self.vectors_dir = root / "vectors"
+        self.vectors_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(root / "brands.sqlite"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS brand_versions ("
+            "brand_id TEXT NOT NULL, version INTEGER NOT NULL, fingerprint TEXT NOT NULL, "
+            "created_at TEXT NOT NULL, guidelines TEXT NOT NULL, prefix TEXT NOT NULL, "
+            "rules TEXT NOT NULL, vectors TEXT, PRIMARY KEY (brand_id, version))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS brands ("
+            "brand_id TEXT PRIMARY KEY, version INTEGER NOT NULL, updated_at TEXT NOT NULL)"
+        )
+        self._db.commit()
+        self._data_version: Optional[int] = None
+        self._current: dict[str, tuple[int, Optional[str]]] = {}  # brand_id -> (version, vectors file)
+        self._loaded: dict[str, BrandArtifacts] = {}
+    
+    def get(self, brand_id: str) -> Optional[BrandArtifacts]:
+        """Current version of a brand, or None if it was never uploaded"""
+        with self._lock:
+            self._refresh()
+            current = self._current.get(brand_id)
+            if current is None:
+                return None
+            loaded = self._loaded.get(brand_id)
+            if loaded is None or (loaded.version, loaded.vectors_file) != current:
+                loaded = self._loaded[brand_id] = self._load(brand_id, current[0])
+            return loaded
+    
+    def publish(self, brand_id: str, guidelines: BrandGuidelines) -> BrandArtifacts:
+        """Make guidelines the brand's current version; identical guidelines reuse their version"""
+        artifacts = BrandArtifacts.compile(brand_id, 0, guidelines)
+        now = datetime.now().isoformat()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MAX(version) FROM brand_versions WHERE brand_id = ? AND fingerprint = ?",
+                (brand_id, artifacts.fingerprint)
+            ).fetchone()
+            if row[0] is None:
+                latest = self._db.execute(
+                    "SELECT COALESCE(MAX(version), 0) FROM brand_versions WHERE brand_id = ?", (brand_id,)
+                ).fetchone()[0]
+                artifacts.version = latest + 1
+                self._db.execute(
+                    "INSERT INTO brand_versions VALUES (?, ?, ?, ?, ?, ?, ?, NULL)",
+                    (
+                        brand_id, artifacts.version, artifacts.fingerprint, now,
+                        guidelines.model_dump_json(), artifacts.prefix, json.dumps(artifacts.rules.to_state())
+                    )
+                )
+            else:
+                artifacts.version = row[0]
+            self._db.execute("INSERT OR REPLACE INTO brands VALUES (?, ?, ?)", (brand_id, artifacts.version, now))
+            self._db.commit()
+            self._data_version = None
+        return self.get(brand_id)
+    
+    def activate(self, brand_id: str, version: int) -> Optional[BrandArtifacts]:
+        """Roll a brand back (or forward) to a stored version"""
+        with self._lock:
+            exists = self._db.execute(
+                "SELECT 1 FROM brand_versions WHERE brand_id = ? AND version = ?", (brand_id, version)
+            ).fetchone()
+            if not exists:
+                return None
+            self._db.execute(
+                "INSERT OR REPLACE INTO brands VALUES (?, ?, ?)",
+                (brand_id, version, datetime.now().isoformat())
+            )
+            self._db.commit()
+            self._data_version = None
+        return self.get(brand_id)
+    
+    def attach_vectors(self, brand_id: str, version: int, fingerprint: str, matrix: np.ndarray):
+        """Persist a version's brand vectors; files are named by fingerprint and shared"""
+        name = f"{fingerprint}.npy"
+        path = self.vectors_dir / name
+        if not path.exists():
+            partial = self.vectors_dir / f"{fingerprint}.{uuid.uuid4().hex[:8]}.tmp"
+            with open(partial, "wb") as f:
+                np.save(f, np.ascontiguousarray(matrix, dtype=np.float32))
+            os.replace(partial, path)
+        with self._lock:
+            self._db.execute(
+                "UPDATE brand_versions SET vectors = ? WHERE brand_id = ? AND version = ?",
+                (name, brand_id, version)
+            )
+            self._db.commit()
+            self._data_version = None
+    
+    def versions(self, brand_id: str) -> list[dict]:
+        with self._lock:
+            current = self._db.execute("SELECT version FROM brands WHERE brand_id = ?", (brand_id,)).fetchone()
+            rows = self._db.execute(
+                "SELECT version, fingerprint, created_at, vectors IS NOT NULL FROM brand_versions "
+                "WHERE brand_id = ? ORDER BY version DESC",
+                (brand_id,)
+            ).fetchall()
+        return [
+            {
+                "version": version,
+                "fingerprint": fingerprint,
+                "created_at": created_at,
+                "has_vectors": bool(has_vectors),
+                "current": bool(current) and current[0] == version
+            }
+            for version, fingerprint, created_at, has_vectors in rows
+        ]
+    
+    def _refresh(self):
+        # data_version only changes when another connection commits, so this is one cheap pragma
+        data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        rows = self._db.execute(
+            "SELECT b.brand_id, b.version, v.vectors FROM brands b "
+            "JOIN brand_versions v ON v.brand_id = b.brand_id AND v.version = b.version"
+        ).fetchall()
+        self._current = {brand_id: (version, vectors) for brand_id, version, vectors in rows}
+        self._data_version = data_version
+    
+    def _load(self, brand_id: str, version: int) -> BrandArtifacts:
+        fingerprint, guidelines_json, prefix, rules_json, vectors_file = self._db.execute(
+            "SELECT fingerprint, guidelines, prefix, rules, vectors FROM brand_versions "
+            "WHERE brand_id = ? AND version = ?",
+            (brand_id, version)
+        ).fetchone()
+        guidelines = BrandGuidelines.model_validate_json(guidelines_json)
+        vectors = None
+        if vectors_file:
+            try:
+                matrix = np.load(self.vectors_dir / vectors_file, mmap_mode="r")
+                vectors = BrandVectors.from_matrix(fingerprint, matrix, len(guidelines.values))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Brand vectors for {brand_id} v{version} unavailable: {str(e)}")
+        return BrandArtifacts(
+            brand_id=brand_id,
+            version=version,
+            fingerprint=fingerprint,
+            guidelines=guidelines,
+            prefix=prefix,
+            rules=BrandRules.from_state(json.loads(rules_json)),
+            vectors=vectors,
+            vectors_file=vectors_file
+        )
+
+brand_registry = BrandRegistry(BRAND_REGISTRY_DIR)
+
+def precompute_brand_vectors(artifacts: BrandArtifacts):
+    """Embed a brand version and store the vectors; failures only delay scoring"""
+    try:
+        matrix = BrandAlignmentScorer.embed_brand(artifacts.guidelines)
+        brand_registry.attach_vectors(artifacts.brand_id, artifacts.version, artifacts.fingerprint, matrix)
+    except Exception as e:
+        logger.warning(f"Could not precompute brand vectors for {artifacts.brand_id}: {str(e)}")
+
+# ==================== Context Compaction ====================
+
+# Approximate prompt-token budget for the context each stage receives
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+STAGE_CONTEXT_BUDGETS = {
+    # Compliance should see as much of a long draft as possible; design needs the gist
+    "compliance_officer": 4000,
+    "design_validator": 800,
+    "optimizer": 3000,
+    **{stage: int(budget) for stage, budget in parse_assignments(os.getenv("STAGE_CONTEXT_BUDGETS", "")).items()}
+}
+# Findings always get at least this much room, even next to a long draft
+CONTEXT_MIN_FINDINGS_TOKENS = 200
+CONTEXT_ITEM_CHARS = 240
+
+context_tokens = metrics.counter(
+    "copilot_context_tokens_total",
+    "Estimated context tokens per stage: the full upstream transcript vs what was sent",
+    ("stage", "kind")
+)
+
+def estimate_tokens(text: str) -> int:
+    # About four characters per token for English with the Llama and Mistral tokenizers
+    return (len(text) + 3) // 4
+
+def fit_text(text: str, max_tokens: int) -> str:
+    """Trim text to a token budget, keeping its beginning and end"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    keep = max_tokens * 4
+    head, tail = text[:keep * 2 // 3], text[-(keep // 3):]
+    return f"{head}\n[... {len(text) - len(head) - len(tail)} characters omitted ...]\n{tail}"
+
+def clip(item: str) -> str:
+    item = " ".join(item.split())
+    return item if len(item) <= CONTEXT_ITEM_CHARS else item[:CONTEXT_ITEM_CHARS - 3] + "..."
+
+class ContextCompactor:
+    """Builds each stage's context for one campaign
+    
+    Stages get the current draft plus a short digest of the earlier reviews instead
+    of every upstream output verbatim, within their token budget. Tokens sent are
+    compared with the full transcript each stage would otherwise have received.
+    """
+    
+    def __init__(self):
+        self.usage: dict[str, dict[str, int]] = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def budget(stage: str) -> int:
+        return STAGE_CONTEXT_BUDGETS.get(stage, CONTEXT_TOKEN_BUDGET)
+    
+    def draft_context(self, stage: str, inputs: dict) -> str:
+        """Context for the reviewers: the draft alone, trimmed if it exceeds the budget"""
+        draft = fit_text(inputs["content_creator"], self.budget(stage))
+        return self._record(stage, inputs, f"{STAGE_LABELS['content_creator']}:\n{draft}")
+    
+    def optimizer_context(self, stage: str, inputs: dict, include_design: bool) -> str:
+        """The whole draft (it is being rewritten) and as many findings as fit"""
+        draft = inputs["content_creator"]
+        room = max(self.budget(stage) - estimate_tokens(draft), CONTEXT_MIN_FINDINGS_TOKENS)
+        findings = self.findings(
+            BrandReview.model_validate_json(inputs["brand_manager"]),
+            ComplianceReview.model_validate_json(inputs["compliance_officer"]),
+            DesignRecommendations.model_validate_json(inputs["design_validator"]) if include_design else None,
+            room
+        )
+        context = f"{STAGE_LABELS['content_creator']}:\n{draft}\n\nReview findings:\n{findings}"
+        return self._record(stage, inputs, context)
+    
+    @staticmethod
+    def findings(
+        brand: BrandReview,
+        compliance: ComplianceReview,
+        design: Optional[DesignRecommendations],
+        max_tokens: int
+    ) -> str:
+        """Actionable review items, most important first, cut off at the budget"""
+        headings = {
+            "compliance": f"Compliance (score {compliance.score if compliance.score is not None else 'n/a'})",
+            "brand": f"Brand (score {brand.score if brand.score is not None else 'n/a'})",
+            "design": "Design"
+        }
+        items = [
+            *(("compliance", f"Issue: {item}") for item in compliance.issues),
+            *(("compliance", f"Needs disclaimer or citation: {item}") for item in compliance.flagged_claims),
+            *(("brand", f"Issue: {item}") for item in brand.issues),
+            *(("compliance", f"Fix: {item}") for item in compliance.recommendations),
+            *(("brand", f"Fix: {item}") for item in brand.recommendations)
+        ]
+        # Unstructured answers only have their summary to offer
+        for section, review in (("compliance", compliance), ("brand", brand)):
+            if review.summary and not any(name == section for name, _ in items):
+                items.append((section, review.summary))
+        if design:
+            items.extend(("design", item) for item in design.layout + design.typography)
+        
+        kept: dict[str, list[str]] = {section: [] for section in headings}
+        used = 0
+        omitted = 0
+        for section, item in items:
+            line = f"- {clip(item)}"
+            cost = estimate_tokens(line) + 1
+            if used + cost > max_tokens:
+                omitted += 1
+                continue
+            kept[section].append(line)
+            used += cost
+        
+        lines = []
+        for section, section_lines in kept.items():
+            if section_lines:
+                lines.append(f"{headings[section]}:")
+                lines.extend(section_lines)
+        if omitted:
+            lines.append(f"({omitted} lower-priority findings omitted)")
+        return "\n".join(lines) or "No issues found."
+    
+    def _record(self, stage: str, inputs: dict, context: str) -> str:
+        full = estimate_tokens(build_stage_context(list(inputs), inputs) or "")
+        sent = estimate_tokens(context)
+        context_tokens.inc(full, stage=stage, kind="full")
+        context_tokens.inc(sent, stage=stage, kind="sent")
+        with self._lock:
+            self.usage[stage] = {"full": full, "sent": sent}
+        return context
+    
+    def savings(self) -> dict:
+        with self._lock:
+            usage = {stage: dict(counts) for stage, counts in self.usage.items()}
+        full = sum(counts["full"] for counts in usage.values())
+        sent = sum(counts["sent"] for counts in usage.values())
+        return {"stages": usage, "full": full, "sent": sent, "saved": full - sent}
+
+# ==================== Task Graph ====================
+
+STAGE_WORKERS = int(os.getenv("STAGE_WORKERS", "6"))
+# Attempts per stage when Ollama is briefly unreachable or overloaded
+STAGE_MAX_ATTEMPTS = int(os.getenv("STAGE_MAX_ATTEMPTS", "3"))
+STAGE_RETRY_BACKOFF = float(os.getenv("STAGE_RETRY_BACKOFF", "2"))
+
+stage_retries = metrics.counter(
+    "copilot_stage_retries_total", "Stage attempts repeated after a transient LLM error", ("stage",)
+)
+
+# Separate from the job pool so a job waiting on its stages can never starve them
+stage_executor = ThreadPoolExecutor(
+    max_workers=STAGE_WORKERS,
+    thread_name_prefix="campaign-stage"
+)
+
+STAGE_LABELS = {
+    "content_creator": "Draft content",
+    "brand_rules": "Brand rule check",
+    "brand_alignment": "Brand alignment scores",
+    "brand_manager": "Brand consistency review",
+    "compliance_officer": "Compliance review",
+    "design_validator": "Design recommendations",
+    "optimizer": "Optimized content"
+}
+
+class Stage:
+    """A task in the campaign graph together with the stages it reads from
+    
+    Stages with a ``run`` callable receive their dependencies' outputs directly
+    instead of executing ``task`` with the joined context. A task's answer is
+    validated into ``output_model`` and passed to ``check``, which may raise to
+    stop the graph early. ``route`` is the (tier, model) of the stage's agent.
+    ``context`` builds a task's context from its inputs; by default every
+    dependency's output is joined.
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        task: Optional["Task"] = None,
+        depends_on: Optional[list[str]] = None,
+        run: Optional[Callable[[dict], str]] = None,
+        output_model: Optional[type[BaseModel]] = None,
+        check: Optional[Callable[[BaseModel], None]] = None,
+        route: Optional[tuple[str, str]] = None,
+        context: Optional[Callable[[dict], Optional[str]]] = None
+    ):
+        self.name = name
+        self.task = task
+        self.depends_on = depends_on or []
+        self.run = run
+        self.output_model = output_model
+        self.check = check
+        self.route = route
+        self.context = context
+
+def build_campaign_graph(crew_config: dict, campaign_request: CampaignRequest) -> list[Stage]:
+    """Declare the campaign stages and their dependencies"""
+    review_inputs = ["content_creator"]
+    routes = crew_config["model_routes"]
+    compactor = crew_config.get("context_compactor") or ContextCompactor()
+    brand_guidelines = crew_config["brand_guidelines"]
+    brand_rules = crew_config["brand_rules"]
+    
+    def check_brand_rules(inputs: dict) -> str:
+        report = brand_rules.check(inputs["content_creator"])
+        if report.prohibited_hits and BRAND_RULES_FAIL_FAST:
+            terms = sorted({hit.term for hit in report.prohibited_hits})
+            raise BrandRuleViolation(f"Draft mentions prohibited topics: {', '.join(terms)}")
+        return report.model_dump_json()
+    
+    def score_brand_alignment(inputs: dict) -> str:
+        try:
+            scores = brand_alignment_scorer.score(
+                crew_config["brand_id"], brand_guidelines, inputs["content_creator"],
+                brand=crew_config.get("brand_vectors")
+            )
+        except Exception as e:
+            logger.warning(f"Brand alignment scoring unavailable: {str(e)}")
+            scores = {}
+        return json.dumps(scores)
+    
+    def review_brand(inputs: dict) -> str:
+        report = BrandRuleReport.model_validate_json(inputs["brand_rules"])
+        if report.verdict == "pass" and BRAND_RULES_SKIP_LLM:
+            return BrandReview(summary=f"Automated brand rule check passed.\n{report.describe()}").model_dump_json()
+        context = compactor.draft_context("brand_manager", inputs)
+        if not BRAND_PREFIX_CACHE:
+            task = create_brand_validation_task(crew_config["brand_manager"], brand_guidelines, report)
+            answer = str(task.execute(context=context))
+        else:
+            # Brand block first via the system prompt, then the findings, then the draft
+            tier, model = routes["brand_manager"]
+            key = (model, crew_config["brand_id"], crew_config["brand_prefix"], tier)
+            with brand_agent_pool.checkout(key) as agents:
+                task = create_brand_validation_task(
+                    agents["brand_manager"], brand_guidelines, report, prefixed=True
+                )
+                answer = str(task.execute(context=context))
+        return parse_agent_output(answer, BrandReview, "brand_manager", {"summary": answer}).model_dump_json()
+    
+    def optimize(inputs: dict) -> str:
+        brand = BrandReview.model_validate_json(inputs["brand_manager"])
+        compliance = ComplianceReview.model_validate_json(inputs["compliance_officer"])
+        # Without an LLM brand score (rule check skipped the review) fall back to the embedding score
+        brand_score = brand.score
+        if brand_score is None:
+            brand_score = json.loads(inputs["brand_alignment"]).get("overall")
+        mode = plan_optimization(brand_score, compliance)
+        optimizer_runs.inc(mode=mode)
+        logger.info(f"Optimizer mode {mode} (brand {brand_score}, compliance {compliance.score})")
+        if mode == "skip":
+            return OptimizedContent(content=inputs["content_creator"], mode=mode).model_dump_json()
+        
+        task = create_optimization_task(crew_config["optimizer"], light=mode == "light")
+        context = compactor.optimizer_context("optimizer", inputs, include_design=mode == "full")
+        answer = str(task.execute(context=context))
+        result = parse_agent_output(answer, OptimizedContent, "optimizer", {"content": answer})
+        result.mode = mode
+        return result.model_dump_json()
+    
+    return [
+        Stage(
+            "content_creator",
+            create_content_generation_task(
+                crew_config["content_creator"], campaign_request, crew_config.get("reference_content")
+            ),
+            route=routes["content_creator"]
+        ),
+        Stage("brand_rules", depends_on=review_inputs, run=check_brand_rules),
+        Stage("brand_alignment", depends_on=review_inputs, run=score_brand_alignment),
+        Stage(
+            "brand_manager",
+            depends_on=["content_creator", "brand_rules"],
+            run=review_brand,
+            route=routes["brand_manager"]
+        ),
+        Stage(
+            "compliance_officer",
+            create_compliance_task(crew_config["compliance_officer"]),
+            review_inputs,
+            output_model=ComplianceReview,
+            check=check_compliance,
+            route=routes["compliance_officer"],
+            context=lambda inputs: compactor.draft_context("compliance_officer", inputs)
+        ),
+        Stage(
+            "design_validator",
+            create_design_recommendation_task(crew_config["design_validator"]),
+            review_inputs,
+            output_model=DesignRecommendations,
+            route=routes["design_validator"],
+            context=lambda inputs: compactor.draft_context("design_validator", inputs)
+        ),
+        Stage(
+            "optimizer",
+            depends_on=[
+                "content_creator", "brand_alignment", "brand_manager",
+                "compliance_officer", "design_validator"
+            ],
+            run=optimize,
+            route=routes["optimizer"]
+        )
+    ]
+
+def build_stage_context(names: list[str], outputs: dict) -> Optional[str]:
+    """Join the outputs of the named stages into a task context"""
+    if not names:
+        return None
+    return "\n\n".join(
+        f"{STAGE_LABELS.get(name, name)}:\n{outputs[name]}"
+        for name in names
+    )
+
+def is_transient_error(error: Exception) -> bool:
+    """Errors worth retrying the same stage for: lost connections, timeouts, 429 and 5xx"""
+    if isinstance(error, OllamaServerError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+def run_stage(stage: Stage, inputs: dict) -> str:
+    if stage.run:
+        return stage.run(inputs)
+    context = stage.context(inputs) if stage.context else build_stage_context(stage.depends_on, inputs)
+    output = str(stage.task.execute(context=context))
+    if stage.output_model:
+        parsed = parse_agent_output(output, stage.output_model, stage.name, {"summary": output})
+        if stage.check:
+            stage.check(parsed)
+        output = parsed.model_dump_json()
+    return output
+
+def execute_stage(stage: Stage, inputs: dict, timings: Optional[dict] = None) -> str:
+    """Run a single stage's task with its agent (blocking), recording its wall time
+    
+    Transient LLM errors retry only this stage, with exponential backoff.
+    """
+    _current_stage.set(stage.name)
+    emit_event("stage_start", stage=stage.name)
+    started = datetime.now()
+    attempt = 1
+    while True:
+        try:
+            output = run_stage(stage, inputs)
+            break
+        except Exception as e:
+            if attempt >= STAGE_MAX_ATTEMPTS or not is_transient_error(e):
+                stage_failures.inc(stage=stage.name)
+                raise
+            delay = STAGE_RETRY_BACKOFF * 2 ** (attempt - 1)
+            logger.warning(f"Stage {stage.name} attempt {attempt} failed, retrying in {delay:.0f}s: {str(e)}")
+            stage_retries.inc(stage=stage.name)
+            emit_event("stage_retry", stage=stage.name, attempt=attempt, error=str(e))
+            time.sleep(delay)
+            attempt += 1
+    elapsed = (datetime.now() - started).total_seconds()
+    stage_duration.observe(elapsed, stage=stage.name)
+    if stage.route:
+        model_router.observe(*stage.route, elapsed)
+    if timings is not None:
+        timings[stage.name] = round(elapsed, 3)
+    logger.info(f"Stage {stage.name} finished in {elapsed:.1f}s")
+    emit_event("stage_end", stage=stage.name, elapsed=round(elapsed, 2))
+    return output
+
+def run_task_graph(
+    stages: list[Stage],
+    cancel_event: Optional[threading.Event] = None,
+    timings: Optional[dict] = None,
+    completed: Optional[dict] = None,
+    on_complete: Optional[Callable[[str, str], None]] = None
+) -> dict:
+    """Run stages as soon as their dependencies complete, independent ones in parallel
+    
+    Stages in ``completed`` (outputs restored from a checkpoint) are not run again.
+    ``on_complete(name, output)`` is called for every stage that finishes, including
+    ones still finishing after another stage failed.
+    """
+    outputs = dict(completed or {})
+    pending = {stage.name: stage for stage in stages if stage.name not in outputs}
+    running = {}
+    
+    try:
+        while pending or running:
+            if cancel_event and cancel_event.is_set():
+                raise JobCancelledError("Campaign cancelled")
+            
+            ready = [
+                stage for stage in pending.values()
+                if all(name in outputs for name in stage.depends_on)
+            ]
+            for stage in ready:
+                del pending[stage.name]
+                inputs = {name: outputs[name] for name in stage.depends_on}
+                running[stage_executor.submit(
+                    contextvars.copy_context().run, execute_stage, stage, inputs, timings
+                )] = stage
+            
+            if not running:
+                raise ValueError(f"Unsatisfiable stage dependencies: {', '.join(sorted(pending))}")
+            
+            done, _ = wait_futures(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                outputs[stage.name] = future.result()
+                if on_complete:
+                    on_complete(stage.name, outputs[stage.name])
+    finally:
+        # Let stages that already started finish so their agents are idle before reuse
+        for future in running:
+            future.cancel()
+        wait_futures(running)
+        if on_complete:
+            for future, stage in running.items():
+                if not future.cancelled() and future.exception() is None:
+                    on_complete(stage.name, future.result())
+    
+    return outputs
+
+# ==================== Campaign Pipeline ====================
+
+def get_default_brand_guidelines() -> BrandGuidelines:
+    """Guidelines used when a campaign references an unknown brand"""
+    return BrandGuidelines(
+        brand_name="Default Brand",
+        voice="professional, friendly, informative",
+        tone="conversational",
+        values=["quality", "innovation", "integrity"],
+        colors=["#0066cc", "#333333"],
+        prohibited_topics=[],
+        keywords=[]
+    )
+
+_default_brand: Optional[BrandArtifacts] = None
+
+def resolve_brand(brand_id: Optional[str]) -> BrandArtifacts:
+    """Current compiled version of an uploaded brand, or of the default guidelines"""
+    global _default_brand
+    artifacts = brand_registry.get(brand_id or "default")
+    if artifacts:
+        return artifacts
+    if _default_brand is None:
+        _default_brand = BrandArtifacts.compile("default", 0, get_default_brand_guidelines())
+    return _default_brand
+
+def resolve_brand_context(brand_id: Optional[str]) -> dict:
+    """Everything a campaign needs to know about its brand, resolved once"""
+    artifacts = resolve_brand(brand_id)
+    return {
+        "brand_id": brand_id or "default",
+        "brand_version": artifacts.version,
+        "brand_guidelines": artifacts.guidelines,
+        "brand_rules": artifacts.rules,
+        "brand_prefix": artifacts.prefix,
+        "brand_vectors": artifacts.vectors
+    }
+
+def new_campaign_id() -> str:
+    """Generate a sortable campaign id that is unique across concurrent workers"""
+    return f"campaign_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+def find_duplicate_brief(
+    request: CampaignRequest,
+    brief_vector: Optional[np.ndarray],
+    brand_context: dict
+) -> Optional[tuple[BriefMatch, dict]]:
+    """Closest earlier campaign for the same brand version and content type above the threshold
+    
+    Requests that bypass the cache ask for a fresh generation and are never matched.
+    """
+    if brief_vector is None or DUPLICATE_BRIEF_MODE not in ("reuse", "seed") or request.bypass_cache:
+        return None
+    matches = brief_index.search(
+        brief_vector,
+        limit=1,
+        brand_id=request.brand_id or "default",
+        content_type=request.content_type,
+        min_similarity=DUPLICATE_BRIEF_THRESHOLD
+    )
+    if not matches:
+        return None
+    original = load_campaign(matches[0].campaign_id)
+    # Guidelines changed since the earlier run: its content may no longer be on brand
+    if not original or original.get("brand_version", 0) != brand_context["brand_version"]:
+        return None
+    return matches[0], original
+
+def reuse_campaign(
+    campaign_id: str,
+    request: CampaignRequest,
+    brand_context: dict,
+    match: BriefMatch,
+    original: dict
+) -> CampaignResponse:
+    """Record a new campaign that reuses the result of a near-duplicate brief"""
+    logger.info(f"Reusing {match.campaign_id} for {campaign_id} (similarity {match.similarity})")
+    emit_event("duplicate", campaign_id=match.campaign_id, similarity=match.similarity)
+    
+    campaign_data = {
+        **{key: original.get(key) for key in ("status", "result", "validations", "brand_alignment", "reviews", "agent_feedback")},
+        "campaign_id": campaign_id,
+        "campaign_brief": request.campaign_brief,
+        "target_audience": request.target_audience,
+        "content_type": request.content_type,
+        "brand_id": request.brand_id or "default",
+        "brand_version": brand_context["brand_version"],
+        "timestamp": datetime.now().isoformat(),
+        "duplicate_of": match.campaign_id,
+        "similarity": match.similarity
+    }
+    # Not indexed: the original already represents this brief
+    save_campaign(campaign_id, campaign_data)
+    
+    return CampaignResponse(
+        campaign_id=campaign_id,
+        status=campaign_data["status"] or "completed",
+        content=str(campaign_data["result"]),
+        validations=campaign_data["validations"] or {},
+        agent_feedback=[
+            f"Reused campaign {match.campaign_id} for a near-identical brief "
+            f"(similarity {match.similarity}); no new content was generated"
+        ],
+        timestamp=campaign_data["timestamp"],
+        reused=True,
+        duplicate_of=match.campaign_id,
+        similarity=match.similarity
+    )
+
+def load_checkpoints(campaign_id: str, brand_context: dict) -> dict[str, tuple[str, Optional[float]]]:
+    """Stage outputs a resumed run can keep"""
+    checkpoints = checkpoint_store.stages(campaign_id)
+    run = checkpoint_store.run(campaign_id)
+    if run and run["brand_version"] != brand_context["brand_version"]:
+        # Reviews of the old guidelines are stale; the draft is still worth keeping
+        logger.info(f"Brand changed since {campaign_id} started, keeping only its draft")
+        checkpoint_store.discard_stages(campaign_id, {"content_creator"})
+        checkpoints = {name: value for name, value in checkpoints.items() if name == "content_creator"}
+    return checkpoints
+
+def run_campaign(
+    request: CampaignRequest,
+    cancel_event: Optional[threading.Event] = None,
+    on_event: Optional[Callable[[dict], None]] = None,
+    brand_context: Optional[dict] = None,
+    resume_from: Optional[str] = None
+) -> CampaignResponse:
+    """Run the multi-agent crew for a campaign (blocking)
+    
+    With ``resume_from`` the campaign continues from the stages it checkpointed.
+    """
+    
+    campaign_id = resume_from or new_campaign_id()
+    if on_event:
+        _event_sink.set(on_event)
+    _cache_bypass.set(request.bypass_cache)
+    
+    brand_context = brand_context or resolve_brand_context(request.brand_id)
+    
+    # A near-paraphrase of an earlier brief can reuse its result or seed the new draft
+    brief_vector = embed_brief(request)
+    reference_content = None
+    checkpoints = {}
+    if resume_from:
+        checkpoints = load_checkpoints(campaign_id, brand_context)
+    else:
+        duplicate = find_duplicate_brief(request, brief_vector, brand_context)
+        if duplicate:
+            match, original = duplicate
+            threshold = reuse_threshold() if DUPLICATE_BRIEF_MODE == "reuse" else None
+            if threshold is not None and match.similarity >= threshold:
+                return reuse_campaign(campaign_id, request, brand_context, match, original)
+            reference_content = original.get("result")
+    
+    emit_event("campaign", campaign_id=campaign_id, resumed_stages=sorted(checkpoints))
+    checkpoint_store.begin(campaign_id, request, brand_context["brand_version"])
+    stage_seconds = {name: seconds for name, (_, seconds) in checkpoints.items() if seconds is not None}
+    
+    def checkpoint(stage: str, output: str):
+        try:
+            checkpoint_store.save_stage(campaign_id, stage, output, stage_seconds.get(stage))
+        except sqlite3.Error as e:
+            logger.warning(f"Could not checkpoint {stage} of {campaign_id}: {str(e)}")
+    
+    # Borrow a prebuilt crew for this content type's model routing; it goes back to
+    # the pool once every stage has finished
+    routes = model_router.routes(request.content_type)
+    compactor = ContextCompactor()
+    try:
+        with crew_pool.checkout(crew_key(routes)) as agents:
+            crew_config = {
+                **agents,
+                **brand_context,
+                "model_routes": routes,
+                "context_compactor": compactor,
+                "reference_content": reference_content
+            }
+            
+            # Execute the task graph; the reviews run concurrently on the draft
+            outputs = run_task_graph(
+                build_campaign_graph(crew_config, request),
+                cancel_event,
+                stage_seconds,
+                completed={name: output for name, (output, _) in checkpoints.items()},
+                on_complete=checkpoint
+            )
+    except JobCancelledError:
+        checkpoint_store.fail(campaign_id, "cancelled", "Campaign cancelled")
+        raise
+    except Exception as e:
+        checkpoint_store.fail(campaign_id, "failed", str(e))
+        raise
+    context_usage = compactor.savings()
+    logger.info(
+        f"Campaign {campaign_id} context: sent {context_usage['sent']} of "
+        f"{context_usage['full']} estimated tokens ({context_usage['saved']} saved)"
+    )
+    optimized = OptimizedContent.model_validate_json(outputs["optimizer"])
+    result = optimized.content
+    rule_report = BrandRuleReport.model_validate_json(outputs["brand_rules"])
+    alignment = json.loads(outputs["brand_alignment"])
+    brand_review = BrandReview.model_validate_json(outputs["brand_manager"])
+    compliance_review = ComplianceReview.model_validate_json(outputs["compliance_officer"])
+    design = DesignRecommendations.model_validate_json(outputs["design_validator"])
+    
+    validations = {
+        "brand_alignment": alignment.get("overall"),
+        "brand_consistency": brand_review.score,
+        "compliance": compliance_review.score,
+        "readability": optimized.readability_after,
+        "overall_quality": optimized.quality_score,
+        "prohibited_terms": len(rule_report.prohibited_hits),
+        "keyword_coverage": round(rule_report.keyword_coverage * 100)
+    }
+    feedback = {
+        "brand_manager": brand_review.summary or "Validated brand consistency",
+        "compliance_officer": compliance_review.summary or "Reviewed for legal issues",
+        "design_validator": design.summary or "Provided design recommendations",
+        "optimizer": {
+            "skip": "Draft cleared the quality thresholds; optimization skipped",
+            "light": "Applied the reviewers' fixes",
+            "full": "Finalized and optimized"
+        }[optimized.mode]
+    }
+    
+    status = "completed"
+    if alignment.get("overall") is not None and alignment["overall"] < BRAND_ALIGNMENT_MIN:
+        status = "needs_review"
+    
+    # Prepare response
+    campaign_data = {
+        "campaign_id": campaign_id,
+        "status": status,
+        "campaign_brief": request.campaign_brief,
+        "target_audience": request.target_audience,
+        "content_type": request.content_type,
+        "brand_id": request.brand_id or "default",
+        "brand_version": brand_context["brand_version"],
+        "timestamp": datetime.now().isoformat(),
+        "result": str(result),
+        "validations": validations,
+        "brand_alignment": alignment,
+        "stage_seconds": stage_seconds,
+        "context_tokens": context_usage,
+        "reviews": {
+            "brand_manager": brand_review.model_dump(),
+            "compliance_officer": compliance_review.model_dump(),
+            "design_validator": design.model_dump(),
+            "optimizer": optimized.model_dump(exclude={"content"})
+        },
+        "agent_feedback": {"content_creator": "Generated initial content", **feedback}
+    }
+    
+    # Save campaign
+    save_campaign(campaign_id, campaign_data, brief_vector)
+    checkpoint_store.complete(campaign_id)
+    
+    return CampaignResponse(
+        campaign_id=campaign_id,
+        status=status,
+        content=str(result),
+        validations=validations,
+        agent_feedback=[f"{STAGE_LABELS[stage]}: {text}" for stage, text in feedback.items()],
+        timestamp=datetime.now().isoformat()
+    )
+
+# ==================== Job Queue ====================
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "100"))
+JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", "1000"))
+JOB_DRAIN_TIMEOUT = float(os.getenv("JOB_DRAIN_TIMEOUT", "300"))
+JOB_DEFAULT_DURATION = 120.0
+# Identical requests submitted while one is queued or running share that job
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() == "true"
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_KEY_LIMIT = int(os.getenv("IDEMPOTENCY_KEY_LIMIT", "10000"))
+
+coalesced_requests = metrics.counter(
+    "copilot_coalesced_requests_total",
+    "Campaign requests served by an existing job instead of a new one",
+    ("reason",)
+)
+
+def request_fingerprint(request: CampaignRequest) -> str:
+    """Hash of the request fields that determine its result, whitespace and case normalized"""
+    normalized = [
+        " ".join(request.campaign_brief.lower().split()),
+        " ".join(request.target_audience.lower().split()),
+        request.content_type,
+        request.brand_id or "default",
+        str(request.bypass_cache)
+    ]
+    return hashlib.sha256("\x1f".join(normalized).encode()).hexdigest()
+
+def failure_status(error: Exception) -> tuple[int, Optional[int]]:
+    """HTTP status and Retry-After seconds for a job that raised
+    
+    Only the app's own exceptions choose a status, as a class attribute. A failure of
+    Ollama or of the connection to it is a bad gateway, whatever status Ollama sent.
+    """
+    if isinstance(error, OllamaUnavailableError):
+        return error.status_code, error.retry_after
+    if isinstance(error, (OllamaServerError, requests.RequestException)):
+        return 502, None
+    return getattr(type(error), "status_code", 500), None
+
+class Job:
+    """A campaign request tracked through the worker pool"""
+    
+    def __init__(
+        self,
+        request: CampaignRequest,
+        on_event: Optional[Callable[[dict], None]] = None,
+        brand_context: Optional[dict] = None,
+        priority: str = "interactive",
+        resume_from: Optional[str] = None
+    ):
+        self.job_id = f"job_{uuid.uuid4().hex[:12]}"
+        self.request = request
+        self.on_event = on_event
+        self.brand_context = brand_context
+        self.priority = priority
+        self.resume_from = resume_from
+        self.campaign_id = resume_from
+        self.status = "queued"
+        self.submitted_at = datetime.now().isoformat()
+        self.started_at = None
+        self.finished_at = None
+        self.result: Optional[CampaignResponse] = None
+        self.error: Optional[str] = None
+        self.error_status = 500
+        self.retry_after: Optional[int] = None
+        self.cancel_event = threading.Event()
+        self.future: Future = Future()
+        self.key: Optional[str] = None  # coalescing key while queued or running
+        self.requests = 1
+        self._enqueued = time.monotonic()
+        self._listeners = [on_event] if on_event else []
+        self._history: list[dict] = []
+        self._listeners_lock = threading.Lock()
+        # Always relay, so requests that attach later still get the remaining events
+        self.on_event = self.broadcast
+    
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+    
+    def broadcast(self, event: dict):
+        """Deliver an event to every attached listener, keeping all but tokens for replay"""
+        if event["event"] == "campaign":
+            self.campaign_id = event["campaign_id"]
+        with self._listeners_lock:
+            if event["event"] != "token":
+                self._history.append(event)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.warning(f"Could not deliver {event['event']} event for {self.job_id}: {str(e)}")
+    
+    def attach(self, on_event: Optional[Callable[[dict], None]] = None):
+        """Share this job with another identical request, replaying the events so far"""
+        self.requests += 1
+        if on_event is None:
+            return
+        with self._listeners_lock:
+            for event in self._history:
+                on_event(event)
+            self._listeners.append(on_event)
+    
+    async def wait(self):
+        """Await completion without blocking the event loop"""
+        await asyncio.wait([asyncio.wrap_future(self.future)])
+        if self.future.cancelled():
+            self.status = "cancelled"
+    
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "priority": self.priority,
+            "campaign_id": self.result.campaign_id if self.result else self.campaign_id,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "requests": self.requests
+        }
+
+class JobManager:
+    """Bounded, priority-ordered worker pool that runs campaign crews off the event loop"""
+    
+    def __init__(self, max_workers: int, max_queue: int, history_limit: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.history_limit = history_limit
+        self.wait_stats = WaitStats()
+        self._jobs: dict[str, Job] = {}
+        self._inflight: dict[str, Job] = {}
+        self._idempotency: OrderedDict[str, tuple[str, Job, float]] = OrderedDict()
+        self._queue: list[tuple[int, int, Job]] = []
+        self._seq = itertools.count()
+        self._durations: deque[float] = deque(maxlen=50)
+        self._cond = threading.Condition()
+        self._accepting = True
+        self._stopping = False
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"campaign-worker-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+    
+    def submit(
+        self,
+        request: CampaignRequest,
+        on_event: Optional[Callable[[dict], None]] = None,
+        brand_context: Optional[dict] = None,
+        priority: str = "interactive",
+        idempotency_key: Optional[str] = None,
+        resume_from: Optional[str] = None
+    ) -> Job:
+        """Queue a campaign request, raising QueueFullError when saturated
+        
+        A request carrying a known idempotency key, or identical to one that is
+        still queued or running, attaches to that job instead of starting another.
+        """
+        fingerprint = request_fingerprint(request)
+        key = None
+        if resume_from:
+            # Only one run per campaign may write its checkpoints
+            key = f"resume:{resume_from}"
+        elif COALESCE_REQUESTS and not request.bypass_cache:
+            # The brand version is part of the key: new guidelines mean a different result.
+            # Requests that bypass the cache ask for a fresh generation and never share a job.
+            brand_context = brand_context or resolve_brand_context(request.brand_id)
+            key = f"{fingerprint}:{brand_context['brand_version']}"
+        
+        with self._cond:
+            if not self._accepting:
+                raise ShuttingDownError("Server is shutting down, not accepting new jobs")
+            existing, reason = self._idempotent_job(idempotency_key, fingerprint), "idempotency_key"
+            if existing is None and key:
+                existing, reason = self._inflight.get(key), "in_flight"
+            if existing is not None:
+                existing.attach(on_event)
+                self._promote(existing, priority)
+                self._remember(idempotency_key, fingerprint, existing)
+                coalesced_requests.inc(reason=reason)
+                return existing
+            
+            # New work would only wait out timeouts while the model server is down
+            ollama_breaker.check()
+            depth = self._count("queued")
+            if depth >= self.max_queue:
+                raise QueueFullError(
+                    f"Job queue is full ({self.max_queue} pending)",
+                    retry_after=self._estimate_wait(depth)
+                )
+            job = Job(request, on_event, brand_context, priority, resume_from)
+            job.key = key
+            if key:
+                self._inflight[key] = job
+            self._remember(idempotency_key, fingerprint, job)
+            self._jobs[job.job_id] = job
+            self._prune()
+            heapq.heappush(self._queue, (PRIORITIES.get(priority, len(PRIORITIES)), next(self._seq), job))
+            self._cond.notify()
+        return job
+    
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+    
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job; running crews stop at the next checkpoint"""
+        job = self._jobs.get(job_id)
+        if not job or job.finished:
+            return False
+        job.cancel_event.set()
+        if job.future.cancel():
+            self._finish(job, "cancelled")
+        return True
+    
+    def detach(self, job: Job):
+        """Drop one request's interest in a job, cancelling it once nobody is waiting"""
+        with self._cond:
+            job.requests -= 1
+            abandoned = job.requests <= 0
+        if abandoned:
+            self.cancel(job.job_id)
+    
+    def queue_depth(self) -> int:
+        with self._cond:
+            return self._count("queued")
+    
+    def stats(self) -> dict:
+        with self._cond:
+            counts = {}
+            queued_by_priority = {name: 0 for name in PRIORITIES}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+                if job.status == "queued":
+                    queued_by_priority[job.priority] = queued_by_priority.get(job.priority, 0) + 1
+        return {
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "queue_depth": counts.get("queued", 0),
+            "queued_by_priority": queued_by_priority,
+            "running": counts.get("running", 0),
+            "completed": counts.get("completed", 0),
+            "failed": counts.get("failed", 0),
+            "cancelled": counts.get("cancelled", 0),
+            "accepting": self._accepting,
+            "in_flight_keys": len(self._inflight),
+            "idempotency_keys": len(self._idempotency),
+            "queue_wait_seconds": self.wait_stats.summary()
+        }
+    
+    def shutdown(self, timeout: float):
+        """Stop accepting jobs, wait for pending ones, then cancel the rest"""
+        with self._cond:
+            self._accepting = False
+            pending = [job for job in self._jobs.values() if not job.finished]
+        
+        logger.info(f"Draining {len(pending)} job(s) (timeout {timeout}s)")
+        _, not_done = wait_futures([job.future for job in pending], timeout=timeout)
+        
+        for job in pending:
+            if job.future in not_done:
+                self.cancel(job.job_id)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+    
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopping:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                _, _, job = heapq.heappop(self._queue)
+                # A promoted job leaves a stale entry behind at its old priority
+                if job.status != "queued":
+                    continue
+                job.status = "running"
+            
+            # False when the job was cancelled while it sat in the queue
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            waited = time.monotonic() - job._enqueued
+            self.wait_stats.observe(waited)
+            job_queue_wait.observe(waited, priority=job.priority)
+            started = time.monotonic()
+            self._run(job)
+            self._durations.append(time.monotonic() - started)
+            job.future.set_result(None)
+    
+    def _run(self, job: Job):
+        """Worker entry point; outcomes are recorded on the job, never raised"""
+        if job.cancel_event.is_set():
+            self._finish(job, "cancelled")
+            return
+        
+        job.status = "running"
+        job.started_at = datetime.now().isoformat()
+        _request_priority.set(job.priority)
+        try:
+            job.result = run_campaign(
+                job.request, job.cancel_event, job.on_event, job.brand_context, job.resume_from
+            )
+        except JobCancelledError:
+            self._finish(job, "cancelled")
+            return
+        except Exception as e:
+            logger.error(f"Campaign creation error: {str(e)}")
+            job.error = str(e)
+            job.error_status, job.retry_after = failure_status(e)
+            self._finish(job, "failed")
+            return
+        
+        self._finish(job, "completed")
+    
+    def _finish(self, job: Job, status: str):
+        with self._cond:
+            job.status = status
+            job.finished_at = datetime.now().isoformat()
+            if job.key and self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+        event = job.to_dict()
+        if job.result:
+            event["result"] = job.result.model_dump()
+        job.broadcast({"event": status, **event})
+    
+    def _idempotent_job(self, idempotency_key: Optional[str], fingerprint: str) -> Optional[Job]:
+        """The job an idempotency key already stands for; failed and cancelled ones may be retried"""
+        if not idempotency_key:
+            return None
+        entry = self._idempotency.get(idempotency_key)
+        if entry is None:
+            return None
+        known_fingerprint, job, expires = entry
+        if expires < time.monotonic():
+            del self._idempotency[idempotency_key]
+            return None
+        if known_fingerprint != fingerprint:
+            raise IdempotencyConflict("Idempotency-Key was already used for a different request")
+        if job.status in ("failed", "cancelled"):
+            return None
+        return job
+    
+    def _remember(self, idempotency_key: Optional[str], fingerprint: str, job: Job):
+        if not idempotency_key:
+            return
+        self._idempotency[idempotency_key] = (fingerprint, job, time.monotonic() + IDEMPOTENCY_TTL)
+        self._idempotency.move_to_end(idempotency_key)
+        while len(self._idempotency) > IDEMPOTENCY_KEY_LIMIT:
+            self._idempotency.popitem(last=False)
+    
+    def _promote(self, job: Job, priority: str):
+        """Requeue a waiting job at a more urgent priority when an urgent request joins it"""
+        rank = PRIORITIES.get(priority, len(PRIORITIES))
+        if job.status == "queued" and rank < PRIORITIES.get(job.priority, len(PRIORITIES)):
+            job.priority = priority
+            heapq.heappush(self._queue, (rank, next(self._seq), job))
+            self._cond.notify()
+    
+    def _estimate_wait(self, depth: int) -> int:
+        """Seconds until a queue slot is likely to free up"""
+        average = sum(self._durations) / len(self._durations) if self._durations else JOB_DEFAULT_DURATION
+        return max(1, math.ceil(average * max(1, depth - self.max_queue + 1) / self.max_workers))
+    
+    def _count(self, status: str) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == status)
+    
+    def _prune(self):
+        """Forget the oldest finished jobs beyond the history limit"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.history_limit)]:
+            del self._jobs[job_id]
+
+job_manager = JobManager(
+    max_workers=JOB_WORKERS,
+    max_queue=JOB_QUEUE_LIMIT,
+    history_limit=JOB_HISTORY_LIMIT
+)
+
+def submit_job_or_reject(request: CampaignRequest, **kwargs) -> Job:
+    """Submit a job, turning admission failures into 429/503 responses with Retry-After"""
+    try:
+        return job_manager.submit(request, **kwargs)
+    except ShuttingDownError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    except OllamaUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+# Failures worth resuming: Ollama errored or was unavailable. Rule violations (422) fail the same way again
+RESUMABLE_STATUSES = {502, 503}
+
+def failure_detail(job: Job) -> str:
+    detail = f"Campaign creation failed: {job.error}"
+    if job.campaign_id and job.error_status in RESUMABLE_STATUSES:
+        detail += f" (completed stages are kept; resume with POST /api/campaign/{job.campaign_id}/resume)"
+    return detail
+
+def failure_error(job: Job) -> HTTPException:
+    """HTTP error for a failed job, with Retry-After when the model server was unavailable"""
+    headers = {"Retry-After": str(job.retry_after)} if job.retry_after else None
+    return HTTPException(status_code=job.error_status, detail=failure_detail(job), headers=headers)
+
+# ==================== Warm-up ====================
+
+# Preload in the background at startup; set false for processes that only serve stored campaigns
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "300"))
+# Failed required steps retry after this many seconds, doubling up to the maximum
+WARMUP_RETRY_BACKOFF = float(os.getenv("WARMUP_RETRY_BACKOFF", "5"))
+WARMUP_RETRY_MAX_DELAY = float(os.getenv("WARMUP_RETRY_MAX_DELAY", "300"))
+
+def load_ollama_model(model: str = OLLAMA_MODEL):
+    """Ask Ollama to load a model into memory without generating anything"""
+    response = ollama_session.post(
+        f"{OLLAMA_BASE_URL}/api/generate",
+        json={"model": model, "keep_alive": OLLAMA_KEEP_ALIVE},
+        timeout=WARMUP_TIMEOUT
+    )
+    response.raise_for_status()
+
+def load_routed_models():
+    """Load every model an agent can be routed to"""
+    for model in model_router.models():
+        load_ollama_model(model)
+
+class Warmup:
+    """Runs preload steps on a background thread and tracks their progress
+    
+    Required steps gate readiness; optional ones only degrade features that already
+    fall back gracefully (brand alignment scoring without embeddings). Failed required
+    steps are retried with exponential backoff, or at once via ``retry_now`` (called
+    when the health probe sees Ollama come back), until they succeed.
+    """
+    
+    def __init__(
+        self,
+        steps: list[tuple[str, Callable[[], object], bool]],
+        retry_backoff: float = 5,
+        retry_max_delay: float = 300
+    ):
+        self.steps = steps
+        self.retry_backoff = retry_backoff
+        self.retry_max_delay = retry_max_delay
+        self.state = "idle"  # idle -> running -> ready | failed (-> running again on retry)
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.attempts = 0
+        self.next_retry_at: Optional[str] = None
+        self.components = {name: {"status": "pending", "required": required} for name, _, required in steps}
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+    
+    def start(self) -> bool:
+        """Begin warming up unless it is already running or done; a failed run retries at once"""
+        with self._lock:
+            if self.state in ("running", "ready"):
+                return False
+            if self.state == "failed":
+                self._wake.set()
+                return True
+            self.state = "running"
+            self.started_at = datetime.now().isoformat()
+            self.finished_at = None
+            self.components = {
+                name: {"status": "pending", "required": required} for name, _, required in self.steps
+            }
+        threading.Thread(target=self._run, name="warmup", daemon=True).start()
+        return True
+    
+    def retry_now(self):
+        """Skip the remaining backoff of a failed warm-up"""
+        with self._lock:
+            if self.state == "failed":
+                self._wake.set()
+    
+    def _run(self):
+        steps = self.steps
+        delay = self.retry_backoff
+        while True:
+            failed = self._run_steps(steps)
+            with self._lock:
+                self.attempts += 1
+                self.finished_at = datetime.now().isoformat()
+                if not failed:
+                    self.state = "ready"
+                    self.next_retry_at = None
+                    logger.info("Warm-up ready")
+                    return
+                self.state = "failed"
+                self.next_retry_at = (datetime.now() + timedelta(seconds=delay)).isoformat()
+                self._wake.clear()
+            logger.warning(f"Warm-up failed at {', '.join(failed)}; retrying in {delay:.0f}s")
+            self._wake.wait(delay)
+            with self._lock:
+                self.state = "running"
+                self.next_retry_at = None
+            steps = [step for step in self.steps if step[0] in failed]
+            delay = min(delay * 2, self.retry_max_delay)
+    
+    def _run_steps(self, steps: list[tuple[str, Callable[[], object], bool]]) -> list[str]:
+        """Run steps in order; returns the required ones that failed"""
+        failed = []
+        for name, step, required in steps:
+            self._update(name, status="running")
+            started = time.monotonic()
+            try:
+                step()
+            except Exception as e:
+                logger.warning(f"Warm-up step {name} failed: {str(e)}")
+                if required:
+                    failed.append(name)
+                self._update(name, status="failed", error=str(e), seconds=round(time.monotonic() - started, 2))
+            else:
+                self._update(name, status="ready", error=None, seconds=round(time.monotonic() - started, 2))
+        return failed
+    
+    def _update(self, name: str, **fields):
+        with self._lock:
+            self.components[name] = {**self.components[name], **fields}
+    
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "attempts": self.attempts,
+                "next_retry_at": self.next_retry_at,
+                "components": {name: dict(info) for name, info in self.components.items()}
+            }
+
+warmup = Warmup([
+    ("agents", lambda: crew_pool.warm(crew_key(model_router.routes()), count=min(JOB_WORKERS, CREW_POOL_SIZE)), True),
+    ("llm", load_routed_models, True),
+    ("embeddings", lambda: embed_texts(["warm-up"]), False),
+], retry_backoff=WARMUP_RETRY_BACKOFF, retry_max_delay=WARMUP_RETRY_MAX_DELAY)
+# Ollama coming back is the usual reason a failed warm-up can now succeed
+ollama_probe.on_recover.append(warmup.retry_now)
+
 # ==================== FastAPI Application ====================
 
 app = FastAPI(
     title="Creative Media Co-Pilot API",
     description="Multi-agent AI system for collaborative creative content",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS
@@ -290,8 +3976,93 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Store brand guidelines in memory
-brand_guidelines_store = {}
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.monotonic()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template so /api/jobs/{job_id} stays one series
+        route = request.scope.get("route")
+        http_request_duration.observe(
+            time.monotonic() - started,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status
+        )
+
+@metrics.collector
+def collect_runtime_metrics() -> list[tuple]:
+    jobs = job_manager.stats()
+    gate = llm_gate.stats()
+    cache = dict(llm_cache.counters)
+    breaker = ollama_breaker.snapshot()
+    probe = ollama_probe.snapshot()
+    return [
+        ("copilot_job_queue_depth", "gauge", "Jobs waiting for a worker",
+         [({"priority": name}, count) for name, count in jobs["queued_by_priority"].items()]),
+        ("copilot_jobs_running", "gauge", "Jobs currently running", [({}, jobs["running"])]),
+        ("copilot_llm_gate_active", "gauge", "LLM calls holding an admission slot", [({}, gate["active"])]),
+        ("copilot_llm_gate_waiting", "gauge", "LLM calls waiting for an admission slot", [({}, gate["waiting"])]),
+        ("copilot_llm_cache_lookups_total", "counter", "LLM cache lookups by outcome",
+         [({"result": result}, cache[result]) for result in ("memory_hits", "disk_hits", "misses")]),
+        ("copilot_ollama_breaker_state", "gauge", "1 for the circuit breaker's current state",
+         [({"state": state}, int(breaker["state"] == state)) for state in ("closed", "open", "half_open")]),
+        ("copilot_ollama_up", "gauge", "Whether the last health probe reached Ollama",
+         [({}, int(probe["status"] == "up"))]),
+    ]
+
+SSE_KEEPALIVE_INTERVAL = 15
+
+def format_sse(event: dict) -> str:
+    """Encode an event dict as a server-sent event frame"""
+    return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+COMPRESS_MIN_BYTES = 1024
+
+def compress_body(request: Request, body: bytes) -> tuple[bytes, Optional[str]]:
+    """Compress with the best encoding the client accepts; small bodies are sent as is"""
+    if len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    accepted = {part.split(";")[0].strip().lower() for part in request.headers.get("accept-encoding", "").split(",")}
+    if brotli is not None and "br" in accepted:
+        return brotli.compress(body, quality=4), "br"
+    if "gzip" in accepted:
+        return gzip.compress(body, compresslevel=5), "gzip"
+    return body, None
+
+def conditional_json(request: Request, content) -> Response:
+    """Compressed JSON tagged with an ETag; 304 with no body when the client already has it"""
+    body = orjson.dumps(content, default=jsonable_encoder)
+    etag = f'W/"{hashlib.sha1(body).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    body, encoding = compress_body(request, body)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type="application/json", headers=headers)
+
+def parse_fields(fields: Optional[str]) -> Optional[list[str]]:
+    """``?fields=a,b`` as a list of top-level keys, or None for everything"""
+    if not fields:
+        return None
+    return [name.strip() for name in fields.split(",") if name.strip()]
+
+def select_fields(item: dict, fields: Optional[list[str]]) -> dict:
+    if fields is None:
+        return item
+    return {name: item[name] for name in fields if name in item}
+
+def retire_brand_prefix(brand_id: str, previous: Optional[BrandArtifacts], current: BrandArtifacts):
+    """A changed prefix makes the old brand-scoped clients and agents unreachable"""
+    if previous and previous.prefix != current.prefix:
+        brand_agent_pool.discard(lambda key: key[1] == brand_id and key[2] == previous.prefix)
+        discard_llm_clients(previous.prefix)
 
 @app.get("/")
 def root():
@@ -314,11 +4085,21 @@ async def upload_brand_guidelines(
         
         # Validate required fields
         brand_guidelines = BrandGuidelines(**guidelines)
-        brand_guidelines_store[brand_id] = brand_guidelines
+        
+        # Compile and persist a new version; other workers pick it up on their next lookup
+        loop = asyncio.get_running_loop()
+        previous = brand_registry.get(brand_id)
+        artifacts = await loop.run_in_executor(None, brand_registry.publish, brand_id, brand_guidelines)
+        retire_brand_prefix(brand_id, previous, artifacts)
+        
+        # Embed the brand side in the background so the first campaign only encodes its draft
+        if artifacts.vectors is None:
+            loop.run_in_executor(None, precompute_brand_vectors, artifacts)
         
         return {
             "status": "success",
             "brand_id": brand_id,
+            "version": artifacts.version,
             "message": "Brand guidelines uploaded successfully"
         }
     except json.JSONDecodeError:
@@ -326,141 +4107,472 @@ async def upload_brand_guidelines(
     except ValueError as e:
         raise HTTPException(status_code=400, detail=f"Validation error: {str(e)}")
 
+@app.get("/api/brand/{brand_id}")
+def get_brand(brand_id: str):
+    """Current version of an uploaded brand"""
+    artifacts = brand_registry.get(brand_id)
+    if not artifacts:
+        raise HTTPException(status_code=404, detail="Brand not found")
+    return {
+        "brand_id": brand_id,
+        "version": artifacts.version,
+        "fingerprint": artifacts.fingerprint,
+        "has_vectors": artifacts.vectors is not None,
+        "guidelines": artifacts.guidelines
+    }
+
+@app.get("/api/brand/{brand_id}/versions")
+def list_brand_versions(brand_id: str):
+    versions = brand_registry.versions(brand_id)
+    if not versions:
+        raise HTTPException(status_code=404, detail="Brand not found")
+    return {"brand_id": brand_id, "versions": versions}
+
+@app.post("/api/brand/{brand_id}/versions/{version}/activate")
+def activate_brand_version(brand_id: str, version: int):
+    """Make a stored version current again, e.g. to roll back an upload"""
+    previous = brand_registry.get(brand_id)
+    artifacts = brand_registry.activate(brand_id, version)
+    if not artifacts:
+        raise HTTPException(status_code=404, detail="Brand version not found")
+    retire_brand_prefix(brand_id, previous, artifacts)
+    return {"status": "success", "brand_id": brand_id, "version": artifacts.version}
+
+@app.post("/api/brand/{brand_id}/check")
+def check_brand_text(brand_id: str, request: BrandCheckRequest):
+    """Run the deterministic brand rules over a piece of text"""
+    return resolve_brand(brand_id).rules.check(request.text)
+
 @app.post("/api/campaign/create")
-async def create_campaign(request: CampaignRequest):
+async def create_campaign(
+    request: CampaignRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """Create a new campaign with multi-agent collaboration"""
+    job = submit_job_or_reject(request, idempotency_key=idempotency_key)
     
-    campaign_id = f"campaign_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    await job.wait()
+    if job.status == "cancelled":
+        raise HTTPException(status_code=409, detail=f"Job {job.job_id} was cancelled")
+    if job.status == "failed":
+        raise failure_error(job)
+    return job.result
+
+@app.post("/api/campaign/{campaign_id}/resume")
+async def resume_campaign(campaign_id: str):
+    """Continue a failed, cancelled or interrupted campaign from its last completed stages"""
+    checkpoint_store.mark_interrupted()
+    run = checkpoint_store.run(campaign_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="No resumable run for this campaign")
+    if run["status"] == "running":
+        raise HTTPException(status_code=409, detail=f"Campaign is still running on {run['owner']}")
     
-    try:
-        # Get brand guidelines
-        brand_id = request.brand_id or "default"
-        brand_guidelines = brand_guidelines_store.get(brand_id)
-        
-        if not brand_guidelines:
-            # Use default guidelines if not found
-            brand_guidelines = BrandGuidelines(
-                brand_name="Default Brand",
-                voice="professional, friendly, informative",
-                tone="conversational",
-                values=["quality", "innovation", "integrity"],
-                colors=["#0066cc", "#333333"],
-                prohibited_topics=[],
-                keywords=[]
-            )
-        
-        # Create crew
-        crew_config = create_creative_crew(brand_guidelines)
-        
-        # Create tasks
-        content_task = create_content_generation_task(
-            crew_config["content_creator"],
-            request
-        )
-        brand_task = create_brand_validation_task(
-            crew_config["brand_manager"],
-            brand_guidelines
-        )
-        compliance_task = create_compliance_task(
-            crew_config["compliance_officer"]
-        )
-        design_task = create_design_recommendation_task(
-            crew_config["design_validator"]
-        )
-        optimization_task = create_optimization_task(
-            crew_config["optimizer"]
-        )
-        
-        # Create and run crew
-        crew = Crew(
-            agents=[
-                crew_config["content_creator"],
-                crew_config["brand_manager"],
-                crew_config["compliance_officer"],
-                crew_config["design_validator"],
-                crew_config["optimizer"]
-            ],
-            tasks=[
-                content_task,
-                brand_task,
-                compliance_task,
-                design_task,
-                optimization_task
-            ],
-            verbose=True
-        )
-        
-        # Execute crew
-        result = crew.kickoff()
-        
-        # Prepare response
-        campaign_data = {
-            "campaign_id": campaign_id,
-            "status": "completed",
-            "campaign_brief": request.campaign_brief,
-            "content_type": request.content_type,
-            "timestamp": datetime.now().isoformat(),
-            "result": str(result),
-            "agent_feedback": {
-                "content_creator": "Generated initial content",
-                "brand_manager": "Validated brand consistency",
-                "compliance_officer": "Reviewed for legal issues",
-                "design_validator": "Provided design recommendations",
-                "optimizer": "Finalized and optimized"
-            }
-        }
+    job = submit_job_or_reject(CampaignRequest(**run["request"]), resume_from=campaign_id)
+    await job.wait()
+    if job.status == "cancelled":
+        raise HTTPException(status_code=409, detail=f"Job {job.job_id} was cancelled")
+    if job.status == "failed":
+        raise failure_error(job)
+    return job.result
+
+@app.get("/api/campaign/{campaign_id}/checkpoint")
+def get_campaign_checkpoint(campaign_id: str):
+    """Status, error and completed stages of an unfinished campaign run"""
+    run = checkpoint_store.run(campaign_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="No unfinished run for this campaign")
+    return run
+
+@app.get("/api/campaigns/incomplete")
+def list_incomplete_campaigns(limit: int = Query(20, ge=1, le=100)):
+    """Failed, cancelled and interrupted runs that can be resumed"""
+    return {"runs": checkpoint_store.incomplete(limit)}
+
+@app.post("/api/campaign/stream")
+async def stream_campaign(
+    request: CampaignRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Create a campaign and stream stage events and LLM tokens as server-sent events"""
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    
+    def on_event(event: dict):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+    
+    job = submit_job_or_reject(request, on_event=on_event, idempotency_key=idempotency_key)
+    
+    async def event_stream():
+        # The job keeps running if the client disconnects; results stay available via /api/jobs
+        yield format_sse({"event": "queued", **job.to_dict()})
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), timeout=SSE_KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(event)
+            if event["event"] in ("completed", "failed", "cancelled"):
+                break
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# How long a batch keeps retrying while the queue is full or Ollama is down before
+# failing the items it could not submit
+BATCH_MAX_WAIT = float(os.getenv("BATCH_MAX_WAIT", "300"))
+
+@app.post("/api/campaigns/batch")
+async def create_campaign_batch(batch: BatchCampaignRequest):
+    """Run many campaigns with shared brand context, streaming each result as it completes"""
+    brand_contexts = {
+        brand_id: resolve_brand_context(brand_id)
+        for brand_id in {request.brand_id or "default" for request in batch.campaigns}
+    }
+    
+    async def event_stream():
+        pending = deque(enumerate(batch.campaigns))
+        running: dict[asyncio.Task, tuple[int, Job]] = {}
+        counts = {"completed": 0, "failed": 0, "cancelled": 0, "rejected": 0}
+        waiting_since = None
+        yield format_sse({"event": "batch_started", "total": len(pending), "concurrency": batch.concurrency})
         
-        # Save campaign
-        save_campaign(campaign_id, campaign_data)
-        
-        return CampaignResponse(
-            campaign_id=campaign_id,
-            status="completed",
-            content=str(result),
-            validations={
-                "brand_alignment": 85,
-                "compliance": 92,
-                "readability": 78,
-                "overall_quality": 85
-            },
-            agent_feedback=[
-                "Content generated and validated successfully",
-                "Brand consistency: Excellent",
-                "Compliance: Passed all checks",
-                "Design recommendations provided"
-            ],
-            timestamp=datetime.now().isoformat()
-        )
+        try:
+            while pending or running:
+                # Keep at most `concurrency` items in the shared worker pool at a time
+                backpressure = None
+                while pending and len(running) < batch.concurrency:
+                    index, request = pending[0]
+                    try:
+                        job = job_manager.submit(
+                            request,
+                            brand_context=brand_contexts[request.brand_id or "default"],
+                            priority="batch"
+                        )
+                    except (QueueFullError, OllamaUnavailableError) as e:
+                        backpressure = e
+                        break
+                    except ShuttingDownError:
+                        counts["rejected"] += len(pending)
+                        pending.clear()
+                        break
+                    waiting_since = None
+                    pending.popleft()
+                    running[asyncio.ensure_future(job.wait())] = (index, job)
+                
+                if not running:
+                    if backpressure is None:
+                        continue
+                    # The queue is full with other clients' work, or Ollama is down
+                    now = time.monotonic()
+                    waiting_since = waiting_since or now
+                    waited = now - waiting_since
+                    status = 503 if isinstance(backpressure, OllamaUnavailableError) else 429
+                    if waited >= BATCH_MAX_WAIT:
+                        for index, _ in pending:
+                            counts["failed"] += 1
+                            yield format_sse({
+                                "event": "item",
+                                "index": index,
+                                "job_id": None,
+                                "status": "failed",
+                                "error": f"Not submitted after waiting {round(waited)}s: {str(backpressure)}",
+                                "error_status": status,
+                                "result": None
+                            })
+                        pending.clear()
+                        continue
+                    delay = max(1.0, min(backpressure.retry_after, BATCH_MAX_WAIT - waited))
+                    yield format_sse({
+                        "event": "waiting",
+                        "reason": "llm_unavailable" if status == 503 else "queue_full",
+                        "detail": str(backpressure),
+                        "retry_after": round(delay, 1),
+                        "pending": len(pending),
+                        "waited_seconds": round(waited, 1)
+                    })
+                    await asyncio.sleep(delay)
+                    continue
+                
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for waiter in done:
+                    index, job = running.pop(waiter)
+                    counts[job.status] += 1
+                    yield format_sse({
+                        "event": "item",
+                        "index": index,
+                        **job.to_dict(),
+                        "result": job.result.model_dump() if job.result else None
+                    })
+        finally:
+            # Client went away mid-batch: stop the work nobody else is waiting for
+            for _, job in running.values():
+                job_manager.detach(job)
         
-    except Exception as e:
-        logger.error(f"Campaign creation error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Campaign creation failed: {str(e)}")
+        yield format_sse({"event": "batch_completed", "total": len(batch.campaigns), **counts})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/jobs", status_code=202)
+def submit_job(
+    request: CampaignRequest,
+    priority: str = Query("batch", pattern="^(interactive|batch)$"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Queue a campaign for background processing and return its job id"""
+    job = submit_job_or_reject(request, priority=priority, idempotency_key=idempotency_key)
+    
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "priority": job.priority,
+        "queue_depth": job_manager.queue_depth()
+    }
+
+@app.get("/api/jobs")
+def get_job_stats():
+    """Report worker pool, queue and LLM admission statistics"""
+    return {
+        **job_manager.stats(),
+        "llm_gate": llm_gate.stats(),
+        "crew_pool": crew_pool.stats(),
+        "brand_agent_pool": brand_agent_pool.stats()
+    }
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    """Retrieve job status"""
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/api/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    """Retrieve the campaign produced by a finished job"""
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status == "failed":
+        raise failure_error(job)
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return job.result
+
+@app.delete("/api/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """Cancel a queued or running job"""
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not job_manager.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Job is already {job.status}")
+    return job.to_dict()
+
+@app.on_event("startup")
+def import_legacy_campaigns():
+    """Index campaigns saved as loose JSON files by earlier versions"""
+    imported = campaign_store.import_json(CAMPAIGNS_DIR)
+    if imported:
+        logger.info(f"Imported {imported} campaign file(s) into {CAMPAIGN_INDEX_PATH}")
+    compressed = campaign_store.compress_legacy()
+    if compressed:
+        logger.info(f"Compressed {compressed} campaign record(s)")
+    scanned = campaign_store.rebuild_rollups()
+    if scanned is not None:
+        logger.info(f"Built analytics rollups from {scanned} campaign(s)")
+
+@app.on_event("startup")
+def recover_checkpoints():
+    """Flag runs whose worker died as resumable, drop stale checkpoints and start lease renewal"""
+    interrupted = checkpoint_store.mark_interrupted()
+    if interrupted:
+        logger.info(f"{interrupted} campaign run(s) were interrupted; resume them via /api/campaigns/incomplete")
+    checkpoint_store.start()
+    pruned = checkpoint_store.prune(CHECKPOINT_RETENTION_DAYS)
+    if pruned:
+        logger.info(f"Dropped checkpoints of {pruned} run(s) older than {CHECKPOINT_RETENTION_DAYS:g} days")
+
+@app.on_event("startup")
+def start_health_probe():
+    """Poll Ollama in the background so health checks and the breaker see outages early"""
+    ollama_probe.start()
+
+@app.on_event("startup")
+def start_warmup():
+    """Preload agents, the Ollama model and embeddings without delaying startup"""
+    if WARMUP_ON_STARTUP:
+        warmup.start()
+
+@app.on_event("shutdown")
+def drain_jobs():
+    """Stop accepting jobs and let in-flight campaigns finish"""
+    job_manager.shutdown(timeout=JOB_DRAIN_TIMEOUT)
+    ollama_probe.stop()
+    checkpoint_store.stop()
 
 @app.get("/api/campaign/{campaign_id}")
-def get_campaign(campaign_id: str):
-    """Retrieve campaign details"""
+def get_campaign(campaign_id: str, request: Request, fields: Optional[str] = None):
+    """Retrieve campaign details, optionally only ``fields`` (comma separated)"""
     campaign = load_campaign(campaign_id)
     if not campaign:
         raise HTTPException(status_code=404, detail="Campaign not found")
-    return campaign
+    return conditional_json(request, select_fields(campaign, parse_fields(fields)))
+
+@app.get("/api/campaigns/similar")
+def find_similar_campaigns(
+    campaign_brief: str = Query(..., min_length=1),
+    target_audience: str = "",
+    brand_id: Optional[str] = None,
+    content_type: Optional[str] = None,
+    limit: int = Query(5, ge=1, le=50),
+    min_similarity: float = Query(0.0, ge=-1.0, le=1.0)
+):
+    """Past campaigns whose brief and audience are closest to the given ones"""
+    try:
+        vector = embed_texts([brief_text(campaign_brief, target_audience)])[0]
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Embedding model unavailable: {str(e)}")
+    matches = brief_index.search(
+        vector, limit=limit, brand_id=brand_id, content_type=content_type, min_similarity=min_similarity
+    )
+    summaries = {c["campaign_id"]: c for c in campaign_store.summaries([m.campaign_id for m in matches])}
+    return {
+        "matches": [
+            {**match.model_dump(), **summaries.get(match.campaign_id, {})}
+            for match in matches
+        ],
+        "duplicate_threshold": DUPLICATE_BRIEF_THRESHOLD,
+        "reuse_threshold": reuse_threshold() if DUPLICATE_BRIEF_MODE == "reuse" else None
+    }
 
 @app.get("/api/campaigns/list")
-def list_campaigns(limit: int = 10):
-    """List recent campaigns"""
-    campaigns = []
-    for file in sorted(CAMPAIGNS_DIR.glob("*.json"), reverse=True)[:limit]:
-        with open(file) as f:
-            campaigns.append(json.load(f))
-    return {"campaigns": campaigns}
+def list_campaigns(
+    request: Request,
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None,
+    brand_id: Optional[str] = None,
+    content_type: Optional[str] = None,
+    status: Optional[str] = None,
+    summary: bool = False,
+    fields: Optional[str] = None
+):
+    """List recent campaigns, newest first"""
+    selected = parse_fields(fields)
+    # Index columns alone can answer the request without decoding full campaigns
+    if selected and set(selected) <= set(CampaignStore.SUMMARY_COLUMNS):
+        summary = True
+    try:
+        campaigns, next_cursor = campaign_store.list(
+            limit=limit,
+            cursor=cursor,
+            brand_id=brand_id,
+            content_type=content_type,
+            status=status,
+            summary=summary
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    campaigns = [select_fields(campaign, selected) for campaign in campaigns]
+    return conditional_json(request, {"campaigns": campaigns, "next_cursor": next_cursor})
+
+@app.get("/api/analytics")
+def get_analytics(request: Request, days: int = Query(30, ge=1, le=366)):
+    """Aggregates over recent campaigns, served from incrementally maintained rollups"""
+    return conditional_json(request, build_analytics(days))
+
+@app.get("/api/cache/stats")
+def get_cache_stats():
+    """LLM response cache hit/miss counters and sizes"""
+    return llm_cache.stats()
+
+@app.delete("/api/cache")
+def clear_cache():
+    """Drop every cached LLM response"""
+    llm_cache.clear()
+    return {"status": "success", "message": "LLM cache cleared"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus text exposition of stage, token, queue, cache and HTTP metrics"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/models")
+def get_model_routing():
+    """Model tiers, which tier each agent runs on and per-tier stage latency"""
+    return model_router.stats()
 
 @app.get("/api/health")
 def health_check():
-    """Health check endpoint"""
-    return {
-        "status": "healthy",
+    """Health of the service and its dependencies; 503 while campaigns cannot run
+    
+    Reads the cached Ollama probe, so it answers immediately even when Ollama hangs.
+    """
+    ollama = ollama_probe.snapshot()
+    breaker = ollama_breaker.snapshot()
+    jobs = job_manager.stats()
+    status = warmup.snapshot()
+    if breaker["state"] == "open" or ollama["status"] == "down" or not jobs["accepting"]:
+        overall = "unhealthy"
+    elif breaker["state"] == "half_open" or ollama.get("missing_models") or status["state"] == "failed":
+        overall = "degraded"
+    else:
+        overall = "healthy"
+    body = {
+        "status": overall,
         "service": "Creative Media Co-Pilot",
-        "timestamp": datetime.now().isoformat()
+        "timestamp": datetime.now().isoformat(),
+        "dependencies": {
+            "ollama": {"url": OLLAMA_BASE_URL, **ollama, "circuit_breaker": breaker},
+            "job_queue": {
+                "accepting": jobs["accepting"],
+                "queue_depth": jobs["queue_depth"],
+                "running": jobs["running"]
+            },
+            "warmup": status["state"]
+        }
+    }
+    headers = {"Retry-After": str(breaker["retry_after"])} if breaker["retry_after"] else None
+    return JSONResponse(body, status_code=503 if overall == "unhealthy" else 200, headers=headers)
+
+@app.get("/api/health/live")
+def liveness_check():
+    """Liveness: the process is up and serving requests"""
+    return {"status": "alive", "timestamp": datetime.now().isoformat()}
+
+@app.get("/api/health/ready")
+def readiness_check():
+    """Readiness: required models are loaded, jobs are being accepted and Ollama is reachable"""
+    status = warmup.snapshot()
+    accepting = job_manager.stats()["accepting"]
+    breaker = ollama_breaker.snapshot()["state"]
+    # Without a warm-up, components load lazily on the first campaign
+    warmed = status["state"] == "ready" or (status["state"] == "idle" and not WARMUP_ON_STARTUP)
+    body = {
+        "ready": warmed and accepting and breaker != "open",
+        "accepting_jobs": accepting,
+        "circuit_breaker": breaker,
+        "warmup": status
     }
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+@app.post("/api/warmup", status_code=202)
+def trigger_warmup():
+    """Start preloading in the background; a no-op while running or once ready"""
+    started = warmup.start()
+    return {"started": started, **warmup.snapshot()}
+
+@app.get("/api/warmup")
+def get_warmup_status():
+    return warmup.snapshot()
 
 # ==================== Main ====================
 
@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for Creative Media Co-Pilot
+Drives the FastAPI backend against a stub Ollama server and reports latency,
+throughput and memory as JSON that can be compared across versions
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import requests
+
+REPO_DIR = Path(__file__).resolve().parent
+
+# ==================== Stub Ollama Server ====================
+
+STUB_WORDS = (
+    "launch your brand with bold creative content that connects customers "
+    "to quality innovation and integrity across every campaign channel"
+).split()
+
+class StubOllamaConfig:
+    """Tunable behaviour of the stub server"""
+    
+    def __init__(
+        self,
+        latency: float = 0.2,
+        tokens_per_sec: float = 200.0,
+        tokens: int = 120,
+        failure_rate: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        self.latency = latency  # seconds before the first token (prompt evaluation)
+        self.tokens_per_sec = tokens_per_sec
+        self.tokens = tokens
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+    
+    def should_fail(self) -> bool:
+        with self.lock:
+            self.requests += 1
+            failed = self.random.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+            return failed
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    """Speaks enough of the Ollama API for the backend: generate, chat and tags"""
+    
+    protocol_version = "HTTP/1.1"
+    config: StubOllamaConfig = StubOllamaConfig()
+    
+    def do_GET(self):
+        if self.path.rstrip("/") == "/api/tags":
+            self._send_json({"models": [{"name": "mistral:7b"}]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+    
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json({"error": "invalid json"}, status=400)
+            return
+        
+        path = self.path.rstrip("/")
+        if path not in ("/api/generate", "/api/chat"):
+            self._send_json({"error": "not found"}, status=404)
+            return
+        
+        config = self.config
+        time.sleep(config.latency)
+        if config.should_fail():
+            self._send_json({"error": "stub failure"}, status=500)
+            return
+        
+        model = payload.get("model", "mistral:7b")
+        words = [config.random.choice(STUB_WORDS) for _ in range(config.tokens)]
+        prompt = payload.get("prompt") or json.dumps(payload.get("messages", []))
+        final = {
+            "model": model,
+            "done": True,
+            "prompt_eval_count": max(1, len(prompt) // 4),
+            "eval_count": len(words),
+            "eval_duration": int(len(words) / config.tokens_per_sec * 1e9)
+        }
+        
+        if payload.get("stream") is False:
+            text = " ".join(words)
+            body = {"message": {"role": "assistant", "content": text}} if path == "/api/chat" else {"response": text}
+            time.sleep(len(words) / config.tokens_per_sec)
+            self._send_json({**body, **final})
+            return
+        
+        # Stream ndjson chunks at the configured token rate
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = 1.0 / config.tokens_per_sec
+        try:
+            for i, word in enumerate(words):
+                token = word if i == 0 else " " + word
+                if path == "/api/chat":
+                    chunk = {"model": model, "message": {"role": "assistant", "content": token}, "done": False}
+                else:
+                    chunk = {"model": model, "response": token, "done": False}
+                self._write_chunk(json.dumps(chunk) + "\n")
+                time.sleep(interval)
+            self._write_chunk(json.dumps({**final, "response": ""}) + "\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+    
+    def _write_chunk(self, text: str):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+    
+    def _send_json(self, body: dict, status: int = 200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_ollama(port: int, config: StubOllamaConfig) -> ThreadingHTTPServer:
+    """Serve the stub on a background thread; port 0 picks a free port"""
+    handler = type("ConfiguredStubOllamaHandler", (StubOllamaHandler,), {"config": config})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# ==================== Backend Process ====================
+
+def free_port() -> int:
+    import socket
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_backend(port: int, ollama_url: str, workdir: Path, env: dict) -> subprocess.Popen:
+    """Run the backend under uvicorn in an isolated working directory"""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend_main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=workdir,
+        env={
+            **os.environ,
+            **env,
+            "PYTHONPATH": os.pathsep.join(filter(None, [str(REPO_DIR), os.environ.get("PYTHONPATH")])),
+            "OLLAMA_BASE_URL": ollama_url
+        },
+        stdout=subprocess.DEVNULL,
+        stderr=open(workdir / "backend.log", "w")
+    )
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited with code {process.returncode}, see {workdir / 'backend.log'}")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/", timeout=1).ok:
+                return process
+        except requests.RequestException:
+            time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError("Backend did not start within 120s")
+
+def read_rss_mb(pid: int) -> Optional[float]:
+    """Resident memory of a process in MB (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+class MemorySampler:
+    """Tracks the backend's peak resident memory while a scenario runs"""
+    
+    def __init__(self, pid: Optional[int], interval: float = 0.25):
+        self.pid = pid
+        self.interval = interval
+        self.samples: list[float] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def _run(self):
+        while not self._stop.is_set():
+            rss = read_rss_mb(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            self._stop.wait(self.interval)
+    
+    def __enter__(self):
+        if self.pid:
+            self._thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+    
+    def summary(self) -> dict:
+        if not self.samples:
+            return {"rss_start_mb": None, "rss_end_mb": None, "rss_peak_mb": None}
+        return {
+            "rss_start_mb": self.samples[0],
+            "rss_end_mb": self.samples[-1],
+            "rss_peak_mb": max(self.samples)
+        }
+
+# ==================== Scenarios ====================
+
+BRIEFS = [
+    "Announce our spring product line to returning customers",
+    "Promote the annual sustainability report on social media",
+    "Invite small business owners to a free onboarding webinar",
+    "Introduce the new loyalty program with a limited-time offer"
+]
+CONTENT_TYPES = ["blog_post", "social_media", "email", "ad_copy"]
+
+class ScenarioRunner:
+    """Issues requests from a fixed number of concurrent clients and records latencies
+    
+    Unless ``repeat_briefs`` is set, every create sends a brief no other request has
+    used, so the backend cannot coalesce it or reuse an earlier campaign.
+    """
+    
+    def __init__(self, base_url: str, concurrency: int, timeout: float, bypass_cache: bool, repeat_briefs: bool = False):
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.bypass_cache = bypass_cache
+        self.repeat_briefs = repeat_briefs
+        self.run_id = uuid.uuid4().hex[:8]
+        self.reused = 0
+        self.campaign_ids: list[str] = []
+        self._ids_lock = threading.Lock()
+        self._local = threading.local()
+    
+    def session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+    
+    def brief(self, i: int) -> str:
+        brief = BRIEFS[i % len(BRIEFS)]
+        if self.repeat_briefs:
+            return brief
+        return f"{brief} (benchmark run {self.run_id}, request {i})"
+    
+    def create(self, i: int) -> requests.Response:
+        response = self.session().post(
+            f"{self.base_url}/api/campaign/create",
+            json={
+                "campaign_brief": self.brief(i),
+                "target_audience": "Marketing managers at mid-size companies",
+                "content_type": CONTENT_TYPES[i % len(CONTENT_TYPES)],
+                "bypass_cache": self.bypass_cache
+            },
+            timeout=self.timeout
+        )
+        if response.ok:
+            campaign = response.json()
+            with self._ids_lock:
+                self.campaign_ids.append(campaign["campaign_id"])
+                if campaign.get("duplicate_of"):
+                    self.reused += 1
+        return response
+    
+    def list(self, i: int) -> requests.Response:
+        return self.session().get(
+            f"{self.base_url}/api/campaigns/list",
+            params={"limit": 10, "summary": True},
+            timeout=self.timeout
+        )
+    
+    def get(self, i: int) -> requests.Response:
+        with self._ids_lock:
+            campaign_id = self.campaign_ids[i % len(self.campaign_ids)]
+        return self.session().get(f"{self.base_url}/api/campaign/{campaign_id}", timeout=self.timeout)
+    
+    def seed_campaign_ids(self):
+        """Collect existing campaign ids for the get scenario"""
+        response = requests.get(
+            f"{self.base_url}/api/campaigns/list",
+            params={"limit": 100, "summary": True},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        with self._ids_lock:
+            self.campaign_ids.extend(c["campaign_id"] for c in response.json()["campaigns"])
+    
+    def run(self, name: str, requests_count: int, pid: Optional[int]) -> dict:
+        call = getattr(self, name)
+        latencies: list[float] = []
+        errors: dict[str, int] = {}
+        lock = threading.Lock()
+        
+        def issue(i: int):
+            started = time.perf_counter()
+            try:
+                response = call(i)
+                error = None if response.ok else f"http_{response.status_code}"
+            except requests.RequestException as e:
+                error = type(e).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                if error:
+                    errors[error] = errors.get(error, 0) + 1
+                else:
+                    latencies.append(elapsed)
+        
+        with MemorySampler(pid) as memory:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                list(executor.map(issue, range(requests_count)))
+            wall = time.perf_counter() - started
+        
+        result = {
+            "scenario": name,
+            "requests": requests_count,
+            "concurrency": self.concurrency,
+            "succeeded": len(latencies),
+            "errors": errors,
+            "wall_seconds": round(wall, 3),
+            "requests_per_sec": round(len(latencies) / wall, 3) if wall else 0.0,
+            "latency_seconds": summarize_latencies(latencies),
+            "memory": memory.summary()
+        }
+        if name == "create":
+            # Reused campaigns skip generation; a nonzero count means create was not fully measured
+            result["reused"] = self.reused
+        return result
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def summarize_latencies(latencies: list[float]) -> dict:
+    if not latencies:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    values = sorted(latencies)
+    return {
+        "p50": round(percentile(values, 0.50), 4),
+        "p95": round(percentile(values, 0.95), 4),
+        "p99": round(percentile(values, 0.99), 4),
+        "mean": round(sum(values) / len(values), 4),
+        "max": round(values[-1], 4)
+    }
+
+# ==================== Reporting ====================
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_reports(current: dict, baseline: dict) -> list[str]:
+    """One line per scenario: change in p95 latency and throughput against a baseline"""
+    previous = {result["scenario"]: result for result in baseline.get("results", [])}
+    lines = []
+    for result in current["results"]:
+        before = previous.get(result["scenario"])
+        if not before:
+            continue
+        parts = [result["scenario"]]
+        for label, now, then in (
+            ("p95", result["latency_seconds"]["p95"], before["latency_seconds"]["p95"]),
+            ("rps", result["requests_per_sec"], before["requests_per_sec"])
+        ):
+            if now is None or not then:
+                parts.append(f"{label} n/a")
+            else:
+                parts.append(f"{label} {then} -> {now} ({(now - then) / then * 100:+.1f}%)")
+        lines.append("  ".join(parts))
+    return lines
+
+# ==================== Main ====================
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the Creative Media Co-Pilot backend")
+    parser.add_argument("--url", help="Benchmark an already running backend instead of starting one")
+    parser.add_argument("--scenarios", default="create,list,get",
+                        help="Comma separated scenarios to run in order: create, list, get")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent clients")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Per request timeout in seconds")
+    parser.add_argument("--use-cache", action="store_true",
+                        help="Let campaigns hit the LLM response cache (bypassed by default)")
+    parser.add_argument("--repeat-briefs", action="store_true",
+                        help="Cycle through four fixed briefs so identical requests are coalesced "
+                             "and near-duplicates reused (unique briefs with both off by default)")
+    parser.add_argument("--stub-port", type=int, default=0, help="Stub Ollama port (0 picks a free one)")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Stub delay before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0, help="Stub generation rate")
+    parser.add_argument("--tokens", type=int, default=120, help="Stub tokens per response")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of stub calls that return 500")
+    parser.add_argument("--seed", type=int, help="Seed for stub output and failures")
+    parser.add_argument("--stub-only", action="store_true", help="Only run the stub Ollama server")
+    parser.add_argument("--output", help="Write the JSON report to this file as well as stdout")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = parse_args(argv)
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - {"create", "list", "get"}
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+    
+    stub_config = StubOllamaConfig(
+        latency=args.llm_latency,
+        tokens_per_sec=args.tokens_per_sec,
+        tokens=args.tokens,
+        failure_rate=args.failure_rate,
+        seed=args.seed
+    )
+    stub = start_stub_ollama(args.stub_port, stub_config)
+    stub_url = f"http://127.0.0.1:{stub.server_address[1]}"
+    
+    if args.stub_only:
+        print(f"Stub Ollama listening on {stub_url}", file=sys.stderr)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            return 0
+    
+    backend = None
+    workdir = None
+    try:
+        if args.url:
+            base_url = args.url
+        else:
+            workdir = tempfile.TemporaryDirectory(prefix="copilot-bench-")
+            port = free_port()
+            print(f"Starting backend on port {port} against {stub_url}", file=sys.stderr)
+            # Measure generation, not request merging, unless asked to
+            env = {} if args.repeat_briefs else {"COALESCE_REQUESTS": "false", "DUPLICATE_BRIEF_MODE": "off"}
+            backend = start_backend(port, stub_url, Path(workdir.name), env=env)
+            base_url = f"http://127.0.0.1:{port}"
+        
+        create_mode = "repeated briefs, coalescing and reuse on" if args.repeat_briefs else "unique briefs, coalescing and reuse off"
+        if args.url and not args.repeat_briefs:
+            create_mode = "unique briefs (coalescing and reuse as configured on the target)"
+        print(f"Create mode: {create_mode}", file=sys.stderr)
+        runner = ScenarioRunner(
+            base_url, args.concurrency, args.timeout,
+            bypass_cache=not args.use_cache, repeat_briefs=args.repeat_briefs
+        )
+        results = []
+        for name in scenarios:
+            if name == "get":
+                runner.seed_campaign_ids()
+                if not runner.campaign_ids:
+                    print("Skipping get: no campaigns to fetch", file=sys.stderr)
+                    continue
+            print(f"Running {name}: {args.requests} requests, concurrency {args.concurrency}", file=sys.stderr)
+            results.append(runner.run(name, args.requests, backend.pid if backend else None))
+        
+        report = {
+            "timestamp": datetime.now().isoformat(),
+            "git_revision": git_revision(),
+            "python": sys.version.split()[0],
+            "config": {
+                key: value for key, value in vars(args).items()
+                if key not in ("output", "compare", "stub_only")
+            },
+            "create_mode": create_mode,
+            "stub": {"requests": stub_config.requests, "failures": stub_config.failures},
+            "results": results
+        }
+    finally:
+        if backend:
+            backend.terminate()
+            try:
+                backend.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                backend.kill()
+        if workdir:
+            workdir.cleanup()
+        stub.shutdown()
+    
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    if args.compare:
+        for line in compare_reports(report, json.loads(Path(args.compare).read_text())):
+            print(line, file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
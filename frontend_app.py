@@ -6,8 +6,10 @@ Built with Streamlit for easy deployment and interaction
 
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import time
+import threading
 from datetime import datetime
 from pathlib import Path
 import pandas as pd
@@ -15,6 +17,30 @@ import pandas as pd
 # ==================== Configuration ====================
 
 API_BASE_URL = st.secrets.get("API_BASE_URL", "http://localhost:8000")
+STREAM_READ_TIMEOUT = 60
+API_POOL_SIZE = 8
+ETAG_CACHE_SIZE = 256
+# Seconds that reruns reuse a response before revalidating it with the backend
+HEALTH_TTL = 10
+CAMPAIGNS_LIST_TTL = 15
+CAMPAIGN_TTL = 300
+ANALYTICS_TTL = 30
+SCORE_LABELS = {
+    "brand_alignment": "Brand Alignment",
+    "compliance": "Compliance",
+    "readability": "Readability",
+    "overall_quality": "Overall Quality",
+    "keyword_coverage": "Keyword Coverage"
+}
+STAGES = {
+    "content_creator": "Content Creator",
+    "brand_rules": "Brand Rule Check",
+    "brand_alignment": "Brand Alignment Score",
+    "brand_manager": "Brand Manager",
+    "compliance_officer": "Compliance Officer",
+    "design_validator": "Design Validator",
+    "optimizer": "Optimizer"
+}
 st.set_page_config(
     page_title="Creative Media Co-Pilot",
     page_icon="🎨",
@@ -78,41 +104,92 @@ if "brand_guidelines" not in st.session_state:
 
 # ==================== Helper Functions ====================
 
+class ApiClient:
+    """Pooled session to the backend that revalidates GETs with ETags"""
+    
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=API_POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._etags = {}
+        self._lock = threading.Lock()
+    
+    def get_json(self, path, params=None, timeout=10):
+        """GET a JSON resource; an unchanged resource comes back as 304 and is served locally"""
+        key = (path, tuple(sorted((params or {}).items())))
+        with self._lock:
+            cached = self._etags.get(key)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        response = self.session.get(f"{self.base_url}{path}", params=params, headers=headers, timeout=timeout)
+        if response.status_code == 304 and cached:
+            return cached[1]
+        response.raise_for_status()
+        body = response.json()
+        if response.headers.get("ETag"):
+            with self._lock:
+                self._etags[key] = (response.headers["ETag"], body)
+                if len(self._etags) > ETAG_CACHE_SIZE:
+                    del self._etags[next(iter(self._etags))]
+        return body
+    
+    def post(self, path, **kwargs):
+        return self.session.post(f"{self.base_url}{path}", **kwargs)
+
 @st.cache_resource
 def get_api_client():
-    """Initialize API client"""
-    return requests.Session()
+    """Initialize API client shared by every session of this app"""
+    return ApiClient(API_BASE_URL)
 
+@st.cache_data(ttl=HEALTH_TTL, show_spinner=False)
 def check_api_health():
-    """Check if backend API is running"""
+    """Fetch backend health, or None when the backend API is not reachable"""
     try:
-        response = requests.get(f"{API_BASE_URL}/api/health", timeout=2)
-        return response.status_code == 200
-    except:
-        return False
+        # An unhealthy backend answers 503 but still reports its dependencies
+        return get_api_client().session.get(f"{API_BASE_URL}/api/health", timeout=2).json()
+    except Exception:
+        return None
 
-def create_campaign(campaign_brief, target_audience, content_type, brand_id="default"):
-    """Create new campaign via API"""
+def stream_campaign(campaign_brief, target_audience, content_type, brand_id="default"):
+    """Create new campaign via the streaming API, yielding server-sent events"""
+    payload = {
+        "campaign_brief": campaign_brief,
+        "target_audience": target_audience,
+        "content_type": content_type,
+        "brand_id": brand_id
+    }
+    # The read timeout applies between chunks; the backend sends keep-alives while agents work
+    with get_api_client().post(
+        "/api/campaign/stream",
+        json=payload,
+        stream=True,
+        timeout=(10, STREAM_READ_TIMEOUT)
+    ) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"API Error: {response.status_code} - {response.text}")
+        for line in response.iter_lines(decode_unicode=True):
+            if line and line.startswith("data: "):
+                yield json.loads(line[len("data: "):])
+
+def create_campaign(campaign_brief, target_audience, content_type, brand_id="default", on_event=None):
+    """Create new campaign via API, passing progress events to on_event"""
     try:
-        payload = {
-            "campaign_brief": campaign_brief,
-            "target_audience": target_audience,
-            "content_type": content_type,
-            "brand_id": brand_id
-        }
-        response = requests.post(
-            f"{API_BASE_URL}/api/campaign/create",
-            json=payload,
-            timeout=120
-        )
-        if response.status_code == 200:
-            campaign = response.json()
-            st.session_state.campaigns.append(campaign)
-            st.session_state.current_campaign = campaign
-            return campaign
-        else:
-            st.error(f"API Error: {response.status_code} - {response.text}")
-            return None
+        for event in stream_campaign(campaign_brief, target_audience, content_type, brand_id):
+            if on_event:
+                on_event(event)
+            if event["event"] == "completed":
+                campaign = event["result"]
+                fetch_campaigns_list.clear()
+                fetch_analytics.clear()
+                st.session_state.campaigns.append(campaign)
+                st.session_state.current_campaign = campaign
+                return campaign
+            if event["event"] in ("failed", "cancelled"):
+                st.error(f"Campaign {event['event']}: {event.get('error') or event['job_id']}")
+                return None
+        st.error("Connection Error: stream ended before the campaign completed")
+        return None
     except Exception as e:
         st.error(f"Connection Error: {str(e)}")
         return None
@@ -121,8 +198,8 @@ def upload_brand_guidelines(brand_id, guidelines_file):
     """Upload brand guidelines to backend"""
     try:
         files = {"file": guidelines_file}
-        response = requests.post(
-            f"{API_BASE_URL}/api/brand/upload-guidelines",
+        response = get_api_client().post(
+            "/api/brand/upload-guidelines",
             files=files,
             params={"brand_id": brand_id},
             timeout=30
@@ -137,30 +214,46 @@ def upload_brand_guidelines(brand_id, guidelines_file):
         st.error(f"Upload error: {str(e)}")
         return False
 
+@st.cache_data(ttl=CAMPAIGN_TTL, show_spinner=False)
+def fetch_campaign(campaign_id):
+    return get_api_client().get_json(f"/api/campaign/{campaign_id}")
+
+@st.cache_data(ttl=CAMPAIGNS_LIST_TTL, show_spinner=False)
+def fetch_campaigns_list(limit):
+    return get_api_client().get_json("/api/campaigns/list", params={"limit": limit, "summary": "true"})["campaigns"]
+
+@st.cache_data(ttl=ANALYTICS_TTL, show_spinner=False)
+def fetch_analytics(days):
+    return get_api_client().get_json("/api/analytics", params={"days": days})
+
+def load_analytics(days=30):
+    """Load campaign aggregates, or None when the backend is unreachable"""
+    try:
+        return fetch_analytics(days)
+    except Exception as e:
+        st.warning(f"Could not load analytics: {str(e)}")
+        return None
+
+def format_score(value):
+    return f"{value:.0f}%" if value is not None else "n/a"
+
 def get_campaign_details(campaign_id):
     """Fetch campaign details from API"""
     try:
-        response = requests.get(
-            f"{API_BASE_URL}/api/campaign/{campaign_id}",
-            timeout=10
-        )
-        if response.status_code == 200:
-            return response.json()
+        return fetch_campaign(campaign_id)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return None
+        st.error(f"Error fetching campaign: {str(e)}")
         return None
     except Exception as e:
         st.error(f"Error fetching campaign: {str(e)}")
         return None
 
-def load_campaigns_list():
-    """Load list of recent campaigns"""
+def load_campaigns_list(limit=10):
+    """Load summaries of recent campaigns"""
     try:
-        response = requests.get(
-            f"{API_BASE_URL}/api/campaigns/list",
-            timeout=10
-        )
-        if response.status_code == 200:
-            return response.json()["campaigns"]
-        return []
+        return fetch_campaigns_list(limit)
     except Exception as e:
         st.warning(f"Could not load campaigns list: {str(e)}")
         return []
@@ -185,35 +278,50 @@ def page_dashboard():
     """Dashboard - Overview and recent campaigns"""
     st.markdown("# 📊 Dashboard")
     
+    analytics = load_analytics(days=30)
+    totals = analytics["totals"] if analytics else {"campaigns": 0, "averages": {}}
+    
     col1, col2, col3 = st.columns(3)
     
     with col1:
         st.metric(
             "Total Campaigns",
-            len(st.session_state.campaigns),
-            "campaigns created"
+            totals["campaigns"],
+            "last 30 days",
+            delta_color="off"
         )
     
     with col2:
         st.metric(
             "Average Quality",
-            "85%",
-            "brand consistency"
+            format_score(totals["averages"].get("overall_quality")),
+            "overall quality",
+            delta_color="off"
         )
     
     with col3:
         st.metric(
-            "Compliance Score",
-            "92%",
-            "all content validated"
+            "Brand Alignment",
+            format_score(totals["averages"].get("brand_alignment")),
+            "average score",
+            delta_color="off"
         )
     
     st.markdown("---")
     
     # API Status
     st.subheader("🔌 System Status")
-    if check_api_health():
+    health = check_api_health()
+    if health and health.get("status") == "healthy":
         st.markdown('<div class="success-box">✅ Backend API: Connected</div>', unsafe_allow_html=True)
+    elif health:
+        ollama = health.get("dependencies", {}).get("ollama", {})
+        st.markdown(
+            f'<div class="error-box">⚠️ Backend API: Connected, but {health.get("status")}. '
+            f'Ollama is {ollama.get("status", "unknown")}, circuit breaker '
+            f'{ollama.get("circuit_breaker", {}).get("state", "unknown")}</div>',
+            unsafe_allow_html=True
+        )
     else:
         st.markdown(
             '<div class="error-box">⚠️ Backend API: Disconnected. Ensure backend is running on port 8000</div>',
@@ -222,7 +330,7 @@ def page_dashboard():
     
     # Recent Campaigns
     st.subheader("📝 Recent Campaigns")
-    campaigns = load_campaigns_list()
+    campaigns = load_campaigns_list(limit=5)
     
     if campaigns:
         for campaign in campaigns[:5]:
@@ -230,8 +338,8 @@ def page_dashboard():
                 st.write(f"**Campaign ID**: {campaign['campaign_id']}")
                 st.write(f"**Type**: {campaign.get('content_type', 'N/A')}")
                 st.write(f"**Status**: {campaign.get('status', 'completed')}")
-                if "result" in campaign:
-                    st.write(f"**Generated Content**:\n{campaign['result'][:300]}...")
+                if campaign.get("preview"):
+                    st.write(f"**Generated Content**:\n{campaign['preview']}...")
     else:
         st.info("No campaigns yet. Create one to get started!")
 
@@ -303,32 +411,52 @@ def page_create_campaign():
                 st.error("Please fill in all required fields")
             else:
                 with st.spinner("🔄 Agents are collaborating on your content..."):
-                    # Simulate multi-agent processing with progress
                     progress_bar = st.progress(0)
+                    status = st.empty()
+                    placeholders = {}
+                    outputs = {}
+                    finished = []
+                    last_render = [0.0]
                     
-                    steps = [
-                        ("Content Creator", "Generating content..."),
-                        ("Brand Manager", "Validating brand consistency..."),
-                        ("Compliance Officer", "Reviewing for legal issues..."),
-                        ("Design Validator", "Providing design recommendations..."),
-                        ("Optimizer", "Finalizing and optimizing...")
-                    ]
-                    
-                    for i, (agent_name, status_text) in enumerate(steps):
-                        st.info(f"🤖 {agent_name}: {status_text}")
-                        progress_bar.progress((i + 1) / len(steps))
-                        time.sleep(1)
+                    def render_event(event):
+                        stage = event.get("stage")
+                        if event["event"] == "stage_start":
+                            placeholders[stage] = st.empty()
+                            outputs[stage] = ""
+                            status.info(f"🤖 {STAGES.get(stage, stage)}: working...")
+                        elif event["event"] == "token" and stage in outputs:
+                            outputs[stage] += event["text"]
+                            # Throttle redraws; tokens arrive much faster than the UI needs
+                            if time.time() - last_render[0] > 0.2:
+                                placeholders[stage].markdown(
+                                    f"**{STAGES.get(stage, stage)}**\n\n{outputs[stage]}"
+                                )
+                                last_render[0] = time.time()
+                        elif event["event"] == "stage_end":
+                            finished.append(stage)
+                            placeholders[stage].markdown(
+                                f"**{STAGES.get(stage, stage)}** ✅\n\n{outputs.get(stage, '')[:500]}"
+                            )
+                            progress_bar.progress(len(finished) / len(STAGES))
                     
                     # Create campaign via API
                     campaign = create_campaign(
                         campaign_brief,
                         target_audience,
                         content_type,
-                        brand_id
+                        brand_id,
+                        on_event=render_event
                     )
+                    status.empty()
                     
                     if campaign:
-                        st.markdown('<div class="success-box">✅ Content Generated Successfully!</div>', unsafe_allow_html=True)
+                        if campaign.get("reused"):
+                            st.info(
+                                f"♻️ Reused campaign {campaign['duplicate_of']} for a near-identical brief "
+                                f"(similarity {campaign.get('similarity')}); no new content was generated."
+                            )
+                        else:
+                            st.markdown('<div class="success-box">✅ Content Generated Successfully!</div>', unsafe_allow_html=True)
                         
                         st.markdown("### 📄 Generated Content")
                         st.write(campaign.get("content", "No content"))
@@ -339,13 +467,13 @@ def page_create_campaign():
                         validations = campaign.get("validations", {})
                         
                         with col1:
-                            st.metric("Brand Alignment", f"{validations.get('brand_alignment', 0)}%")
+                            st.metric("Brand Alignment", format_score(validations.get("brand_alignment")))
                         with col2:
-                            st.metric("Compliance", f"{validations.get('compliance', 0)}%")
+                            st.metric("Compliance", format_score(validations.get("compliance")))
                         with col3:
-                            st.metric("Readability", f"{validations.get('readability', 0)}%")
+                            st.metric("Readability", format_score(validations.get("readability")))
                         with col4:
-                            st.metric("Overall Quality", f"{validations.get('overall_quality', 0)}%")
+                            st.metric("Overall Quality", format_score(validations.get("overall_quality")))
                         
                         st.markdown("### 🎯 Agent Feedback")
                         for feedback in campaign.get("agent_feedback", []):
@@ -428,62 +556,103 @@ def page_analytics():
     """Analytics - Performance and insights"""
     st.markdown("# 📈 Analytics")
     
+    days = st.selectbox("Period", [7, 30, 90, 365], index=1, format_func=lambda d: f"Last {d} days")
+    analytics = load_analytics(days=days)
+    if not analytics or not analytics["totals"]["campaigns"]:
+        st.info("No campaigns in this period yet. Create one to see analytics.")
+        return
+    
     # Metrics Overview
     st.subheader("Performance Metrics")
     
-    col1, col2, col3 = st.columns(3)
+    totals = analytics["totals"]
+    col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        st.metric(
-            "Avg Brand Consistency",
-            "87%",
-            "+5% from last week"
-        )
+        st.metric("Campaigns", totals["campaigns"])
     
     with col2:
-        st.metric(
-            "Compliance Rate",
-            "94%",
-            "+2% from last week"
-        )
+        st.metric("Avg Brand Alignment", format_score(totals["averages"].get("brand_alignment")))
     
     with col3:
-        st.metric(
-            "Content Quality",
-            "86%",
-            "+3% from last week"
-        )
+        st.metric("Compliance Rate", format_score(totals["averages"].get("compliance")))
     
-    st.markdown("---")
+    with col4:
+        st.metric("Content Quality", format_score(totals["averages"].get("overall_quality")))
     
-    # Simulated data
-    st.subheader("Quality Scores Over Time")
-    
-    import pandas as pd
-    import numpy as np
+    st.markdown("---")
     
-    dates = pd.date_range(start='2024-11-01', periods=10)
-    data = pd.DataFrame({
-        'Date': dates,
-        'Brand Consistency': np.random.randint(80, 95, 10),
-        'Compliance': np.random.randint(88, 98, 10),
-        'Readability': np.random.randint(75, 90, 10),
-        'Overall Quality': np.random.randint(82, 92, 10)
-    })
+    st.subheader("Campaigns Per Day")
+    daily = pd.DataFrame([
+        {"Date": day["day"], "Campaigns": day["campaigns"]} for day in analytics["daily"]
+    ])
+    st.bar_chart(daily.set_index("Date"))
     
-    st.line_chart(data.set_index('Date'))
+    st.subheader("Quality Scores Over Time")
+    scores = pd.DataFrame([
+        {"Date": day["day"], **{SCORE_LABELS[m]: v for m, v in day["averages"].items() if m in SCORE_LABELS}}
+        for day in analytics["daily"]
+    ])
+    if len(scores.columns) > 1:
+        st.line_chart(scores.set_index("Date"))
+    else:
+        st.info("No scored campaigns in this period.")
     
     st.markdown("---")
     
     # Content Type Distribution
     st.subheader("Content Generated by Type")
     
-    content_stats = pd.DataFrame({
-        'Type': ['Blog Post', 'Social Media', 'Email', 'Ad Copy', 'Product Description'],
-        'Count': [15, 42, 28, 19, 12]
-    })
+    content_stats = pd.DataFrame([
+        {"Type": content_type, "Count": group["campaigns"]}
+        for content_type, group in analytics["by_content_type"].items()
+    ])
+    st.bar_chart(content_stats.set_index("Type"))
+    
+    with st.expander("By brand"):
+        st.dataframe(pd.DataFrame([
+            {
+                "Brand": brand_id,
+                "Campaigns": group["campaigns"],
+                **{SCORE_LABELS[m]: v for m, v in group["averages"].items() if m in SCORE_LABELS}
+            }
+            for brand_id, group in analytics["by_brand"].items()
+        ]), hide_index=True)
+    
+    st.markdown("---")
     
-    st.bar_chart(content_stats.set_index('Type'))
+    st.subheader("Score Distribution")
+    distributions = analytics["score_distributions"]
+    if distributions:
+        metric = st.selectbox(
+            "Score",
+            list(distributions),
+            format_func=lambda m: SCORE_LABELS.get(m, m)
+        )
+        histogram = pd.DataFrame([
+            {"Range": f"{bucket['min']}-{bucket['max']}", "Campaigns": bucket["count"]}
+            for bucket in distributions[metric]
+        ])
+        st.bar_chart(histogram.set_index("Range"))
+    else:
+        st.info("No scored campaigns in this period.")
+    
+    st.subheader("Stage Latency")
+    stage_latency = analytics["stage_latency"]
+    if stage_latency["daily"]:
+        latency = pd.DataFrame(stage_latency["daily"]).pivot(index="day", columns="stage", values="avg_seconds")
+        st.line_chart(latency)
+        st.dataframe(pd.DataFrame([
+            {
+                "Stage": STAGES.get(stage, stage),
+                "Runs": entry["count"],
+                "Avg (s)": entry["avg_seconds"],
+                "Max (s)": entry["max_seconds"]
+            }
+            for stage, entry in stage_latency["overall"].items()
+        ]), hide_index=True)
+    else:
+        st.info("No stage timings recorded in this period.")
 
 def page_about():
     """About - Project information"""
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# backend_main creates its stores relative to the working directory on import
+os.chdir(tempfile.mkdtemp(prefix="copilot-tests-"))
+os.environ.setdefault("WARMUP_ON_STARTUP", "false")
+os.environ.setdefault("OLLAMA_HEALTH_INTERVAL", "0")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,26 @@
+import json
+
+from fastapi.testclient import TestClient
+
+import backend_main as b
+
+
+def sse_events(body: str) -> list[dict]:
+    return [json.loads(line[len("data: "):]) for line in body.splitlines() if line.startswith("data: ")]
+
+
+def test_batch_reports_backpressure_then_fails_unsubmitted_items(monkeypatch):
+    breaker = b.CircuitBreaker(failure_threshold=1, cooldown=60, trial_calls=1, recovery_calls=1)
+    breaker.observe_probe(False, "connection refused")
+    monkeypatch.setattr(b, "ollama_breaker", breaker)
+    monkeypatch.setattr(b, "BATCH_MAX_WAIT", 1.0)
+    campaign = {"campaign_brief": "Spring launch", "target_audience": "Customers", "content_type": "email"}
+    
+    response = TestClient(b.app).post("/api/campaigns/batch", json={"campaigns": [campaign, campaign]})
+    events = sse_events(response.text)
+    
+    waiting = [e for e in events if e["event"] == "waiting"]
+    items = [e for e in events if e["event"] == "item"]
+    assert waiting and waiting[0]["reason"] == "llm_unavailable"
+    assert [(e["index"], e["status"], e["error_status"]) for e in items] == [(0, "failed", 503), (1, "failed", 503)]
+    assert events[-1] == {"event": "batch_completed", "total": 2, "completed": 0, "failed": 2, "cancelled": 0, "rejected": 0}
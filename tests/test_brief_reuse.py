@@ -0,0 +1,33 @@
+import numpy as np
+
+import backend_main as b
+
+
+def fake_embeddings(monkeypatch, similarities):
+    """Make the n-th calibration pair score similarities[n]"""
+    calls = []
+    
+    def embed_texts(texts):
+        calls.append(texts)
+        if len(calls) % 2:
+            return np.tile(np.array([1.0, 0.0], dtype=np.float32), (len(texts), 1))
+        return np.array([[sim, np.sqrt(1 - sim ** 2)] for sim in similarities], dtype=np.float32)
+    
+    monkeypatch.setattr(b, "embed_texts", embed_texts)
+
+
+def labelled(paraphrase, distinct):
+    return [paraphrase if same else distinct for _, _, same in b.BRIEF_CALIBRATION_PAIRS]
+
+
+def test_reuse_threshold_sits_between_distinct_and_paraphrased_briefs(monkeypatch):
+    fake_embeddings(monkeypatch, labelled(paraphrase=0.99, distinct=0.96))
+    
+    assert b.calibrate_reuse_threshold() == 0.975
+
+
+def test_reuse_is_disabled_when_distinct_briefs_score_like_paraphrases(monkeypatch):
+    fake_embeddings(monkeypatch, labelled(paraphrase=0.93, distinct=0.94))
+    
+    assert b.calibrate_reuse_threshold() is None
+
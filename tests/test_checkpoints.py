@@ -0,0 +1,57 @@
+import socket
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+import backend_main as b
+
+
+def make_store(tmp_path, lease_seconds=60):
+    return b.CheckpointStore(tmp_path / "checkpoints.sqlite", lease_seconds=lease_seconds)
+
+
+def start_run(store, campaign_id, owner=None, lease_offset=60):
+    request = b.CampaignRequest(campaign_brief="Spring sale", target_audience="shoppers", content_type="email")
+    store.begin(campaign_id, request, brand_version=1)
+    if owner is not None:
+        lease_until = (datetime.now() + timedelta(seconds=lease_offset)).isoformat()
+        store._db.execute(
+            "UPDATE campaign_runs SET owner = ?, lease_until = ? WHERE campaign_id = ?",
+            (owner, lease_until, campaign_id)
+        )
+        store._db.commit()
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_runs_of_live_workers_are_left_running(tmp_path):
+    store = make_store(tmp_path)
+    start_run(store, "mine")
+    start_run(store, "other-host", owner="elsewhere:123:abcd")
+    
+    assert store.mark_interrupted() == 0
+    assert store.run("mine")["status"] == "running"
+    assert store.run("other-host")["status"] == "running"
+
+
+def test_runs_of_dead_workers_are_interrupted(tmp_path):
+    store = make_store(tmp_path)
+    host = socket.gethostname()
+    start_run(store, "dead-pid", owner=f"{host}:{dead_pid()}:abcd")
+    start_run(store, "previous-boot", owner=f"{host}:{b.os.getpid()}:old")
+    start_run(store, "expired", owner="elsewhere:123:abcd", lease_offset=-1)
+    
+    assert store.mark_interrupted() == 3
+    assert {run["campaign_id"] for run in store.incomplete()} == {"dead-pid", "previous-boot", "expired"}
+
+
+def test_renewal_keeps_own_runs_leased(tmp_path):
+    store = make_store(tmp_path, lease_seconds=60)
+    start_run(store, "mine", owner=b.CHECKPOINT_OWNER, lease_offset=-1)
+    
+    assert store.renew_leases() == 1
+    assert store.run("mine")["lease_until"] > datetime.now().isoformat()
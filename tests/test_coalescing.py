@@ -0,0 +1,33 @@
+import backend_main as b
+
+BRAND = {"brand_id": "default", "brand_version": 1}
+
+
+def request(**overrides):
+    fields = {
+        "campaign_brief": "Announce the spring product line",
+        "target_audience": "Returning customers",
+        "content_type": "email",
+        **overrides
+    }
+    return b.CampaignRequest(**fields)
+
+
+def test_identical_requests_share_a_job():
+    manager = b.JobManager(max_workers=0, max_queue=10, history_limit=10)
+    
+    first = manager.submit(request(), brand_context=BRAND)
+    second = manager.submit(request(campaign_brief="  announce the SPRING product line"), brand_context=BRAND)
+    
+    assert second is first
+    assert first.requests == 2
+
+
+def test_cache_bypassing_requests_never_share_a_job():
+    manager = b.JobManager(max_workers=0, max_queue=10, history_limit=10)
+    
+    cached = manager.submit(request(), brand_context=BRAND)
+    fresh = manager.submit(request(bypass_cache=True), brand_context=BRAND)
+    fresh_again = manager.submit(request(bypass_cache=True), brand_context=BRAND)
+    
+    assert len({cached.job_id, fresh.job_id, fresh_again.job_id}) == 3
@@ -0,0 +1,33 @@
+import requests
+
+import backend_main as b
+
+
+def test_upstream_ollama_statuses_become_bad_gateway():
+    for status in (400, 404, 429, 503):
+        assert b.failure_status(b.OllamaServerError(status, "upstream")) == (502, None)
+    assert b.failure_status(requests.ConnectionError("refused")) == (502, None)
+
+
+def test_open_breaker_is_unavailable_with_retry_after():
+    assert b.failure_status(b.OllamaUnavailableError("down", retry_after=12)) == (503, 12)
+
+
+def test_app_errors_keep_their_status():
+    assert b.failure_status(b.ComplianceViolation("blocked")) == (422, None)
+    assert b.failure_status(RuntimeError("bug")) == (500, None)
+
+
+def failed_job(error, campaign_id="campaign_1"):
+    request = b.CampaignRequest(campaign_brief="Launch", target_audience="devs", content_type="email")
+    job = b.Job(request, resume_from=campaign_id)
+    job.error = str(error)
+    job.error_status, job.retry_after = b.failure_status(error)
+    return job
+
+
+def test_resume_hint_only_for_model_server_failures():
+    assert "/resume" in b.failure_detail(failed_job(b.OllamaServerError(500, "boom")))
+    assert "/resume" in b.failure_detail(failed_job(b.OllamaUnavailableError("down", retry_after=5)))
+    assert "/resume" not in b.failure_detail(failed_job(b.ComplianceViolation("blocked")))
+    assert "/resume" not in b.failure_detail(failed_job(b.BrandRuleViolation("off-brand")))
@@ -0,0 +1,75 @@
+import pytest
+from langchain_core.outputs import Generation
+
+import backend_main as b
+
+
+def llm_string(llm, stop=None):
+    """The key material LangChain's BaseLLM.generate hands to the cache"""
+    params = llm.dict()
+    params["stop"] = stop
+    return str(sorted(params.items()))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return b.TwoTierLLMCache(tmp_path / "llm_cache.sqlite", memory_entries=8, disk_entries=100, ttl=3600)
+
+
+def test_system_prompt_is_part_of_the_key(cache):
+    plain = b.get_llm("test-model")
+    prompted = b.get_llm("test-model", system="You are X")
+    cache.update("Write a tagline", llm_string(plain), [Generation(text="plain")])
+    
+    assert cache.lookup("Write a tagline", llm_string(prompted)) is None
+    assert cache.lookup("Write a tagline", llm_string(plain))[0].text == "plain"
+
+
+def test_model_and_sampling_options_are_part_of_the_key(cache):
+    base = b.pooled_ollama_class()(model="test-model", base_url=b.OLLAMA_BASE_URL)
+    other_model = b.pooled_ollama_class()(model="other-model", base_url=b.OLLAMA_BASE_URL)
+    warmer = b.pooled_ollama_class()(model="test-model", base_url=b.OLLAMA_BASE_URL, temperature=0.9)
+    cache.update("Write a tagline", llm_string(base), [Generation(text="base")])
+    
+    assert cache.lookup("Write a tagline", llm_string(other_model)) is None
+    assert cache.lookup("Write a tagline", llm_string(warmer)) is None
+    assert cache.lookup("  Write a tagline  \n", llm_string(base))[0].text == "base"
+
+
+def test_clients_without_an_identity_are_not_cached(cache):
+    cache.update("Write a tagline", "[('_type', 'ollama-llm'), ('stop', None)]", [Generation(text="x")])
+    
+    assert cache.lookup("Write a tagline", "[('_type', 'ollama-llm'), ('stop', None)]") is None
+    assert cache.stats()["disk_entries"] == 0
+
+
+def test_reuploaded_brand_guidelines_miss_the_cached_review(cache, tmp_path):
+    registry = b.BrandRegistry(tmp_path / "brands")
+    guidelines = b.BrandGuidelines(
+        brand_name="Acme", voice="friendly", tone="casual", values=["care"],
+        colors=["#000000"], prohibited_topics=["politics"], keywords=["acme"]
+    )
+    # Brand managers carry the brand block as their system prompt; the review prompt stays the same
+    review = "Review this draft for brand consistency:\nAcme makes mornings better."
+    
+    before = registry.publish("acme", guidelines)
+    first = b.get_llm(b.OLLAMA_MODEL, system=before.prefix)
+    cache.update(review, llm_string(first), [Generation(text="on brand")])
+    
+    after = registry.publish("acme", guidelines.model_copy(update={"voice": "formal"}))
+    second = b.get_llm(b.OLLAMA_MODEL, system=after.prefix)
+    
+    assert after.version == before.version + 1
+    assert cache.lookup(review, llm_string(second)) is None
+    assert cache.lookup(review, llm_string(first))[0].text == "on brand"
+
+
+def test_model_tiers_do_not_share_entries(cache):
+    # Both tiers may resolve to the same model; answers are still kept apart
+    large = b.get_llm("test-model", tier="large")
+    small = b.get_llm("test-model", tier="small")
+    cache.update("Write a tagline", llm_string(small), [Generation(text="small")])
+    
+    assert large is not small
+    assert cache.lookup("Write a tagline", llm_string(large)) is None
+    assert cache.lookup("Write a tagline", llm_string(small))[0].text == "small"
@@ -0,0 +1,12 @@
+import backend_main as b
+
+
+def test_llm_gate_wait_is_exported_per_priority():
+    gate = b.PriorityGate(limit=1)
+    gate.acquire("batch")
+    gate.release()
+    
+    rendered = b.metrics.render()
+    
+    assert 'copilot_llm_gate_wait_seconds_count{priority="batch"}' in rendered
+    assert "# TYPE copilot_job_queue_wait_seconds histogram" in rendered
@@ -0,0 +1,46 @@
+import time
+
+import backend_main as b
+
+
+def wait_for(warmup, state, timeout=5):
+    deadline = time.monotonic() + timeout
+    while warmup.snapshot()["state"] != state and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return warmup.snapshot()
+
+
+def flaky(failures: int):
+    calls = []
+    
+    def step():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise ConnectionError("Ollama is not up yet")
+    return step, calls
+
+
+def test_failed_required_steps_retry_with_backoff_until_ready():
+    llm, llm_calls = flaky(failures=2)
+    agents, agent_calls = flaky(failures=0)
+    warmup = b.Warmup([("agents", agents, True), ("llm", llm, True)], retry_backoff=0.01, retry_max_delay=0.05)
+    
+    warmup.start()
+    status = wait_for(warmup, "ready")
+    
+    assert status["state"] == "ready"
+    assert status["attempts"] == 3
+    assert len(llm_calls) == 3
+    assert len(agent_calls) == 1  # only failed steps are retried
+
+
+def test_retry_now_skips_the_backoff():
+    llm, llm_calls = flaky(failures=1)
+    warmup = b.Warmup([("llm", llm, True)], retry_backoff=60, retry_max_delay=60)
+    
+    warmup.start()
+    assert wait_for(warmup, "failed")["next_retry_at"] is not None
+    warmup.retry_now()
+    
+    assert wait_for(warmup, "ready")["state"] == "ready"
+    assert len(llm_calls) == 2